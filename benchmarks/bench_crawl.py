@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+End-to-end benchmark of the spiders and of WeiboSpiderRunner.crawl against the mock weibo.cn of mock_weibo.py,
+reporting pages/s, items/s, cpu time per page and peak rss of every run. With --archive the pages of every spider
+run are archived and parsed again by a replay of the archive, which shows the cost of the extraction alone. With
+--proxies the spiders go through mock proxies of mock_proxy.py, given as latency:error_rate.
+
+    python benchmarks/bench_crawl.py --pages 10 --latency 0.05 --concurrency 50 --download-delay 0
+    python benchmarks/bench_crawl.py --pages 30 --workers 0 --archive --replay-workers 4
+    python benchmarks/bench_crawl.py --pages 10 --workers 0 --proxies 0.01:0,0.2:0,0:1
+"""
+import os
+import sys
+import csv
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from mock_weibo import MockWeibo, make_server
+from mock_proxy import MockProxy, make_proxy
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def count_rows(files):
+    num_rows = 0
+    for file in files:
+        with open(file, 'r', encoding='utf-8-sig', newline='') as f:
+            num_rows += max(sum([1 for _ in csv.reader(f)]) - 1, 0)
+    return num_rows
+
+
+def patch_settings(spider_dir, args, mock_url, proxy_urls=()):
+    with open(os.path.join(spider_dir, 'cookies.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(['SUB=benchmark{:d}\n'.format(i) for i in range(args.cookies)])
+    with open(os.path.join(spider_dir, 'ips.txt'), 'w', encoding='utf-8') as f:
+        f.writelines([proxy_url + '\n' for proxy_url in proxy_urls] or ['default\n'])
+    with open(os.path.join(spider_dir, 'settings.py'), 'a', encoding='utf-8') as f:
+        f.write('\n# benchmark against the mock weibo.cn\n')
+        f.write('MOCK_SITE_URL = {!r}\n'.format(mock_url))
+        f.write("DOWNLOADER_MIDDLEWARES['middlewares.MockSiteMiddleware'] = 50\n")
+        f.write('CONCURRENT_REQUESTS = {:d}\n'.format(args.concurrency))
+        f.write('DOWNLOAD_DELAY = {!r}\n'.format(args.download_delay))
+        f.write('AUTOTHROTTLE_ENABLED = {!r}\n'.format(args.autothrottle))
+        f.write('HTTPCACHE_ENABLED = {!r}\n'.format(args.http_cache))
+        f.write('ARCHIVE_ENABLED = {!r}\n'.format(args.archive))
+        f.write('PROXIES_PROBE_URL = {!r}\n'.format(mock_url + '/u/1'))
+        f.write('PROXIES_PROBE_INTERVAL = 5\n')
+        f.write('LOG_LEVEL = "WARNING"\n')
+
+
+def run(cmds, cwd, mock):
+    """Run a command and return its wall time, cpu time and peak rss, including the processes it waited for."""
+    mock.reset()
+    time_start = time.time()
+    process = subprocess.Popen(cmds, cwd=cwd, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = status
+    wall_time = time.time() - time_start
+    return wall_time, usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024, mock.requests, mock.throttled
+
+
+def report(name, result, num_items):
+    wall_time, cpu_time, peak_rss, num_pages, num_throttled = result
+    print("{:s}: {:d} pages ({:d} throttled), {:d} items in {:.1f}s: {:.1f} pages/s, {:.1f} items/s, "
+          "{:.1f}ms cpu/page, peak rss {:.0f}MB".format(
+              name, num_pages, num_throttled, num_items, wall_time, num_pages / wall_time, num_items / wall_time,
+              1000 * cpu_time / max(num_pages, 1), peak_rss))
+
+
+def bench_spiders(args, mock, mock_url, work_dir, proxy_urls):
+    spider_dir = os.path.join(work_dir, 'weibospider_0')
+    shutil.copytree(os.path.join(ROOT_DIR, 'weibospider'), spider_dir)
+    patch_settings(spider_dir, args, mock_url, proxy_urls)
+    temp_dir = os.path.join(spider_dir, 'temp')
+    run_spider = [sys.executable, os.path.join(spider_dir, 'run_spider.py')]
+
+    def bench(name, cmds, files):
+        result = run(cmds, spider_dir, mock)
+        report(name, result, count_rows(files()))
+        if args.archive:
+            # the pages archived by the run are parsed again without requesting the mock
+            replay_result = run(cmds + ['--replay', '--workers', str(args.replay_workers)], spider_dir, mock)
+            report(name + ' replay', replay_result[:3] + (result[3], 0), count_rows(files()))
+
+    bench('TweetSpider', run_spider + ['--mode', 'tweet', '--keywords', args.keywords, '--date-start', args.date_start,
+                                       '--date-end', args.date_end, '--min-like-num', str(args.min_like_num)],
+          lambda: [os.path.join(temp_dir, 'tweets.csv')])
+
+    # every run of a spider truncates the csv files of the others, so the ids are read first
+    tweet_ids = []
+    user_ids = []
+    with open(os.path.join(temp_dir, 'tweets.csv'), 'r', encoding='utf-8-sig', newline='') as f:
+        for i, row in enumerate(csv.reader(f)):
+            if i > 0:
+                tweet_ids.append(row[2])
+                if '/u/' + row[1] not in user_ids:
+                    user_ids.append('/u/' + row[1])
+    tweet_ids_file = os.path.join(work_dir, 'tweet_ids.txt')
+    with open(tweet_ids_file, 'w', encoding='utf-8') as f:
+        f.writelines([tweet_id + '\n' for tweet_id in tweet_ids[:args.tweets]])
+    bench('CommentSpider', run_spider + ['--mode', 'comment', '--tweet-ids', tweet_ids_file],
+          lambda: glob.glob(os.path.join(temp_dir, 'comments', '*.csv')))
+
+    user_ids_file = os.path.join(work_dir, 'user_ids.txt')
+    with open(user_ids_file, 'w', encoding='utf-8') as f:
+        f.writelines([user_id + '\n' for user_id in user_ids[:args.users]])
+    bench('UserSpider', run_spider + ['--mode', 'user', '--user-ids', user_ids_file],
+          lambda: [os.path.join(temp_dir, 'users.csv')])
+
+
+def bench_runner(args, mock, mock_url, work_dir, proxy_urls):
+    project_dir = os.path.join(work_dir, 'project')
+    os.makedirs(project_dir)
+    shutil.copy(os.path.join(ROOT_DIR, 'main.py'), project_dir)
+    for name in ['utils', 'weibospider', 'settings']:
+        shutil.copytree(os.path.join(ROOT_DIR, name), os.path.join(project_dir, name))
+    patch_settings(os.path.join(project_dir, 'weibospider'), args, mock_url, proxy_urls)
+    shutil.copy(os.path.join(project_dir, 'weibospider', 'cookies.txt'), os.path.join(project_dir, 'settings'))
+    shutil.copy(os.path.join(project_dir, 'weibospider', 'ips.txt'), os.path.join(project_dir, 'settings'))
+
+    code = ('import main\n'
+            'runner = main.WeiboSpiderRunner({!r}, {!r}, {!r}, min_like_num={:d}, max_workers={:d}, '
+            'days_per_worker={:d}, pipeline={!r})\n'
+            'runner.crawl()\n').format(args.keywords, args.date_start, args.date_end, args.min_like_num, args.workers,
+                                       args.days_per_worker, args.pipeline)
+    result = run([sys.executable, '-c', code], project_dir, mock)
+    source_dir = os.path.join(project_dir, 'data', 'source')
+    num_items = count_rows(glob.glob(os.path.join(source_dir, '*', 'tweets.csv')) +
+                           glob.glob(os.path.join(source_dir, '*', 'comments', '*.csv')) +
+                           [os.path.join(source_dir, 'users.csv')])
+    report('WeiboSpiderRunner.crawl', result, num_items)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawl benchmark')
+    parser.add_argument('--pages', type=int, default=5, help='pages of every list of the mock')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--throttle', type=float, default=0.0, help='requests per second of a cookie')
+    parser.add_argument('--cookies', type=int, default=1, help='cookies of the cookie pool')
+    parser.add_argument('--keywords', type=str, default='隐私')
+    parser.add_argument('--date-start', type=str, default='2020-01-01')
+    parser.add_argument('--date-end', type=str, default='2020-01-02')
+    parser.add_argument('--min-like-num', type=int, default=0)
+    parser.add_argument('--tweets', type=int, default=50, help='tweets for CommentSpider')
+    parser.add_argument('--users', type=int, default=50, help='users for UserSpider')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--download-delay', type=float, default=0.0)
+    parser.add_argument('--autothrottle', action='store_true')
+    parser.add_argument('--http-cache', action='store_true', help='keep the http cache of the spiders enabled')
+    parser.add_argument('--archive', action='store_true', help='archive the pages and replay every spider run')
+    parser.add_argument('--replay-workers', type=int, default=0, help='processes of a replay, all the cores by default')
+    parser.add_argument('--workers', type=int, default=2, help='workers of WeiboSpiderRunner.crawl, 0 to skip it')
+    parser.add_argument('--days-per-worker', type=int, default=1)
+    parser.add_argument('--pipeline', action='store_true')
+    parser.add_argument('--proxies', type=str, default='', help='latency:error_rate of the mock proxies, comma separated')
+    args = parser.parse_args()
+
+    mock = MockWeibo(pages=args.pages, latency=args.latency, throttle=args.throttle)
+    server = make_server(mock)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    mock_url = 'http://127.0.0.1:{:d}'.format(server.server_address[1])
+    proxies = []
+    for proxy_args in [proxy_args for proxy_args in args.proxies.split(',') if proxy_args]:
+        latency, error_rate = proxy_args.split(':')
+        proxy = MockProxy(float(latency), float(error_rate))
+        proxy_server = make_proxy(proxy)
+        threading.Thread(target=proxy_server.serve_forever, daemon=True).start()
+        proxies.append((proxy_args, proxy, proxy_server))
+    proxy_urls = ['127.0.0.1:{:d}'.format(proxy_server.server_address[1]) for _, _, proxy_server in proxies]
+
+    work_dir = tempfile.mkdtemp(prefix='bench_crawl_')
+    try:
+        bench_spiders(args, mock, mock_url, work_dir, proxy_urls)
+        if args.workers > 0:
+            bench_runner(args, mock, mock_url, work_dir, proxy_urls)
+        for proxy_args, proxy, _ in proxies:
+            print("proxy {:s}: {:d} requests, {:d} errors".format(proxy_args, proxy.requests, proxy.errors))
+    finally:
+        server.shutdown()
+        for _, _, proxy_server in proxies:
+            proxy_server.shutdown()
+        shutil.rmtree(work_dir)
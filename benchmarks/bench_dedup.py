@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark of the near-duplicate check of WeiboSpiderRunner.postprocess_topics on synthetic comments,
+the difflib scan over all kept contents against NearDuplicateIndex.
+
+    python benchmarks/bench_dedup.py --texts 5000 --index-texts 50000
+"""
+import os
+import sys
+import time
+import random
+import difflib
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils.dedup import NearDuplicateIndex
+
+
+def make_texts(num_texts, dup_ratio, edit_ratio):
+    random.seed(0)
+    # a skewed distribution over common chinese characters, like real comments
+    chars = [chr(code) for code in range(0x4e00, 0x4e00 + 3000)]
+    weights = [1.0 / (i + 1) for i in range(len(chars))]
+    texts = []
+    for i in range(num_texts):
+        if len(texts) > 0 and random.random() < dup_ratio:
+            text = list(random.choice(texts))
+            for _ in range(int(len(text) * random.uniform(0, edit_ratio))):
+                j = random.randrange(len(text))
+                op = random.random()
+                if op < 0.4:
+                    text[j] = random.choices(chars, weights)[0]
+                elif op < 0.7:
+                    text.insert(j, random.choices(chars, weights)[0])
+                elif len(text) > 5:
+                    del text[j]
+            texts.append(''.join(text))
+        else:
+            texts.append(''.join(random.choices(chars, weights, k=random.randint(5, 120))))
+    return texts
+
+
+def difflib_dedup(texts, threshold):
+    contents = []
+    flags = []
+    for text in texts:
+        duplicate = any([difflib.SequenceMatcher(None, text, content).quick_ratio() > threshold
+                         for content in contents])
+        flags.append(duplicate)
+        if not duplicate:
+            contents.append(text)
+    return flags
+
+
+def index_dedup(texts, threshold):
+    index = NearDuplicateIndex(threshold=threshold)
+    return [not index.add_unique(text) for text in texts]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Near-duplicate benchmark')
+    parser.add_argument('--texts', type=int, default=5000, help='texts for the comparison with difflib')
+    parser.add_argument('--index-texts', type=int, default=50000, help='texts for the index alone, 0 to skip')
+    parser.add_argument('--dup-ratio', type=float, default=0.3)
+    parser.add_argument('--edit-ratio', type=float, default=0.4)
+    parser.add_argument('--threshold', type=float, default=0.7)
+    args = parser.parse_args()
+
+    texts = make_texts(args.texts, args.dup_ratio, args.edit_ratio)
+    time_start = time.time()
+    difflib_flags = difflib_dedup(texts, args.threshold)
+    difflib_time = time.time() - time_start
+    time_start = time.time()
+    index_flags = index_dedup(texts, args.threshold)
+    index_time = time.time() - time_start
+    num_duplicates = sum(difflib_flags)
+    num_found = sum([a and b for a, b in zip(difflib_flags, index_flags)])
+    num_extra = sum([b and not a for a, b in zip(difflib_flags, index_flags)])
+    print("{:d} texts, {:d} duplicates: difflib {:.2f}s, index {:.2f}s, recall {:.4f}, extra duplicates {:d}".format(
+        args.texts, num_duplicates, difflib_time, index_time, num_found / max(num_duplicates, 1), num_extra))
+
+    if args.index_texts > 0:
+        texts = make_texts(args.index_texts, args.dup_ratio, args.edit_ratio)
+        time_start = time.time()
+        index_flags = index_dedup(texts, args.threshold)
+        index_time = time.time() - time_start
+        print("{:d} texts: index {:.2f}s ({:.0f} texts/s), {:d} duplicates".format(
+            args.index_texts, index_time, args.index_texts / index_time, sum(index_flags)))
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Micro-benchmark of the field extraction of TweetSpider.parse and CommentSpider.parse on fixture pages of the mock
+weibo.cn, the ad-hoc xpaths compiled for every node against the precompiled ones of spiders/xpaths.py, and of the
+content extraction of spiders/utils.py, etree.tostring plus regexes against the walk of the tree.
+
+    python benchmarks/bench_extract.py --pages 200 --repeat 3
+"""
+import os
+import re
+import sys
+import time
+import tracemalloc
+import argparse
+from lxml import etree
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'weibospider'))
+from mock_weibo import MockWeibo
+from spiders.xpaths import TWEET_NODES, COMMENT_NODES, CT_NODES, NODE_STRING, NODE_ID, CT_TEXTS, LINK_HREFS, \
+    LIKE_TEXTS, REPOST_NODES, tweet_links, num
+from spiders.utils import extract_weibo_content, extract_comment_content, extract_repost_content
+
+keyword_re = re.compile('<span class="kt">|</span>|原图|<!-- 是否进行翻译 -->|<span class="cmt">|\\[组图共.+张\\]')
+emoji_re = re.compile('<img alt="|" src="//h5\\.sinaimg(.*?)/>')
+white_space_re = re.compile('<br />')
+div_re = re.compile('</div>|<div>')
+image_re = re.compile('<img(.*?)/>')
+url_re = re.compile('<a href=(.*?)>|</a>')
+
+
+def adhoc_tweet(tweet_node):
+    repost_url = tweet_node.xpath('.//a[contains(text(),"转发[")]/@href')[0]
+    images = tweet_node.xpath('.//img[@alt="图片"]/@src')
+    videos = tweet_node.xpath('.//a[contains(@href,"https://m.weibo.cn/s/video/show?object_id=")]/@href')
+    web_urls = tweet_node.xpath('.//a[contains(@href,"https://weibo.cn/sinaurl?f=w&u=")]/@href')
+    origins = tweet_node.xpath('.//a[contains(text(),"原文评论[")]/@href')
+    all_content = tweet_node.xpath('.//a[text()="全文" and contains(@href,"ckAll=1")]')
+    return (
+        re.search(r'/repost/(.*?)\?uid=(\d+)', repost_url).groups(),
+        tweet_node.xpath('.//span[@class="ct"]')[-1].xpath('string(.)'),
+        int(re.search(r'\d+', tweet_node.xpath('.//a[contains(text(),"赞[")]/text()')[-1]).group()),
+        int(re.search(r'\d+', tweet_node.xpath('.//a[contains(text(),"转发[")]/text()')[-1]).group()),
+        int(re.search(r'\d+', tweet_node.xpath(
+            './/a[contains(text(),"评论[") and not(contains(text(),"原文"))]/text()')[-1]).group()),
+        images[0] if images else None,
+        videos[0] if videos else None,
+        web_urls[0] if web_urls else None,
+        origins[0] if origins else None,
+        all_content[0].xpath('./@href')[0] if all_content else None,
+    )
+
+
+def compiled_tweet(tweet_node):
+    links = tweet_links(tweet_node)
+    return (
+        re.search(r'/repost/(.*?)\?uid=(\d+)', links['repost_url']).groups(),
+        NODE_STRING(CT_NODES(tweet_node)[-1]),
+        num(links['like']),
+        num(links['repost']),
+        num(links['comment']),
+        links['image'],
+        links['video'],
+        links['web'],
+        links['origin'],
+        links['all_content'],
+    )
+
+
+def adhoc_comment(comment_node):
+    return (
+        comment_node.xpath('.//a[contains(@href,"/")]/@href')[0],
+        comment_node.xpath('./@id')[0],
+        comment_node.xpath('.//span[@class="ct"]/text()')[0],
+        int(re.search(r'\d+', comment_node.xpath('.//a[contains(text(),"赞[")]/text()')[-1]).group()),
+    )
+
+
+def compiled_comment(comment_node):
+    return (
+        LINK_HREFS(comment_node)[0],
+        NODE_ID(comment_node)[0],
+        CT_TEXTS(comment_node)[0],
+        num(LIKE_TEXTS(comment_node)[-1]),
+    )
+
+
+def regex_weibo_content(weibo_node):
+    s = etree.tostring(weibo_node, encoding='unicode')
+    if 'class="ctt">' in s:
+        s = s.split('class="ctt">', maxsplit=1)[1]
+    s = emoji_re.sub('', s)
+    s = url_re.sub('', s)
+    s = div_re.sub('', s)
+    s = image_re.sub('', s)
+    if '<span class="ct">' in s:
+        s = s.split('<span class="ct">')[0]
+    splits = s.split('赞[')
+    if len(splits) == 2:
+        s = splits[0]
+    try:
+        if len(splits) == 3:
+            origin_text = splits[0]
+            retweet_text = splits[1].split('转发理由:')[1]
+            s = origin_text + '转发理由:' + retweet_text
+    except:
+        s = splits[0]
+    s = white_space_re.sub(' ', s)
+    s = keyword_re.sub('', s)
+    s = s.replace('\xa0', '')
+    s = s.strip(':')
+    s = s.strip()
+    return s
+
+
+def regex_comment_content(comment_node):
+    s = etree.tostring(comment_node, encoding='unicode')
+    if 'class="ctt">' in s:
+        s = s.split('class="ctt">', maxsplit=1)[1]
+    s = s.split('举报', maxsplit=1)[0]
+    s = emoji_re.sub('', s)
+    s = keyword_re.sub('', s)
+    s = url_re.sub('', s)
+    s = div_re.sub('', s)
+    s = image_re.sub('', s)
+    s = white_space_re.sub(' ', s)
+    s = s.replace('\xa0', '')
+    s = s.strip(':')
+    s = s.strip()
+    return s
+
+
+def regex_repost_content(repost_node):
+    s = etree.tostring(repost_node, encoding='unicode')
+    if 'class="cc">' in s:
+        s = s.split('<span class="cc">', maxsplit=1)[0]
+    s = emoji_re.sub('', s)
+    s = keyword_re.sub('', s)
+    s = url_re.sub('', s)
+    s = div_re.sub('', s)
+    s = image_re.sub('', s)
+    s = white_space_re.sub(' ', s)
+    s = s.replace('\xa0', '')
+    s = s.replace('<div class="c">', '')
+    s = s.strip(':')
+    s = s.strip()
+    return s
+
+
+def allocated(nodes, extract):
+    # the mean peak of the memory allocated while extracting a node
+    peak_sum = 0
+    tracemalloc.start()
+    for node in nodes:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        extract(node)
+        peak_sum += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return peak_sum / max(len(nodes), 1)
+
+
+def bench(nodes, extract, repeat):
+    # the pages are parsed beforehand, the parse is the same for both ways
+    best = None
+    for _ in range(repeat):
+        time_start = time.time()
+        results = [extract(node) for node in nodes]
+        elapsed = time.time() - time_start
+        best = elapsed if best is None else min(best, elapsed)
+    return results, best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extraction benchmark')
+    parser.add_argument('--pages', type=int, default=200, help='fixture pages of each kind')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    mock = MockWeibo(pages=args.pages)
+    fixtures = {
+        'tweet': [mock.render('/search/mblog?keyword=隐私&starttime=20200101&page={:d}'.format(page)).encode('utf-8')
+                  for page in range(1, args.pages + 1)],
+        'comment': [mock.render('/comment/hot/M{:08d}?page={:d}'.format(page, page)).encode('utf-8')
+                    for page in range(1, args.pages + 1)],
+        'repost': [mock.render('/repost/M{:08d}?page={:d}'.format(page, page)).encode('utf-8')
+                   for page in range(1, args.pages + 1)],
+    }
+    # the trees are kept alive by their nodes
+    nodes = {kind: [node for page in pages for node in select(etree.HTML(page))] for kind, pages, select in [
+        ('tweet', fixtures['tweet'], TWEET_NODES),
+        ('comment', fixtures['comment'], COMMENT_NODES),
+        ('repost', fixtures['repost'], REPOST_NODES),
+    ]}
+    cases = [
+        ('tweet', adhoc_tweet, compiled_tweet),
+        ('comment', adhoc_comment, compiled_comment),
+    ]
+    for name, adhoc, compiled in cases:
+        adhoc_results, adhoc_time = bench(nodes[name], adhoc, args.repeat)
+        compiled_results, compiled_time = bench(nodes[name], compiled, args.repeat)
+        num_nodes = len(nodes[name])
+        print("{:s}: {:d} nodes, ad-hoc xpaths {:.0f} nodes/s, precompiled {:.0f} nodes/s ({:.1f}x), "
+              "same fields: {}".format(name, num_nodes, num_nodes / adhoc_time, num_nodes / compiled_time,
+                                       adhoc_time / compiled_time, adhoc_results == compiled_results))
+
+    cases = [
+        ('tweet', regex_weibo_content, extract_weibo_content),
+        ('comment', regex_comment_content, extract_comment_content),
+        ('repost', regex_repost_content, extract_repost_content),
+    ]
+    for name, regex, walk in cases:
+        regex_results, regex_time = bench(nodes[name], regex, args.repeat)
+        walk_results, walk_time = bench(nodes[name], walk, args.repeat)
+        num_nodes = len(nodes[name])
+        print("{:s} content: {:d} nodes, tostring+regex {:.0f} nodes/s {:.0f}B/node, tree {:.0f} nodes/s {:.0f}B/node "
+              "({:.1f}x), same content: {}".format(
+                  name, num_nodes, num_nodes / regex_time, allocated(nodes[name], regex), num_nodes / walk_time,
+                  allocated(nodes[name], walk), regex_time / walk_time, regex_results == walk_results))
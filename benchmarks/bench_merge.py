@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark of the tweets merge of WeiboSpiderRunner.postprocess_tasks on synthetic worker csv files, with
+--records the files are in the typed format of the records and are merged as TweetRecords.
+
+    python benchmarks/bench_merge.py --rows 1000000 --files 24 [--records]
+"""
+import os
+import sys
+import csv
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils.merge import merge_csv
+from weibospider.records import TweetRecord
+
+TWEETS_HEAD = ['weibo_url', 'user_id', '_id', 'created_at', 'tool', 'like_num', 'repost_num', 'comment_num',
+               'image_url', 'video_url', 'web_url', 'origin_weibo', 'content']
+
+
+def make_inputs(file_dir, num_rows, num_files, dup_ratio, records=False):
+    random.seed(0)
+    num_ids = max(1, int(num_rows * (1 - dup_ratio)))
+    files = [os.path.join(file_dir, 'tweets_{:d}.csv'.format(i)) for i in range(num_files)]
+    writers = []
+    for file in files:
+        f = open(file, 'w', encoding='utf-8-sig', newline='')
+        writer = csv.writer(f, dialect='excel')
+        writer.writerow(TWEETS_HEAD)
+        writers.append((f, writer))
+    for i in range(num_rows):
+        tweet_id = 'J{:08d}'.format(i if i < num_ids else random.randrange(num_ids))
+        user_id = random.randrange(10 ** 9)
+        if records:
+            row = ['https://weibo.com/{:d}/{:s}'.format(user_id, tweet_id), user_id, tweet_id, 1581227100,
+                   'iPhone客户端', random.randrange(1000), random.randrange(100), random.randrange(100),
+                   None, None, None, None, '微博内容' * random.randrange(1, 20)]
+        else:
+            row = ['=HYPERLINK("https://weibo.com/{:d}/{:s}")'.format(user_id, tweet_id), '/u/{:d}'.format(user_id),
+                   tweet_id, '2020-02-09 13:45', 'iPhone客户端', random.randrange(1000), random.randrange(100),
+                   random.randrange(100), 'Unknown', 'Unknown', 'Unknown', 'Unknown', '微博内容' * random.randrange(1, 20)]
+        writers[i % num_files][1].writerow(row)
+    for f, _ in writers:
+        f.close()
+    return files
+
+
+def legacy_merge(files, out_file):
+    tweet_ids = []
+    tweets = []
+    tweets_head = None
+    for file in files:
+        with open(file, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            for j, row in enumerate(reader):
+                if tweets_head is None and j == 0:
+                    tweets_head = row
+                if j == 0:
+                    continue
+                tweet_id = row[2]
+                if tweet_id not in tweet_ids:
+                    tweet_ids.append(tweet_id)
+                    tweets.append(row)
+    tweets.sort(key=lambda x: (int(x[5]), int(x[6]), int(x[7])), reverse=True)
+    with open(out_file, 'w', encoding='utf-8-sig', newline='') as f:
+        tweets_writer = csv.writer(f, dialect='excel')
+        tweets_writer.writerow(tweets_head)
+        for tweet in tweets:
+            tweets_writer.writerow(tweet)
+    return len(tweets)
+
+
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge benchmark')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--files', type=int, default=24)
+    parser.add_argument('--dup-ratio', type=float, default=0.1)
+    parser.add_argument('--chunk-size', type=int, default=200000)
+    parser.add_argument('--legacy-rows', type=int, default=20000, help='rows for the list based merge, 0 to skip')
+    parser.add_argument('--records', action='store_true', help='merge typed files as records')
+    args = parser.parse_args()
+
+    file_dir = tempfile.mkdtemp(prefix='bench_merge_')
+    try:
+        if args.legacy_rows > 0:
+            files = make_inputs(file_dir, args.legacy_rows, args.files, args.dup_ratio)
+            time_start = time.time()
+            num_rows = legacy_merge(files, os.path.join(file_dir, 'legacy.csv'))
+            legacy_time = time.time() - time_start
+            time_start = time.time()
+            merge_csv(files, os.path.join(file_dir, 'merged.csv'), 2,
+                      sort_key=lambda x: (int(x[5]), int(x[6]), int(x[7])), reverse=True)
+            merge_time = time.time() - time_start
+            print("{:d} rows -> {:d} tweets: list merge {:.2f}s, merge_csv {:.2f}s".format(
+                args.legacy_rows, num_rows, legacy_time, merge_time))
+
+        files = make_inputs(file_dir, args.rows, args.files, args.dup_ratio, args.records)
+        time_start = time.time()
+        if args.records:
+            num_rows = merge_csv(files, os.path.join(file_dir, 'merged.csv'), 2,
+                                 sort_key=TweetRecord.counters, reverse=True,
+                                 chunk_size=args.chunk_size, record=TweetRecord)
+        else:
+            num_rows = merge_csv(files, os.path.join(file_dir, 'merged.csv'), 2,
+                                 sort_key=lambda x: (int(x[5]), int(x[6]), int(x[7])), reverse=True,
+                                 chunk_size=args.chunk_size)
+        merge_time = time.time() - time_start
+        print("{:d} rows -> {:d} tweets: merge_csv {:.2f}s ({:.0f} rows/s), peak rss {:.0f}MB".format(
+            args.rows, num_rows, merge_time, args.rows / merge_time, peak_rss()))
+    finally:
+        shutil.rmtree(file_dir)
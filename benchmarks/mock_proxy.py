@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+A local mock of an http proxy for the proxy pool of IPProxyMiddleware: it forwards the plain http requests it is
+sent, like those to the mock weibo.cn of mock_weibo.py, with a configurable latency and error rate (responses with
+status 502, like a proxy that lost its upstream).
+
+    python benchmarks/mock_proxy.py --port 8901 --latency 0.2 --error-rate 0.1
+
+The spiders are sent through it by a line 127.0.0.1:8901 in weibospider/ips.txt.
+"""
+import time
+import random
+import argparse
+import threading
+import http.client
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+
+class MockProxy(object):
+    """The behaviour and counters of a mock proxy, shared by its handler threads."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+
+    def is_error(self):
+        with self.lock:
+            self.requests += 1
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+
+def make_proxy(proxy, port=0):
+    """Return an http server for the mock proxy, port 0 picks a free port (server.server_address[1])."""
+
+    class ProxyHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if proxy.latency:
+                time.sleep(proxy.latency)
+            if proxy.is_error():
+                self.respond(502, [], b'')
+                return
+            # a proxy is sent the absolute url of the page
+            url = urlparse(self.path)
+            headers = {name: value for name, value in self.headers.items()
+                       if name.lower() not in ['host', 'proxy-connection', 'proxy-authorization', 'connection']}
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            try:
+                conn.request('GET', url.path + ('?' + url.query if url.query else ''), headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except OSError:
+                self.respond(502, [], b'')
+                return
+            finally:
+                conn.close()
+            self.respond(response.status, [(name, value) for name, value in response.getheaders()
+                                           if name.lower() not in ['content-length', 'connection', 'transfer-encoding',
+                                                                   'server', 'date']], body)
+
+        def respond(self, status, headers, body):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class ThreadingServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    return ThreadingServer(('127.0.0.1', port), ProxyHandler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock http proxy')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of the requests answered with 502')
+    args = parser.parse_args()
+
+    server = make_proxy(MockProxy(args.latency, args.error_rate), args.port)
+    print("Mock proxy is serving on http://127.0.0.1:{:d} ...".format(server.server_address[1]))
+    server.serve_forever()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+A local mock of the weibo.cn pages crawled by the spiders: search, comment, full content, profile, info, fans and
+repost pages. The pages are synthetic but deterministic for a url, with a configurable latency, pagination depth
+and throttling (responses with status 418 above a request rate of a cookie, like weibo.cn does when a cookie is
+banned). The cookies in logged_out are redirected to the login page.
+
+    python benchmarks/mock_weibo.py --port 8900 --pages 20 --latency 0.05
+
+The spiders are sent to it by setting MOCK_SITE_URL = 'http://127.0.0.1:8900' in weibospider/settings.py.
+"""
+import re
+import time
+import random
+import hashlib
+import argparse
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+WORDS = ['隐私', '数据', '用户', '保护', '泄露', '手机', '应用', '权限', '信息', '安全', '平台', '隐私政策', '个人',
+         '今天', '我们', '大家', '支持', '问题', '网络', '公司', '法律', '规定', '哈哈', '希望', '注意']
+
+
+class MockWeibo(object):
+    """The page generator and counters of the mock server, shared by its handler threads."""
+
+    def __init__(self, pages=10, latency=0.0, throttle=0.0, items_per_page=10, full_content_ratio=0.1, seed=0):
+        self.pages = pages
+        self.latency = latency
+        self.throttle = throttle
+        self.items_per_page = items_per_page
+        self.full_content_ratio = full_content_ratio
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.windows = {}
+        self.logged_out = set()
+        self.routes = [
+            (re.compile(r'^/search/mblog$'), self.search_page),
+            (re.compile(r'^/comment/hot/(\w+)$'), self.comment_page),
+            (re.compile(r'^/comment/(\w+)$'), self.full_content_page),
+            (re.compile(r'^/repost/(\w+)$'), self.repost_page),
+            (re.compile(r'^/(\d+)/info$'), self.info_page),
+            (re.compile(r'^/(\d+)/fans$'), self.fans_page),
+            (re.compile(r'^/(\d+)/follow$'), self.fans_page),
+            (re.compile(r'^/u/(\d+)$'), self.profile_page),
+            (re.compile(r'^/(\w+)$'), self.profile_page),
+        ]
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.throttled = 0
+
+    def is_throttled(self, cookie=''):
+        with self.lock:
+            self.requests += 1
+            if not self.throttle:
+                return False
+            # the rate is counted per cookie, like the limits of the accounts of weibo.cn
+            second = int(time.time())
+            start, count = self.windows.get(cookie, (0, 0))
+            self.windows[cookie] = (second, count + 1) if second == start else (second, 1)
+            if self.windows[cookie][1] > self.throttle:
+                self.throttled += 1
+                return True
+            return False
+
+    def random(self, *keys):
+        return random.Random(hashlib.md5(repr((self.seed,) + keys).encode('utf-8')).hexdigest())
+
+    def user_id(self, rand):
+        return str(rand.randrange(10 ** 9, 7 * 10 ** 9))
+
+    def text(self, rand, low=5, high=40):
+        return ''.join([rand.choice(WORDS) for _ in range(rand.randint(low, high))])
+
+    def page(self, body, page, pages):
+        # the page list of weibo.cn, the spiders read the number of pages from the first one
+        page_list = ''
+        if pages > 1:
+            page_list = ('<div class="pa" id="pagelist"><form action="" method="post"><div><a href="?page={:d}">'
+                         '下页</a>&nbsp;<input name="mp" type="hidden" value="{:d}" /><input type="text" name="page" '
+                         'size="2" style="-wap-input-format: \'*N\'" /><input type="submit" value="跳页" />&nbsp;'
+                         '{:d}/{:d}页</div></form></div>').format(page + 1, pages, page, pages)
+        return ('<?xml version="1.0" encoding="UTF-8"?><!DOCTYPE html><html><head><meta http-equiv="Content-Type" '
+                'content="text/html; charset=utf-8" /><title>微博</title></head><body>'
+                '<div class="n" style="padding: 6px 4px;"><a href="https://weibo.cn/?tf=5_009" class="nl">首页</a>'
+                '</div>' + body + page_list + '<div class="pm"></div></body></html>')
+
+    def search_page(self, match, query):
+        keyword = query.get('keyword', [''])[0]
+        start_time = query.get('starttime', ['20200101'])[0]
+        page = int(query.get('page', ['1'])[0])
+        date = start_time.split('-')[0]
+        date = '{:s}-{:s}-{:s}'.format(date[:4], date[4:6], date[6:8])
+        # an hour window holds a part of the tweets of its day
+        pages = self.pages if '-' not in start_time else max(1, self.pages // 24)
+        tweets = []
+        for i in range(self.items_per_page):
+            rand = self.random('tweet', keyword, start_time, page, i)
+            tweet_id = 'M' + hashlib.md5(repr((keyword, start_time, page, i)).encode('utf-8')).hexdigest()[:8]
+            user_id = self.user_id(rand)
+            content = self.text(rand)
+            if rand.random() < 0.2:
+                content += ('<img alt="[笑cry]" src="//h5.sinaimg.cn/m/emoticon/icon/default/d_xiaoku-f2bd11b506.png" '
+                            'style="width:1em; height:1em;" />')
+            if rand.random() < 0.05:
+                content += ('<a href="https://m.weibo.cn/s/video/show?object_id=1034:{:s}">{:s}的微博视频</a>').format(
+                    tweet_id, '用户' + user_id)
+            if rand.random() < 0.05:
+                content += ('<a href="https://weibo.cn/sinaurl?f=w&amp;u=http%3A%2F%2Ft.cn%2F{:s}&amp;ep={:s}">网页链接'
+                            '</a>').format(tweet_id, tweet_id)
+            if rand.random() < self.full_content_ratio:
+                content += '<a href="/comment/{:s}?ckAll=1">全文</a>'.format(tweet_id)
+            images = ''
+            if rand.random() < 0.3:
+                images = ('<div><a href="https://weibo.cn/mblog/pic/{0:s}?rl=0"><img src="http://wx1.sinaimg.cn/'
+                          'wap180/{0:s}.jpg" alt="图片" class="ib" /></a></div>').format(tweet_id)
+            counters = ('<a href="https://weibo.cn/attitude/{tid:s}/add?uid={uid:s}&amp;rl=0">赞[{like:d}]</a>&nbsp;'
+                        '<a href="https://weibo.cn/repost/{tid:s}?uid={uid:s}&amp;rl=0">转发[{repost:d}]</a>&nbsp;'
+                        '<a href="https://weibo.cn/comment/{tid:s}?uid={uid:s}&amp;rl=0#cmtfrm" class="cc">'
+                        '评论[{comment:d}]</a>&nbsp;<a href="https://weibo.cn/fav/addFav/{tid:s}?rl=0">收藏</a>&nbsp;'
+                        '<span class="ct">{date:s} {hour:02d}:{minute:02d}:00&nbsp;来自iPhone客户端</span>').format(
+                tid=tweet_id, uid=user_id, like=rand.randrange(1000), repost=rand.randrange(100),
+                comment=rand.randrange(100), date=date, hour=rand.randrange(24), minute=rand.randrange(60))
+            if rand.random() < 0.2:
+                # a repost shows the origin tweet with its counters first, then the reason and the own counters
+                origin_id = 'O' + tweet_id[1:]
+                origin_user_id = self.user_id(rand)
+                tweets.append(
+                    '<div class="c" id="M_{tid:s}"><div><a class="nk" href="https://weibo.cn/u/{uid:s}">用户{uid:s}</a>'
+                    '<span class="cmt">转发了&nbsp;<a href="https://weibo.cn/u/{ouid:s}">用户{ouid:s}</a>&nbsp;的微博:'
+                    '</span><span class="ctt">{content:s}{keyword:s}</span>&nbsp;</div>{images:s}<div>'
+                    '<span class="cmt">赞[{olike:d}]</span>&nbsp;<span class="cmt">原文转发[{orepost:d}]</span>&nbsp;'
+                    '<a href="https://weibo.cn/comment/{oid:s}?rl=1#cmtfrm" class="cc">原文评论[{ocomment:d}]</a>'
+                    '<!-- 是否进行翻译 --></div><div><span class="cmt">转发理由:</span>{reason:s}&nbsp;&nbsp;{counters:s}'
+                    '</div></div><div class="s"></div>'.format(
+                        tid=tweet_id, uid=user_id, ouid=origin_user_id, oid=origin_id, content=content,
+                        keyword=keyword, images=images, olike=rand.randrange(10000), orepost=rand.randrange(1000),
+                        ocomment=rand.randrange(1000), reason=self.text(rand, 1, 10), counters=counters))
+            else:
+                tweets.append(
+                    '<div class="c" id="M_{tid:s}"><div><a class="nk" href="https://weibo.cn/u/{uid:s}">用户{uid:s}</a>'
+                    '<span class="ctt">:{content:s}{keyword:s}</span>&nbsp;</div>{images:s}<div>{counters:s}</div>'
+                    '</div><div class="s"></div>'.format(
+                        tid=tweet_id, uid=user_id, content=content, keyword=keyword, images=images, counters=counters))
+        return self.page(''.join(tweets), page, pages)
+
+    def full_content_page(self, match, query):
+        tweet_id = match.group(1)
+        rand = self.random('full', tweet_id)
+        user_id = self.user_id(rand)
+        body = ('<div class="c" id="M_"><div><a href="/u/{0:s}">用户{0:s}</a>:<span class="ctt">{1:s}</span></div>'
+                '<div><span class="ct">2020-01-01 10:00:00&nbsp;来自网页</span></div></div>').format(
+                    user_id, self.text(rand, 100, 300))
+        return self.page(body, 1, 1)
+
+    def comment_page(self, match, query):
+        tweet_id = match.group(1)
+        page = int(query.get('page', ['1'])[0])
+        comments = []
+        for i in range(self.items_per_page):
+            rand = self.random('comment', tweet_id, page, i)
+            user_id = self.user_id(rand)
+            content = self.text(rand)
+            if rand.random() < 0.3:
+                content += ('<img alt="[doge]" src="//h5.sinaimg.cn/m/emoticon/icon/others/d_doge-be7f768d78.png" '
+                            'style="width:1em; height:1em;" />')
+            if rand.random() < 0.2:
+                content = '回复<a href="/n/用户{0:s}">@用户{0:s}</a>:{1:s}'.format(self.user_id(rand), content)
+            comments.append(
+                '<div class="c" id="C_{cid:d}"><a href="/u/{uid:s}">用户{uid:s}</a>:<span class="ctt">{content:s}'
+                '</span>&nbsp;<a href="/spam/?cid={cid:d}&amp;type=2">举报</a>&nbsp;<span class="cc">'
+                '<a href="/attitude/{cid:d}/add?uid={uid:s}">赞[{like:d}]</a></span>&nbsp;<span class="cc">'
+                '<a href="/comment/reply/{cid:d}">回复</a></span>&nbsp;<span class="ct">2020-01-02 '
+                '{hour:02d}:{minute:02d}&nbsp;来自网页</span></div>'.format(
+                    cid=rand.randrange(10 ** 15, 10 ** 16), uid=user_id, content=content,
+                    like=rand.randrange(100), hour=rand.randrange(24), minute=rand.randrange(60)))
+        return self.page(''.join(comments), page, self.pages)
+
+    def repost_page(self, match, query):
+        tweet_id = match.group(1)
+        page = int(query.get('page', ['1'])[0])
+        reposts = ['<div class="c" id="M_{:s}"><div>原微博</div></div>'.format(tweet_id)]
+        # newest first over the day, a repost is reposted from the tweet or from an older repost of the list
+        num_reposts = self.pages * self.items_per_page
+        for i in range(self.items_per_page):
+            rand = self.random('repost', tweet_id, page, i)
+            user_id = self.user_id(rand)
+            position = (page - 1) * self.items_per_page + i
+            minutes = (num_reposts - position) * 1440 // (num_reposts + 1)
+            chain = ''
+            if position + 1 < num_reposts and rand.random() < 0.7:
+                parent = rand.randrange(position + 1, num_reposts)
+                parent_id = self.user_id(self.random('repost', tweet_id, parent // self.items_per_page + 1,
+                                                     parent % self.items_per_page))
+                chain = '//<a href="/n/用户{0:s}">@用户{0:s}</a>:{1:s}'.format(parent_id, self.text(rand, 1, 5))
+            reposts.append(
+                '<div class="c"><a href="/u/{uid:s}">用户{uid:s}</a>:{content:s}{chain:s}&nbsp;<span class="cc">'
+                '<a href="/attitude/{tid:s}/add">赞[0]</a></span>&nbsp;<span class="ct">&nbsp;2020-01-02 '
+                '{hour:02d}:{minute:02d}&nbsp;来自iPhone客户端</span></div>'.format(
+                    uid=user_id, content=self.text(rand), chain=chain, tid=tweet_id, hour=minutes // 60,
+                    minute=minutes % 60))
+        return self.page(''.join(reposts), page, self.pages)
+
+    def profile_page(self, match, query):
+        name = match.group(1)
+        rand = self.random('user', name)
+        user_id = name if name.isdigit() else self.user_id(rand)
+        body = ('<div class="u"><table><tr><td><a href="/{0:s}/avatar?rl=0"><img src="http://tvax1.sinaimg.cn/'
+                'crop/{0:s}.jpg" alt="头像" /></a></td><td><div class="ut"><span class="ctt">用户{0:s}&nbsp;</span>'
+                '<a href="/{0:s}/info">资料</a>&nbsp;<a href="/{0:s}/operation?rl=0">操作</a></div></td></tr>'
+                '</table><div class="tip2"><span class="tc">微博[{1:d}]</span>&nbsp;<a href="/{0:s}/follow">'
+                '关注[{2:d}]</a>&nbsp;<a href="/{0:s}/fans">粉丝[{3:d}]</a></div></div>').format(
+                    user_id, rand.randrange(10000), rand.randrange(2000), rand.randrange(10 ** 6))
+        return self.page(body, 1, 1)
+
+    def info_page(self, match, query):
+        user_id = match.group(1)
+        rand = self.random('info', user_id)
+        body = ('<div class="tip">基本信息</div><div class="c">昵称:用户{0:s}<br />认证:{1:s}<br />性别:{2:s}<br />'
+                '地区:{3:s}<br />生日:{4:d}-{5:02d}-{6:02d}<br />简介:{7:s}<br />标签:<a href="/search/?keyword=a">'
+                '{8:s}</a>&nbsp;<a href="/search/?keyword=b">{9:s}</a>&nbsp;<a href="/account/privacy/tags/">'
+                '更多&gt;&gt;</a><br /></div><div class="tip">其他信息</div><div class="c">会员等级：{10:d}级&nbsp;'
+                '</div>').format(
+                    user_id, rand.choice(['无', '知名博主']), rand.choice(['男', '女']),
+                    rand.choice(['北京 海淀', '上海', '广东 深圳']), rand.randrange(1970, 2005), rand.randrange(1, 13),
+                    rand.randrange(1, 29), self.text(rand, 2, 10), rand.choice(WORDS), rand.choice(WORDS),
+                    rand.randrange(1, 7))
+        return self.page(body, 1, 1)
+
+    def fans_page(self, match, query):
+        user_id = match.group(1)
+        page = int(query.get('page', ['1'])[0])
+        rows = []
+        for i in range(self.items_per_page):
+            rand = self.random('fans', user_id, page, i)
+            fan_id = self.user_id(rand)
+            rows.append('<table><tr><td valign="top"><a href="https://weibo.cn/u/{0:s}">用户{0:s}</a><br />粉丝{1:d}人'
+                        '<br /><a href="https://weibo.cn/attention/add?uid={0:s}&amp;rl=1&amp;st=abc">关注他</a>'
+                        '</td></tr></table>'.format(fan_id, rand.randrange(10000)))
+        return self.page('<div class="c">' + ''.join(rows) + '</div>', page, self.pages)
+
+    def render(self, path):
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        for pattern, route in self.routes:
+            match = pattern.match(url.path)
+            if match:
+                return route(match, query)
+        return None
+
+
+def make_server(mock, port=0):
+    """Return an http server for the mock, port 0 picks a free port (server.server_address[1])."""
+
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if mock.latency:
+                time.sleep(mock.latency)
+            cookie = self.headers.get('Cookie', '')
+            if cookie in mock.logged_out:
+                mock.is_throttled(cookie)
+                self.respond(302, '', {'Location': 'https://passport.weibo.cn/signin/login'})
+                return
+            if mock.is_throttled(cookie):
+                self.respond(418, '')
+                return
+            body = mock.render(self.path)
+            if body is None:
+                self.respond(404, '')
+                return
+            self.respond(200, body)
+
+        def respond(self, status, body, headers=None):
+            body = body.encode('utf-8')
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class ThreadingServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    return ThreadingServer(('127.0.0.1', port), MockHandler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock weibo.cn server')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--pages', type=int, default=10, help='pages of every search, comment, fans and repost list')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before every response')
+    parser.add_argument('--throttle', type=float, default=0.0, help='requests per second of a cookie above which 418 is returned')
+    parser.add_argument('--items-per-page', type=int, default=10)
+    args = parser.parse_args()
+
+    server = make_server(MockWeibo(args.pages, args.latency, args.throttle, args.items_per_page), args.port)
+    print("Mock weibo.cn is serving on http://127.0.0.1:{:d} ...".format(server.server_address[1]))
+    server.serve_forever()
@@ -5,20 +5,34 @@ import sys
 import csv
 import math
 import time
+import json
 import shutil
-import difflib
+import socket
+import hashlib
 import argparse
 import datetime
+import tempfile
 import subprocess
 from concurrent.futures import ProcessPoolExecutor
 from utils import extract_comment_content
 from utils.analyzer import DataAnalyzer
+from utils.dedup import NearDuplicateIndex
+from utils.merge import iter_csv, merge_csv, merge_lines
+from utils.metrics import MetricsRollup
+from utils.store import ResultStore
+from utils.task_queue import TaskQueue
+from weibospider.ledger import CrawlLedger
+from weibospider.records import TweetRecord, CommentRecord, UserRecord, format_time, parse_int, parse_time, to_epoch, \
+    unlink
+from weibospider.user_cache import UserCache
 
 
 class WeiboSpiderRunner(object):
     def __init__(self, keywords, date_start, date_end, min_like_num=0,
                  min_repost_num=0, min_comment_num=0, file_dir='./data', run_dir='./temp',
-                 max_workers=4, days_per_worker=10, num_topics=10, max_iter=1000, num_top_words=20):
+                 max_workers=4, days_per_worker=10, num_topics=10, max_iter=1000, num_top_words=20, resume=False,
+                 incremental=False, pipeline=False, users_per_task=1000, role='all', worker_offset=0,
+                 lease_time=600, user_info_ttl=30, user_counters_ttl=7, max_comment_requests=0, max_comment_pages=0):
 
         self.keywords = keywords.split(',')
         self.date_start = date_start
@@ -27,17 +41,40 @@ class WeiboSpiderRunner(object):
         self.min_like_num = min_like_num
         self.min_repost_num = min_repost_num
         self.min_comment_num = min_comment_num
+        self.max_comment_requests = max_comment_requests
+        self.max_comment_pages = max_comment_pages
         self.file_dir = file_dir
         self.run_dir = run_dir
         self.source_dir = os.path.join(self.file_dir, 'source')
         self.result_dir = os.path.join(self.file_dir, 'result')
+        self.store_dir = os.path.join(self.file_dir, 'store')
+        self.excel_dir = os.path.join(self.file_dir, 'excel')
         self.max_workers = max_workers
         self.num_workers = max_workers
         self.num_topics = num_topics
         self.max_iter = max_iter
         self.num_top_words = num_top_words
         self.task_kwargs = []
-        self.data_analyzer = DataAnalyzer(self.result_dir, self.num_topics, self.max_iter, self.num_top_words)
+        self.resume = resume
+        self.incremental = incremental
+        # coordinator and worker roles share one frontier in run_dir, which then has to be on shared storage
+        self.role = role
+        self.pipeline = pipeline or role != 'all'
+        self.users_per_task = users_per_task
+        self.worker_offset = worker_offset
+        self.lease_time = lease_time
+        # seconds between the polls of an idle pipeline worker for the tasks fed by the running ones
+        self.min_idle_wait = 0.2
+        self.max_idle_wait = 5.0
+        self.marks_file = os.path.join(self.source_dir, 'marks.json')
+        self.task_queue = TaskQueue(os.path.join(self.run_dir, 'tasks.db'))
+        self.ledger = CrawlLedger(os.path.join(self.run_dir, 'ledger.db'))
+        self.result_store = ResultStore(self.store_dir)
+        # the users crawled within the ttls (in days) of the previous runs are not crawled again
+        self.user_cache = UserCache(os.path.join(self.source_dir, 'users.db'), user_info_ttl * 24 * 3600,
+                                    user_counters_ttl * 24 * 3600)
+        self.data_analyzer = DataAnalyzer(self.result_dir, self.num_topics, self.max_iter, self.num_top_words,
+                                          'settings/my_dict.txt', 'settings/stop_words.txt')
 
         if not os.path.exists(self.file_dir):
             os.makedirs(self.file_dir)
@@ -46,17 +83,19 @@ class WeiboSpiderRunner(object):
         if not os.path.exists(self.result_dir):
             os.makedirs(self.result_dir)
 
-        shutil.copy('settings/ips.txt', 'weibospider/ips.txt')
-        shutil.copy('settings/cookies.txt', 'weibospider/cookies.txt')
-        shutil.copy('settings/stop_words.txt', 'utils/data/stop_words.txt')
-        shutil.copy('settings/my_dict.txt', 'utils/data/my_dict.txt')
-
     def split_tasks(self):
         task_kwargs = []
+        marks = self.load_marks() if self.incremental else {}
         for keyword in self.keywords:
-            if self.date_start and self.date_end:
-                date_start_all = datetime.datetime.strptime(self.date_start, '%Y-%m-%d')
-                date_end_all = datetime.datetime.strptime(self.date_end, '%Y-%m-%d')
+            keyword_date_start, keyword_date_end = self.date_start, self.date_end
+            if keyword in marks:
+                # only crawl from the day of the latest tweet seen by the previous runs
+                keyword_date_start = marks[keyword]['created_at'][:10]
+                if not keyword_date_end:
+                    keyword_date_end = datetime.datetime.now().strftime('%Y-%m-%d')
+            if keyword_date_start and keyword_date_end:
+                date_start_all = datetime.datetime.strptime(keyword_date_start, '%Y-%m-%d')
+                date_end_all = datetime.datetime.strptime(keyword_date_end, '%Y-%m-%d')
                 date_start = date_start_all
                 while date_start <= date_end_all:
                     date_end = date_start + self.time_spread - datetime.timedelta(days=1)
@@ -68,77 +107,273 @@ class WeiboSpiderRunner(object):
                         task_name, '--keywords', keyword, '--date-start', date_start.strftime("%Y-%m-%d"),
                         '--date-end', date_end.strftime("%Y-%m-%d"), '--min-like-num', str(self.min_like_num),
                         '--min-repost-num', str(self.min_repost_num), '--min-comment-num', str(self.min_comment_num),
-                    ])
+                    ] + self.comment_budget_args())
                     date_start = date_start + self.time_spread
             else:
                 task_name = keyword
                 task_kwargs.append([
                     task_name, '--keywords', keyword, '--min-like-num', str(self.min_like_num),
                     '--min-repost-num', str(self.min_repost_num), '--min-comment-num', str(self.min_comment_num),
-                ])
+                ] + self.comment_budget_args())
 
-        tasks_per_worker = int(math.ceil(len(task_kwargs) / self.max_workers))
-        self.num_workers = int(math.ceil(len(task_kwargs) / tasks_per_worker))
-        self.task_kwargs = []
-        for worker_id in range(self.num_workers):
-            run_dir = os.path.join(self.run_dir, 'weibospider_' + str(worker_id))
-            cmds = [sys.executable, os.path.join(run_dir, 'run_weibo_spider.py')]
-            args = []
-            for kwargs in task_kwargs[worker_id * tasks_per_worker: (worker_id + 1) * tasks_per_worker]:
-                args.append(
-                    kwargs[1:] + ['--file-dir', os.path.join(run_dir, 'data', kwargs[0])]
-                )
-            self.task_kwargs.append((cmds, args))
+        task_kwargs = [kwargs for kwargs in task_kwargs if not self.ledger.is_done('task', kwargs[0])]
+        self.task_queue.reset()
+        for kwargs in task_kwargs:
+            if self.pipeline:
+                self.task_queue.put(kwargs[0], kwargs[1:] + ['--stage', 'tweets'], stage='tweet')
+            else:
+                self.task_queue.put(kwargs[0], kwargs[1:])
+        self.num_workers = min(self.max_workers, len(task_kwargs))
+
+    def load_marks(self):
+        if not os.path.exists(self.marks_file):
+            return {}
+        with open(self.marks_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def update_marks(self, keyword, tweets_files):
+        # the high-water mark of a keyword is its latest created_at and the _id of that tweet
+        marks = self.load_marks()
+        mark = marks.get(keyword)
+        mark_time = to_epoch(mark['created_at']) if mark is not None else None
+        for head, row in iter_csv(tweets_files):
+            created_at = parse_time(row[3])
+            if created_at is not None and (mark_time is None or created_at > mark_time):
+                mark = {'created_at': format_time(created_at), '_id': row[2]}
+                mark_time = created_at
+        if mark is None:
+            return
+        marks[keyword] = mark
+        with open(self.marks_file, 'w', encoding='utf-8') as f:
+            json.dump(marks, f, ensure_ascii=False, indent=2)
+
+    def comment_budget_args(self):
+        # CommentSpider crawls the tweets by their comment priority within the budget of every comment crawl
+        return ['--max-comment-requests', str(self.max_comment_requests),
+                '--max-comment-pages', str(self.max_comment_pages)]
+
+    def shared_args(self):
+        # the http cache and the page archive are kept next to the user cache, run_dir is removed after every run,
+        # and the cookie and proxy pools of the workers read settings/cookies.txt and settings/ips.txt themselves, the
+        # cookies are reloaded when the file is edited. The paths are those of the checkout of the worker, so they
+        # are added by the worker that runs a task, not put in the queue
+        return ['--http-cache-dir', os.path.realpath(os.path.join(self.source_dir, 'httpcache')),
+                '--archive-dir', os.path.realpath(os.path.join(self.source_dir, 'archive')),
+                '--cookies-file', os.path.realpath('settings/cookies.txt'),
+                '--proxies-file', os.path.realpath('settings/ips.txt')]
+
+    def user_cache_args(self):
+        # UserSpider requests only the pages of the expired fields of the cached users and updates the cache
+        return ['--user-cache', os.path.realpath(self.user_cache.db_file),
+                '--user-info-ttl', str(self.user_cache.info_ttl / (24 * 3600)),
+                '--user-counters-ttl', str(self.user_cache.counters_ttl / (24 * 3600))]
 
     def split_users(self):
-        user_ids = []
-        users_file = os.path.join(self.source_dir, 'users.txt')
-        with open(users_file, 'r', encoding='utf-8-sig', newline='') as f:
-            lines = f.readlines()
-            lines = [line.strip() for line in lines]
-            for i, line in enumerate(lines):
-                if i % 1000 == 0:
-                    print(i)
-                if line not in user_ids:
-                    user_ids.append(line)
+        user_ids = merge_lines([os.path.join(self.source_dir, 'users.txt')])
+        num_users = len(user_ids)
+        user_ids = self.user_cache.stale(user_ids)
+        print("{:d} of {:d} users are fresh in the user cache.".format(num_users - len(user_ids), num_users))
+        if len(user_ids) == 0:
+            self.num_workers = 0
+            self.task_kwargs = []
+            return
         users_per_worker = int(math.ceil(len(user_ids) / self.max_workers))
         self.num_workers = int(math.ceil(len(user_ids) / users_per_worker))
         self.task_kwargs = []
         for worker_id in range(self.num_workers):
             run_dir = os.path.join(self.run_dir, 'weibospider_' + str(worker_id))
-            file_dir = os.path.join(run_dir, 'data')
-            if not os.path.exists(file_dir):
-                os.makedirs(file_dir)
-
-            user_id = user_ids[worker_id * users_per_worker: (worker_id + 1) * users_per_worker]
-            users_file = os.path.join(file_dir, 'users.txt')
-            with open(users_file, 'w', encoding='utf-8-sig', newline='') as f:
-                f.writelines([line + '\n' for line in user_id])
+            # the slices are cut from the stale users, which change between resumed runs, so they are named by the
+            # users they hold rather than by the worker
+            task_name, users_file = self.write_users_file(
+                user_ids[worker_id * users_per_worker: (worker_id + 1) * users_per_worker])
             self.task_kwargs.append(
-                [sys.executable, os.path.join(run_dir, 'run_spider.py'),
-                 '--mode', 'user', '--user-ids', users_file]
+                [task_name, sys.executable, os.path.join(run_dir, 'run_spider.py'),
+                 '--mode', 'user', '--user-ids', users_file] + self.user_cache_args() + self.shared_args()
             )
 
+    def write_users_file(self, user_ids):
+        task_name = 'users_' + hashlib.md5('\n'.join(user_ids).encode('utf-8')).hexdigest()[:12]
+        users_dir = os.path.join(self.run_dir, 'users')
+        if not os.path.exists(users_dir):
+            os.makedirs(users_dir)
+        users_file = os.path.join(users_dir, task_name + '.txt')
+        with open(users_file, 'w', encoding='utf-8-sig', newline='') as f:
+            f.writelines([line + '\n' for line in user_ids])
+        return task_name, users_file
+
     def run_weibo_spider_single(self, worker_id):
         time.sleep(worker_id)
-        cmds, kwargs = self.task_kwargs[worker_id]
-        for args in kwargs:
-            task_name = os.path.basename(os.path.realpath(args[-1]))
-            print("Runing weibo spider for task {:s} ...".format(task_name))
-            subprocess.run(cmds + args)
-            print("Weibo spider running for task {:s} is finished!".format(task_name))
+        run_dir = os.path.join(self.run_dir, 'weibospider_' + str(worker_id))
+        cmds = [sys.executable, os.path.join(run_dir, 'run_weibo_spider.py')]
+        while True:
+            task = self.task_queue.get(worker_id)
+            if task is None:
+                break
+            task_name, args, _ = task
+            time_start = time.time()
+            print("Runing weibo spider for task {:s} on worker {:d} ...".format(task_name, worker_id))
+            file_dir = os.path.join(run_dir, 'data', task_name)
+            result = subprocess.run(cmds + args + self.shared_args() + ['--file-dir', file_dir, '--ledger',
+                                                                        self.ledger.db_file])
+            if result.returncode == 0:
+                self.ledger.mark_done('task', task_name, file_dir)
+                self.task_queue.done(task_name, worker_id)
+            else:
+                self.task_queue.nack(task_name, worker_id)
+            print("Weibo spider running for task {:s} is finished in {:.1f}s!".format(task_name,
+                                                                                      time.time() - time_start))
         return
 
-    def postprocess_users_single(self, worker_id):
+    def put_comments_task(self, task_name, file_dir, keyword):
+        tweets = [TweetRecord.from_row(row) for head, row in iter_csv([os.path.join(file_dir, keyword, 'tweets.csv')])]
+        if len(tweets) == 0:
+            return
+        # the comments stage keeps this order
+        tweets.sort(key=lambda tweet: tweet.comment_priority(), reverse=True)
+        tweet_ids = [tweet._id for tweet in tweets]
+        tweet_ids_dir = os.path.join(self.run_dir, 'comments')
+        if not os.path.exists(tweet_ids_dir):
+            os.makedirs(tweet_ids_dir)
+        tweet_ids_file = os.path.join(tweet_ids_dir, task_name + '.txt')
+        with open(tweet_ids_file, 'w', encoding='utf-8-sig', newline='') as f:
+            f.writelines([line + '\n' for line in tweet_ids])
+        self.task_queue.put(task_name + '_comments', ['--keywords', keyword, '--stage', 'comments',
+                                                      '--tweet-ids', tweet_ids_file] + self.comment_budget_args(),
+                            stage='comment')
+
+    def put_users_tasks(self, force=False):
+        num_tasks = 0
+        batch_size = self.users_per_task
+        if force:
+            # the users left at the end are spread over the workers instead of going to one of them
+            batch_size = max(1, min(batch_size, int(math.ceil(self.task_queue.count_items('user') / self.max_workers))))
+        while True:
+            user_ids = self.task_queue.take_items('user', batch_size, force)
+            if len(user_ids) == 0:
+                return num_tasks
+            task_name, users_file = self.write_users_file(user_ids)
+            self.task_queue.put(task_name, ['--mode', 'user', '--user-ids', users_file], stage='user')
+            num_tasks += 1
+
+    def seed_pipeline(self):
+        # requeue the comment and user work left behind by the units an interrupted run has finished
+        for task_name, _ in self.ledger.units('users'):
+            users_file = os.path.join(self.run_dir, 'users', task_name + '.txt')
+            self.task_queue.add_items('user', merge_lines([users_file]), batched=True)
+        for task_name, file_dir in self.ledger.units('task'):
+            if not task_name.endswith('_comments') and not self.ledger.is_done('task', task_name + '_comments'):
+                self.put_comments_task(task_name, file_dir, task_name.split('_')[0])
+            self.task_queue.add_items('user',
+                                      self.user_cache.stale(merge_lines([os.path.join(file_dir, 'users.txt')])))
+        self.put_users_tasks()
+
+    def run_leased(self, cmds, task_name, worker_name):
+        # keep renewing the lease of the task while its spider is running
+        process = subprocess.Popen(cmds)
+        while True:
+            try:
+                return process.wait(timeout=self.lease_time / 3)
+            except subprocess.TimeoutExpired:
+                self.task_queue.renew(task_name, worker_name, self.lease_time)
+
+    def run_pipeline_single(self, worker_id):
         time.sleep(worker_id)
-        print("Crawling users for worker {:d} ...".format(worker_id))
+        # the worker index picks the first cookie and proxy of the pools in middlewares.py
+        worker_id = self.worker_offset + worker_id
+        worker_name = socket.gethostname() + '_' + str(worker_id)
+        run_dir = os.path.join(self.run_dir, 'weibospider_' + str(worker_id))
+        idle_wait = self.min_idle_wait
+        while True:
+            task = self.task_queue.get(worker_name, lease=self.lease_time)
+            if task is None:
+                # once no tweet or comment task is left to feed users, the last ones are batched at once
+                if self.task_queue.count('running', ['tweet', 'comment']) == 0 and \
+                        self.put_users_tasks(force=True) > 0:
+                    continue
+                if self.task_queue.count('running') > 0:
+                    # the running tasks can still feed new comment and user tasks, the polls back off while none come
+                    time.sleep(idle_wait)
+                    idle_wait = min(2 * idle_wait, self.max_idle_wait)
+                    continue
+                break
+            idle_wait = self.min_idle_wait
+            task_name, args, stage = task
+            time_start = time.time()
+            print("Runing {:s} task {:s} on worker {:s} ...".format(stage, task_name, worker_name))
+            file_dir = os.path.join(run_dir, 'data', task_name)
+            if stage == 'user':
+                self.remove_users_file(run_dir)
+                returncode = self.run_leased([sys.executable, os.path.join(run_dir, 'run_spider.py')] + args +
+                                             self.user_cache_args() + self.shared_args(), task_name, worker_name)
+                users_file = self.copy_users_file(run_dir, file_dir, returncode)
+                if users_file is not None:
+                    self.ledger.mark_done('users', task_name, users_file)
+                elif returncode == 0:
+                    # a spider that wrote no users.csv has failed all the same
+                    returncode = 1
+            else:
+                returncode = self.run_leased([sys.executable, os.path.join(run_dir, 'run_weibo_spider.py')] + args +
+                                             self.shared_args() + ['--file-dir', file_dir, '--ledger',
+                                                                   self.ledger.db_file], task_name, worker_name)
+                if returncode == 0:
+                    self.ledger.mark_done('task', task_name, file_dir)
+                # feed the next stages before the task is marked as done, so idle workers keep waiting for them, the
+                # comments only once the tweets are complete, a failed tweet task feeds them when it is tried again
+                if stage == 'tweet' and returncode == 0:
+                    self.put_comments_task(task_name, file_dir, args[args.index('--keywords') + 1])
+                self.task_queue.add_items('user',
+                                          self.user_cache.stale(merge_lines([os.path.join(file_dir, 'users.txt')])))
+                self.put_users_tasks()
+            if returncode == 0:
+                self.task_queue.ack(task_name, worker_name)
+            else:
+                # the task goes back to the frontier for another try
+                self.task_queue.nack(task_name, worker_name)
+            print("{:s} task {:s} is finished in {:.1f}s!".format(stage, task_name, time.time() - time_start))
+        return
+
+    def run_pipeline_workers(self):
+        if self.max_workers == 0:
+            return
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self.run_pipeline_single, range(self.max_workers)))
+
+    def postprocess_users_single(self, worker_id):
         run_dir = os.path.join(self.run_dir, 'weibospider_' + str(worker_id))
-        file_dir = os.path.join(run_dir, 'data')
-        subprocess.run(self.task_kwargs[worker_id])
-        shutil.copy(os.path.join(run_dir, 'temp', 'users.csv'), file_dir)
-        print("Users crawling for worker {:d} is finished!".format(worker_id))
+        task_name, cmds = self.task_kwargs[worker_id][0], self.task_kwargs[worker_id][1:]
+        file_dir = os.path.join(run_dir, 'data', task_name)
+        if self.ledger.is_done('users', task_name):
+            print("Users of task {:s} are already crawled!".format(task_name))
+            return
+        time.sleep(worker_id)
+        print("Crawling users of task {:s} on worker {:d} ...".format(task_name, worker_id))
+        self.remove_users_file(run_dir)
+        result = subprocess.run(cmds)
+        users_file = self.copy_users_file(run_dir, file_dir, result.returncode)
+        if users_file is not None:
+            self.ledger.mark_done('users', task_name, users_file)
+        print("Users crawling of task {:s} on worker {:d} is finished!".format(task_name, worker_id))
         return
 
+    @staticmethod
+    def remove_users_file(run_dir):
+        # the users.csv left by the previous task of the worker, or the sample one of the repo
+        users_file = os.path.join(run_dir, 'temp', 'users.csv')
+        if os.path.exists(users_file):
+            os.remove(users_file)
+
+    @staticmethod
+    def copy_users_file(run_dir, file_dir, returncode):
+        # only the users.csv of a user spider that finished is taken into the task output
+        users_file = os.path.join(run_dir, 'temp', 'users.csv')
+        if returncode != 0 or not os.path.exists(users_file):
+            print("The user spider in {:s} failed with exit code {:d}!".format(run_dir, returncode))
+            return None
+        if not os.path.exists(file_dir):
+            os.makedirs(file_dir)
+        shutil.copy(users_file, file_dir)
+        return os.path.join(file_dir, 'users.csv')
+
     def postprocess_tasks(self):
         print("Postprocessing the crawled data from all tasks ...")
         data_dict = {
@@ -150,21 +385,19 @@ class WeiboSpiderRunner(object):
             },
             'users': [],
         }
-        for worker_id, (cmds, kwargs) in enumerate(self.task_kwargs):
-            run_dir = os.path.join(self.run_dir, 'weibospider_' + str(worker_id))
-            for args in kwargs:
-                task_name = os.path.basename(os.path.realpath(args[-1]))
-                file_dir = os.path.join(run_dir, 'data', task_name)
-                data_dict['users'].append(os.path.join(file_dir, 'users.txt'))
-
-                keyword = task_name.split('_')[0]
-                if keyword not in data_dict['keywords']:
-                    data_dict['keywords'][keyword] = {'tweets': [], 'comments': []}
-                tweets_dir = os.path.join(file_dir, keyword)
-                data_dict['keywords'][keyword]['tweets'].append(os.path.join(tweets_dir, 'tweets.csv'))
-                comments_dir = os.path.join(tweets_dir, 'comments')
-                data_dict['keywords'][keyword]['comments'].extend([os.path.join(comments_dir, file)
-                                                                   for file in os.listdir(comments_dir)])
+        for task_name, file_dir in self.ledger.units('task'):
+            data_dict['users'].append(os.path.join(file_dir, 'users.txt'))
+
+            keyword = task_name.split('_')[0]
+            if keyword not in data_dict['keywords']:
+                data_dict['keywords'][keyword] = {'tweets': [], 'comments': []}
+            tweets_dir = os.path.join(file_dir, keyword)
+            data_dict['keywords'][keyword]['tweets'].append(os.path.join(tweets_dir, 'tweets.csv'))
+            comments_dir = os.path.join(tweets_dir, 'comments')
+            if not os.path.exists(comments_dir):
+                continue
+            data_dict['keywords'][keyword]['comments'].extend([os.path.join(comments_dir, file)
+                                                               for file in os.listdir(comments_dir)])
 
         for keyword, data in data_dict['keywords'].items():
             tweets_dir = os.path.join(self.source_dir, keyword)
@@ -175,31 +408,14 @@ class WeiboSpiderRunner(object):
                 os.makedirs(comments_dir)
 
             print("Postprocessing the crawled tweets from all tasks for keyword {:s} ...".format(keyword))
-            tweet_ids = []
-            tweets = []
-            tweets_head = None
-            for i, file in enumerate(data['tweets']):
-                if not os.path.exists(file):
-                    continue
-                with open(file, 'r', encoding='utf-8-sig', newline='') as f:
-                    reader = csv.reader(f)
-                    for j, row in enumerate(reader):
-                        if tweets_head is None and j == 0:
-                            tweets_head = row
-                        if j == 0:
-                            continue
-                        tweet_id = row[2]
-                        if tweet_id not in tweet_ids:
-                            tweet_ids.append(tweet_id)
-                            tweets.append(row)
-            if len(tweets) > 0:
-                tweets.sort(key=lambda x: (int(x[5]), int(x[6]), int(x[7])), reverse=True)
-                tweets_file = os.path.join(tweets_dir, 'tweets.csv')
-                with open(tweets_file, 'w', encoding='utf-8-sig', newline='') as f:
-                    tweets_writer = csv.writer(f, dialect='excel')
-                    tweets_writer.writerow(tweets_head)
-                    for tweet in tweets:
-                        tweets_writer.writerow(tweet)
+            tweets_file = os.path.join(tweets_dir, 'tweets.csv')
+            tweets_files = list(data['tweets'])
+            if self.incremental and os.path.exists(tweets_file):
+                # the new tweets come first so that their counters replace the ones of the previous runs
+                tweets_files.append(self.unlink_file(tweets_file, [1, 2]))
+            merge_csv(tweets_files, tweets_file, 2, sort_key=TweetRecord.counters, reverse=True, record=TweetRecord)
+            if self.incremental:
+                self.update_marks(keyword, data['tweets'])
             print("Tweets postprocessing of all tasks for keyword {:s} is finished!".format(keyword))
 
             print("Postprocessing the crawled comments tweets from all tasks for keyword {:s} ...".format(keyword))
@@ -207,19 +423,7 @@ class WeiboSpiderRunner(object):
                 shutil.copy(file, comments_dir)
             print("Comments postprocessing of all tasks for keyword {:s} is finished!".format(keyword))
 
-        user_ids = []
-        for i, file in enumerate(data_dict['users']):
-            if not os.path.exists(file):
-                continue
-            with open(file, 'r', encoding='utf-8-sig', newline='') as f:
-                lines = f.readlines()
-                lines = [line.strip() for line in lines]
-                for line in lines:
-                    if line not in user_ids:
-                        user_ids.append(line)
-        users_file = os.path.join(self.source_dir, 'users.txt')
-        with open(users_file, 'w', encoding='utf-8-sig', newline='') as f:
-            f.writelines([line + '\n' for line in user_ids])
+        merge_lines(data_dict['users'], os.path.join(self.source_dir, 'users.txt'))
         print("Data postprocessing for all tasks is finished!")
         return
 
@@ -227,124 +431,216 @@ class WeiboSpiderRunner(object):
         print("Postprocessing the crawled users from all tasks...")
         data_users = []
         for worker_id, kwargs in enumerate(self.task_kwargs):
-            run_dir = os.path.join(self.run_dir, 'weibospider_' + str(worker_id))
-            file_dir = os.path.join(run_dir, 'data')
-            data_users.append(os.path.join(file_dir, 'users.csv'))
-
-        user_ids = []
-        users = []
-        users_head = None
-        for i, file in enumerate(data_users):
-            if not os.path.exists(file):
-                continue
-            with open(file, 'r', encoding='utf-8-sig', newline='') as f:
-                reader = csv.reader(f)
-                for j, row in enumerate(reader):
-                    if users_head is None and j == 0:
-                        users_head = row
-                    if j == 0:
-                        continue
-                    user_id = row[15]
-                    if user_id not in user_ids:
-                        user_ids.append(user_id)
-                        users.append(row)
-        if len(users) > 0:
-            users.sort(key=lambda x: int(x[14]), reverse=True)
-            users_file = os.path.join(self.source_dir, 'users.csv')
-            with open(users_file, 'w', encoding='utf-8-sig', newline='') as f:
-                users_writer = csv.writer(f, dialect='excel')
-                users_writer.writerow(users_head)
-                for user in users:
-                    users_writer.writerow(user)
+            users_file = os.path.join(self.run_dir, 'weibospider_' + str(worker_id), 'data', kwargs[0], 'users.csv')
+            if os.path.exists(users_file):
+                data_users.append(users_file)
+        for task_name, users_file in self.ledger.units('users'):
+            if users_file not in data_users:
+                data_users.append(users_file)
+
+        # UserSpider writes the fields it crawled to the user cache, so only the users skipped by split_users, and
+        # the ones whose crawl failed, are taken from it
+        fd, cached_file = tempfile.mkstemp(prefix='cached_', suffix='.csv', dir=self.run_dir)
+        with open(fd, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, dialect='excel')
+            writer.writerow(self.user_cache.fields)
+            writer.writerows(self.user_cache.rows(merge_lines([os.path.join(self.source_dir, 'users.txt')])))
+        data_users.append(cached_file)
+
+        users_file = os.path.join(self.source_dir, 'users.csv')
+        if self.incremental and os.path.exists(users_file):
+            data_users.append(self.unlink_file(users_file, []))
+        merge_csv(data_users, users_file, 15, sort_key=lambda x: x.fans_num if x.fans_num is not None else -1,
+                  reverse=True, record=UserRecord)
         print("Users postprocessing of all tasks is finished!")
         return
 
+    def unlink_file(self, file, columns):
+        # copy a file of a previous run into run_dir with its hyperlink columns turned back into plain values
+        fd, file_name = tempfile.mkstemp(prefix='previous_', suffix='.csv', dir=self.run_dir)
+        with open(fd, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, dialect='excel')
+            head_written = False
+            for head, row in iter_csv([file]):
+                if not head_written:
+                    writer.writerow(head)
+                    head_written = True
+                for column in columns:
+                    row[column] = unlink(row[column])
+                writer.writerow(row)
+        return file_name
+
     def postprocess_final(self):
+        # load the crawled data into the result store as typed records, the excel view is left to export_excel
         print("Postprocessing for all tasks ...")
         users_file = os.path.join(self.source_dir, 'users.csv')
-        users_dict = {}
-        urls_2_ids = {}
-        with open(users_file, 'r', encoding='utf-8-sig', newline='') as f:
-            reader = csv.reader(f)
-            for i, row in enumerate(reader):
-                if i == 0:
-                    continue
-                users_dict[row[0]] = (i + 1,)
-                urls_2_ids[row[15]] = row[0]
+        users = [UserRecord.from_row(row) for head, row in iter_csv([users_file])]
+        user_ids = set([user._id for user in users])
+        urls_2_ids = {url: int(user_id) for url, user_id in self.user_cache.urls().items()}
+        urls_2_ids.update([(user.url, user._id) for user in users])
+        for table in ['users', 'tweets', 'comments']:
+            self.result_store.reset(table)
+        if len(users) > 0:
+            self.result_store.write('users', UserRecord, users)
 
-        tweets_dict = {}
-        for root, dirs, files in os.walk(self.source_dir):
-            for file in files:
-                if file == 'users.csv':
-                    continue
-                elif file == 'tweets.csv':
-                    tweets_file = os.path.join(root, file)
-                    tweets = []
-                    tweets_head = None
-                    tweets_dict = {}
-                    with open(tweets_file, 'r', encoding='utf-8-sig', newline='') as f:
-                        reader = csv.reader(f)
-                        for i, row in enumerate(reader):
-                            if i == 0:
-                                tweets_head = row
-                                continue
-                            try:
-                                tweet_id = row[2]
-                                row[1] = urls_2_ids[row[1]]
-                                row[1] = '=HYPERLINK("../users.csv#users!A{:d}","{:s}")'.format(users_dict[row[1]][0], row[1])
-                                row[2] = '=HYPERLINK("./comments/{:s}.csv","{:s}")'.format(row[2], row[2])
-                                tweets.append(row)
-                                tweets_dict[tweet_id] = len(tweets)
-                            except KeyError:
-                                print("User {:s} is not found for file {:s}!".format(row[1], tweets_file))
-                                continue
-                    with open(tweets_file, 'w', encoding='utf-8-sig', newline='') as f:
-                        tweets_writer = csv.writer(f, dialect='excel')
-                        tweets_writer.writerow(tweets_head)
-                        for tweet in tweets:
-                            tweets_writer.writerow(tweet)
-                elif file.endswith('.csv'):
-                    comments_file = os.path.join(root, file)
-                    comments = []
-                    comments_head = None
-                    with open(comments_file, 'r', encoding='utf-8-sig', newline='') as f:
-                        reader = csv.reader(f)
-                        for i, row in enumerate(reader):
-                            if i == 0:
-                                comments_head = row
-                                continue
-                            try:
-                                row[1] = urls_2_ids[row[1]]
-                                row[0] = '=HYPERLINK("../tweets.csv#tweets!C{:d}","{:s}")'.format(tweets_dict[row[0]][0], row[0])
-                                row[1] = '=HYPERLINK("../../users.csv#users!A{:d}","{:s}")'.format(users_dict[row[1]][0], row[1])
-                                comments.append(row)
-                            except KeyError:
-                                print("User {:s} is not found for file {:s}!".format(row[1], comments_file))
-                    with open(comments_file, 'w', encoding='utf-8-sig', newline='') as f:
-                        comments_writer = csv.writer(f, dialect='excel')
-                        comments_writer.writerow(comments_head)
-                        for comment in comments:
-                            comments_writer.writerow(comment)
+        for keyword in sorted(os.listdir(self.source_dir)):
+            tweets_file = os.path.join(self.source_dir, keyword, 'tweets.csv')
+            if not os.path.exists(tweets_file):
+                continue
+            tweets_dates = {}
+            self.result_store.write('tweets', TweetRecord, self.iter_final_tweets(tweets_file, user_ids, tweets_dates),
+                                    partition=lambda tweet: (keyword, tweets_dates[tweet._id]))
+
+            comments_dir = os.path.join(self.source_dir, keyword, 'comments')
+            comments_files = [os.path.join(comments_dir, file) for file in sorted(os.listdir(comments_dir))
+                              if file.endswith('.csv')] if os.path.exists(comments_dir) else []
+            self.result_store.write('comments', CommentRecord,
+                                    self.iter_final_comments(comments_files, user_ids, urls_2_ids, tweets_dates),
+                                    partition=lambda comment: (keyword, tweets_dates[comment.weibo_id]))
         print("Postprocessing for all tasks is finished!")
 
+    @staticmethod
+    def iter_final_tweets(tweets_file, user_ids, tweets_dates):
+        for head, row in iter_csv([tweets_file]):
+            tweet = TweetRecord.from_row(row)
+            if tweet.user_id not in user_ids:
+                print("User {} is not found for file {:s}!".format(tweet.user_id, tweets_file))
+                continue
+            tweets_dates[tweet._id] = format_time(tweet.created_at)[:10] or 'unknown'
+            yield tweet
+
+    @staticmethod
+    def iter_final_comments(comments_files, user_ids, urls_2_ids, tweets_dates):
+        for file in comments_files:
+            for head, row in iter_csv([file]):
+                comment = CommentRecord.from_row(row)
+                # the user urls are resolved to the numeric ids
+                user_url = comment.comment_user_id or ''
+                comment.comment_user_id = urls_2_ids.get(user_url, parse_int(user_url))
+                if comment.comment_user_id not in user_ids or comment.weibo_id not in tweets_dates:
+                    print("User {:s} is not found for file {:s}!".format(user_url, file))
+                    continue
+                yield comment
+
+    def export_excel(self):
+        # write the result store as csv files linked to each other by excel hyperlinks, with formatted times
+        print("Exporting the result store to {:s} ...".format(self.excel_dir))
+        if os.path.exists(self.excel_dir):
+            shutil.rmtree(self.excel_dir)
+        os.makedirs(self.excel_dir)
+        users_dict = {}
+        users_head = self.result_store.head('users')
+        if users_head is not None:
+            with open(os.path.join(self.excel_dir, 'users.csv'), 'w', encoding='utf-8-sig', newline='') as f:
+                users_writer = csv.writer(f, dialect='excel')
+                users_writer.writerow(users_head)
+                for i, row in enumerate(self.result_store.iter_rows('users', users_head)):
+                    users_dict[row[0]] = (i + 2,)
+                    users_writer.writerow(row)
+
+        tweets_head = self.result_store.head('tweets')
+        comments_head = self.result_store.head('comments')
+        for keyword in self.result_store.keywords('tweets'):
+            tweets_dir = os.path.join(self.excel_dir, keyword)
+            comments_dir = os.path.join(tweets_dir, 'comments')
+            os.makedirs(comments_dir)
+
+            tweets = list(self.result_store.iter_rows('tweets', tweets_head, keyword))
+            counters = [tweets_head.index(column) for column in ['like_num', 'repost_num', 'comment_num']]
+            links = [tweets_head.index(column) for column in ['image_url', 'video_url', 'web_url', 'origin_weibo']]
+            created_at = tweets_head.index('created_at')
+            tweets.sort(key=lambda x: [x[i] or 0 for i in counters], reverse=True)
+            tweets_dict = {}
+            with open(os.path.join(tweets_dir, 'tweets.csv'), 'w', encoding='utf-8-sig', newline='') as f:
+                tweets_writer = csv.writer(f, dialect='excel')
+                tweets_writer.writerow(tweets_head)
+                for i, row in enumerate(tweets):
+                    tweet_id = row[2]
+                    tweets_dict[tweet_id] = (i + 2,)
+                    row[0] = '=HYPERLINK("{:s}")'.format(row[0])
+                    row[1] = '=HYPERLINK("../users.csv#users!A{:d}","{:d}")'.format(users_dict[row[1]][0], row[1])
+                    row[2] = '=HYPERLINK("./comments/{:s}.csv","{:s}")'.format(tweet_id, tweet_id)
+                    row[created_at] = format_time(row[created_at])
+                    for j in links:
+                        if row[j] is not None:
+                            row[j] = '=HYPERLINK("{:s}")'.format(row[j])
+                    tweets_writer.writerow(row)
+
+            if comments_head is None:
+                continue
+            created_at = comments_head.index('created_at')
+            comments_dict = {}
+            for row in self.result_store.iter_rows('comments', comments_head, keyword):
+                comments_dict.setdefault(row[0], []).append(row)
+            for tweet_id, comments in comments_dict.items():
+                with open(os.path.join(comments_dir, tweet_id + '.csv'), 'w', encoding='utf-8-sig', newline='') as f:
+                    comments_writer = csv.writer(f, dialect='excel')
+                    comments_writer.writerow(comments_head)
+                    for row in comments:
+                        row[0] = '=HYPERLINK("../tweets.csv#tweets!C{:d}","{:s}")'.format(tweets_dict[row[0]][0], row[0])
+                        row[1] = '=HYPERLINK("../../users.csv#users!A{:d}","{:d}")'.format(users_dict[row[1]][0], row[1])
+                        row[created_at] = format_time(row[created_at])
+                        comments_writer.writerow(row)
+        print("Exporting the result store is finished!")
+
     def crawl(self):
-        if os.path.exists(self.run_dir):
+        if self.role == 'worker':
+            # the coordinator owns run_dir, workers only join once it has filled the frontier
+            print("Waiting for the coordinator to fill the frontier ...")
+            while not self.task_queue.is_sealed():
+                time.sleep(10)
+        elif os.path.exists(self.run_dir) and not self.resume:
             shutil.rmtree(self.run_dir)
-        for worker_id in range(self.max_workers):
+        if not os.path.exists(self.run_dir):
+            os.makedirs(self.run_dir)
+        for worker_id in range(self.worker_offset, self.worker_offset + self.max_workers):
             run_dir = os.path.join(self.run_dir, 'weibospider_' + str(worker_id))
-            shutil.copytree('weibospider', run_dir)
-
-        self.split_tasks()
-        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
-            list(executor.map(self.run_weibo_spider_single, range(self.num_workers)))
-        self.postprocess_tasks()
-
-        self.split_users()
-        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
-            list(executor.map(self.postprocess_users_single, range(self.num_workers)))
-        self.postprocess_users()
-
-        self.postprocess_final()
+            if not os.path.exists(run_dir):
+                shutil.copytree('weibospider', run_dir)
+
+        metrics_rollup = MetricsRollup(self.run_dir)
+        metrics_rollup.start()
+        if self.role == 'worker':
+            self.run_pipeline_workers()
+            metrics_rollup.stop()
+            return
+
+        if self.pipeline and not self.ledger.is_done('phase', 'users'):
+            self.split_tasks()
+            self.seed_pipeline()
+            self.task_queue.seal()
+            self.run_pipeline_workers()
+            # the workers of other hosts may still be busy with the last tasks
+            while not self.task_queue.is_drained():
+                time.sleep(30)
+            self.task_queue.report()
+            self.postprocess_tasks()
+            self.ledger.mark_done('phase', 'tasks')
+            self.task_kwargs = []
+            self.postprocess_users()
+            self.ledger.mark_done('phase', 'users')
+
+        if not self.ledger.is_done('phase', 'tasks'):
+            self.split_tasks()
+            if self.num_workers > 0:
+                with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                    list(executor.map(self.run_weibo_spider_single, range(self.num_workers)))
+            self.task_queue.report()
+            self.postprocess_tasks()
+            self.ledger.mark_done('phase', 'tasks')
+
+        if not self.ledger.is_done('phase', 'users'):
+            self.split_users()
+            if self.num_workers > 0:
+                with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                    list(executor.map(self.postprocess_users_single, range(self.num_workers)))
+            self.postprocess_users()
+            self.ledger.mark_done('phase', 'users')
+
+        if not self.ledger.is_done('phase', 'final'):
+            self.postprocess_final()
+            self.ledger.mark_done('phase', 'final')
+        metrics_rollup.stop()
         shutil.rmtree(self.run_dir)
         return
 
@@ -353,67 +649,39 @@ class WeiboSpiderRunner(object):
         with open('settings/remove_users.txt', 'r', encoding='utf-8-sig', newline='') as f:
             lines = f.readlines()
             lines = [line.strip() for line in lines]
-        users_file = os.path.join(self.source_dir, 'users.csv')
         users_dict = {}
-        with open(users_file, 'r', encoding='utf-8-sig', newline='') as f:
-            reader = csv.reader(f)
-            for i, row in enumerate(reader):
-                if i == 0:
-                    continue
-                users_dict[row[0]] = (row[1], any([(line in row[10] or line in row[1]) for line in lines]))
+        for user_id, nick_name, authentication in self.result_store.iter_rows(
+                'users', ['_id', 'nick_name', 'authentication']):
+            users_dict[user_id] = (nick_name, any([(line in (authentication or '') or line in (nick_name or ''))
+                                                   for line in lines]))
 
         topics_dir = os.path.join(self.result_dir, 'topic')
         if not os.path.exists(topics_dir):
             os.makedirs(topics_dir)
 
-        topics_file = None
         topics_head = ['用户名', '时间', '内容', '链接', '赞数', '_id']
-        tweets_dict = {}
-        for root, dirs, files in os.walk(self.source_dir):
-            for file in files:
-                if file == 'users.csv':
-                    continue
-                elif file == 'tweets.csv':
-                    tweets_file = os.path.join(root, file)
-                    tweets = []
-                    with open(tweets_file, 'r', encoding='utf-8-sig', newline='') as f:
-                        reader = csv.reader(f)
-                        for i, row in enumerate(reader):
-                            if i == 0:
-                                continue
-                            tweets.append(row)
-                    topics_file = os.path.join(topics_dir, os.path.basename(os.path.realpath(root)) + '.csv')
-                    file_exists = os.path.exists(topics_file)
-                    with open(topics_file, 'a', encoding='utf-8-sig', newline='') as f:
-                        topics_writer = csv.writer(f, dialect='excel')
-                        if not file_exists:
-                            topics_writer.writerow(topics_head)
-                        for tweet in tweets:
-                            user_id = tweet[1].split('","')[-1].split('")')[0]
-                            tweet_id = tweet[2].split('","')[-1].split('")')[0]
-                            if users_dict[user_id][1]:
-                                continue
-                            tweets_dict[tweet_id] = (tweet[0],)
-                            topics_writer.writerow([users_dict[user_id][0], tweet[3], tweet[12],
-                                                   tweet[0], tweet[5], tweet_id])
-                elif file.endswith('.csv'):
-                    comments_file = os.path.join(root, file)
-                    comments = []
-                    with open(comments_file, 'r', encoding='utf-8-sig', newline='') as f:
-                        reader = csv.reader(f)
-                        for i, row in enumerate(reader):
-                            if i == 0:
-                                continue
-                            comments.append(row)
-                    with open(topics_file, 'a', encoding='utf-8-sig', newline='') as f:
-                        topics_writer = csv.writer(f, dialect='excel')
-                        for comment in comments:
-                            user_id = comment[1].split('","')[-1].split('")')[0]
-                            tweet_id = comment[0].split('","')[-1].split('")')[0]
-                            if users_dict[user_id][1] or tweet_id not in tweets_dict:
-                                continue
-                            topics_writer.writerow([users_dict[user_id][0], comment[5], comment[2],
-                                                   tweets_dict[tweet_id][0], comment[4], comment[3]])
+        for keyword in self.result_store.keywords('tweets'):
+            topics_file = os.path.join(topics_dir, keyword + '.csv')
+            file_exists = os.path.exists(topics_file)
+            tweets_dict = {}
+            with open(topics_file, 'a', encoding='utf-8-sig', newline='') as f:
+                topics_writer = csv.writer(f, dialect='excel')
+                if not file_exists:
+                    topics_writer.writerow(topics_head)
+                for weibo_url, user_id, tweet_id, created_at, content, like_num in self.result_store.iter_rows(
+                        'tweets', ['weibo_url', 'user_id', '_id', 'created_at', 'content', 'like_num'], keyword):
+                    if users_dict[user_id][1]:
+                        continue
+                    tweets_dict[tweet_id] = ('=HYPERLINK("{:s}")'.format(weibo_url),)
+                    topics_writer.writerow([users_dict[user_id][0], format_time(created_at), content,
+                                           tweets_dict[tweet_id][0], like_num or 0, tweet_id])
+                for tweet_id, user_id, content, comment_id, like_num, created_at in self.result_store.iter_rows(
+                        'comments', ['weibo_id', 'comment_user_id', 'content', '_id', 'like_num', 'created_at'],
+                        keyword):
+                    if users_dict[user_id][1] or tweet_id not in tweets_dict:
+                        continue
+                    topics_writer.writerow([users_dict[user_id][0], format_time(created_at), content,
+                                           tweets_dict[tweet_id][0], like_num or 0, comment_id])
 
         for file in os.listdir(topics_dir):
             file_name = os.path.splitext(file)[0]
@@ -424,14 +692,15 @@ class WeiboSpiderRunner(object):
                     os.remove(topics_file)
                 continue
             contents = []
+            # the same quick_ratio > 0.7 check as difflib, with a candidate lookup instead of comparing to all contents
+            contents_index = NearDuplicateIndex(threshold=0.7)
             with open(topics_file, 'r', encoding='utf-8-sig', newline='') as f:
                 reader = csv.reader(f)
                 for i, row in enumerate(reader):
                     if i == 0:
                         continue
                     row[2] = extract_comment_content(row[2])
-                    if len(row[2]) < 5 or any([difflib.SequenceMatcher(None, row[2], content[2]).quick_ratio() > 0.7
-                                               for content in contents]):
+                    if len(row[2]) < 5 or not contents_index.add_unique(row[2]):
                         continue
                     contents.append(row)
             contents.sort(key=lambda x: int(x[4]), reverse=True)
@@ -477,6 +746,23 @@ if __name__ == '__main__':
     parser.add_argument('--num-topics', type=int, default=12)
     parser.add_argument('--max-iter', type=int, default=5000)
     parser.add_argument('--num-top-words', type=int, default=20)
+    parser.add_argument('--resume', action='store_true', help='skip the units finished by an interrupted run')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only crawl every keyword from its latest tweet seen and merge into the existing data')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='crawl the comments and users while the tweets are still being crawled')
+    parser.add_argument('--users-per-task', type=int, default=1000)
+    parser.add_argument('--role', type=str, default='all', help='all, coordinator or worker')
+    parser.add_argument('--worker-offset', type=int, default=0, help='the index of the first worker on this host')
+    parser.add_argument('--lease-time', type=int, default=600)
+    parser.add_argument('--user-info-ttl', type=float, default=30, help='days before the cached user info expires')
+    parser.add_argument('--user-counters-ttl', type=float, default=7,
+                        help='days before the cached user counters expire')
+    parser.add_argument('--max-comment-requests', type=int, default=0,
+                        help='requests of the comment crawl of a keyword in a task, 0 for no limit')
+    parser.add_argument('--max-comment-pages', type=int, default=0, help='comment pages of a tweet, 0 for all of them')
+    parser.add_argument('--export-excel', action='store_true',
+                        help='only export the result store as csv files with excel hyperlinks')
     args = parser.parse_args()
 
     keywords = []
@@ -491,7 +777,14 @@ if __name__ == '__main__':
     weibospider_runner = WeiboSpiderRunner(args.keywords, args.date_start, args.date_end,
                                            args.min_like_num, args.min_repost_num, args.min_comment_num,
                                            args.file_dir, args.run_dir, args.max_workers, args.days_per_worker,
-                                           args.num_topics, args.max_iter, args.num_top_words)
+                                           args.num_topics, args.max_iter, args.num_top_words, args.resume,
+                                           args.incremental, args.pipeline, args.users_per_task,
+                                           args.role, args.worker_offset, args.lease_time, args.user_info_ttl,
+                                           args.user_counters_ttl, args.max_comment_requests, args.max_comment_pages)
+    if args.export_excel:
+        weibospider_runner.export_excel()
+        sys.exit(0)
     weibospider_runner.crawl()
-    weibospider_runner.analyze()
+    if args.role != 'worker':
+        weibospider_runner.analyze()
 
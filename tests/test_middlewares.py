@@ -0,0 +1,49 @@
+# encoding: utf-8
+import os
+import sys
+import tempfile
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'weibospider'))
+from middlewares import CookiePoolMiddleware, IPProxyMiddleware
+
+
+def make_pools(tmp_dir):
+    cookies_file = os.path.join(tmp_dir, 'cookies.txt')
+    proxies_file = os.path.join(tmp_dir, 'ips.txt')
+    with open(cookies_file, 'w', encoding='utf-8') as f:
+        f.write('SUB=a\nSUB=b\n')
+    with open(proxies_file, 'w', encoding='utf-8') as f:
+        f.write('127.0.0.1:8001\n127.0.0.1:8002\n')
+    crawler = get_crawler(settings_dict={
+        'COOKIES_FILE': cookies_file, 'COOKIES_RELOAD_INTERVAL': 30, 'COOKIES_COOLDOWN': 0, 'COOKIES_INTERVAL': 0,
+        'COOKIES_MAX_STRIKES': 5, 'COOKIES_MAX_RETRIES': 3, 'PROXIES_FILE': proxies_file,
+        'PROXIES_PROBE_INTERVAL': 0, 'PROXIES_PROBE_TIMEOUT': 10, 'PROXIES_WINDOW': 50,
+        'PROXIES_MAX_ERROR_RATE': 0.5, 'PROXIES_MAX_LATENCY': 10})
+    return CookiePoolMiddleware.from_crawler(crawler), IPProxyMiddleware.from_crawler(crawler)
+
+
+def download(cookie_pool, proxy_pool, request, status):
+    # the proxy pool (740) comes before the cookie pool (910) for the requests and after it for the responses
+    proxy_pool.process_request(request, None)
+    cookie_pool.process_request(request, None)
+    response = Response(request.url, status=status, request=request)
+    result = cookie_pool.process_response(request, response, None)
+    if isinstance(result, Response):
+        result = proxy_pool.process_response(request, result, None)
+    return result
+
+
+def test_cookie_ban_retry_releases_proxy():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cookie_pool, proxy_pool = make_pools(tmp_dir)
+        request = Request('https://weibo.cn/u/1')
+        retry_request = download(cookie_pool, proxy_pool, request, 418)
+        assert isinstance(retry_request, Request)
+        assert 'proxy_label' not in retry_request.meta
+        assert [health.in_flight for health in proxy_pool.proxies] == [0, 0]
+        response = download(cookie_pool, proxy_pool, retry_request, 200)
+        assert response.status == 200
+        assert [health.in_flight for health in proxy_pool.proxies] == [0, 0]
+        assert [health.in_flight for health in cookie_pool.cookies.values()] == [0, 0]
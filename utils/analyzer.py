@@ -22,8 +22,12 @@ matplotlib.rcParams['axes.unicode_minus'] = False    # 正常显示负号
 
 
 class DataAnalyzer(object):
-    def __init__(self, file_dir, num_topics=10, max_iter=1000, n_top_words=20):
+    def __init__(self, file_dir, num_topics=10, max_iter=1000, n_top_words=20, my_dict_file=None,
+                 stop_words_file=None):
         self.file_dir = file_dir
+        # the user dictionary and stop words of the run, those of utils/data by default
+        self.my_dict_file = my_dict_file or os.path.join(data_root, 'my_dict.txt')
+        self.stop_words_file = stop_words_file or os.path.join(data_root, 'stop_words.txt')
         self.comments_file = os.path.join(file_dir, 'comments.txt')
         self.keywords_file = os.path.join(file_dir, 'keywords.txt')
         self.num_topics = num_topics
@@ -40,7 +44,7 @@ class DataAnalyzer(object):
         jieba.load_userdict(os.path.join(data_root, 'dict_pangu.txt'))
         jieba.load_userdict(os.path.join(data_root, 'dict_sougou_utf8.txt'))
         jieba.load_userdict(os.path.join(data_root, 'dict_tencent_utf8.txt'))
-        jieba.load_userdict(os.path.join(data_root, 'my_dict.txt'))
+        jieba.load_userdict(self.my_dict_file)
         self.jieba_load = True
 
     def cut_words(self):
@@ -51,7 +55,7 @@ class DataAnalyzer(object):
             lines = f.readlines()
             lines = [line.strip() for line in lines]
             stop_words.extend(lines)
-        with open(os.path.join(data_root, 'stop_words.txt'), 'r', encoding='utf-8-sig', newline='') as f:
+        with open(self.stop_words_file, 'r', encoding='utf-8-sig', newline='') as f:
             lines = f.readlines()
             lines = [line.strip() for line in lines]
             stop_words.extend(lines)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import zlib
+import collections
+import numpy as np
+
+
+class NearDuplicateIndex(object):
+    """
+    A MinHash LSH index of texts for the near-duplicate check of postprocess_topics.
+
+    The similarity is difflib's quick_ratio, 2 * |common characters| / (len(a) + len(b)), which is the Dice
+    coefficient of the character multisets. The texts are shingled into (character, occurrence) pairs, so the
+    Jaccard similarity of the shingle sets is J = D / (2 - D) for a Dice coefficient D. Texts sharing one band
+    of band_size MinHash values are candidates, candidates whose MinHash estimate of J is far below the threshold
+    are dropped and only the rest are compared exactly.
+    """
+    prime = (1 << 31) - 1
+
+    def __init__(self, threshold=0.7, num_perm=256, band_size=4, seed=0):
+        self.threshold = threshold
+        self.band_size = band_size
+        self.num_bands = num_perm // band_size
+        random_state = np.random.RandomState(seed)
+        self.a = random_state.randint(1, self.prime, size=self.num_bands * band_size).astype(np.int64)
+        self.b = random_state.randint(0, self.prime, size=self.num_bands * band_size).astype(np.int64)
+        self.buckets = [{} for _ in range(self.num_bands)]
+        # the estimate of J has a standard deviation of at most 0.5 / sqrt(num_perm), keep a margin of 6 of them
+        self.min_jaccard = threshold / (2 - threshold) - 3.0 / np.sqrt(self.num_bands * band_size)
+        self.counters = []
+        self.lengths = []
+        self.signatures = np.zeros((1024, self.num_bands * band_size), dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.counters)
+
+    def signature(self, counter):
+        shingles = [zlib.crc32('{:s}{:d}'.format(char, i).encode('utf-8')) & self.prime
+                    for char, count in counter.items() for i in range(count)]
+        if len(shingles) == 0:
+            return None
+        shingles = np.array(shingles, dtype=np.int64)
+        return ((np.outer(shingles, self.a) + self.b) % self.prime).min(axis=0)
+
+    def bands(self, signature):
+        return [signature[i * self.band_size: (i + 1) * self.band_size].tobytes() for i in range(self.num_bands)]
+
+    def similarity(self, counter, other):
+        length = sum(counter.values()) + sum(other.values())
+        if length == 0:
+            return 1.0
+        matches = sum([min(count, other[char]) for char, count in counter.items() if char in other])
+        return 2.0 * matches / length
+
+    def query(self, text):
+        """Return the indexes of the added texts whose similarity to text is above the threshold."""
+        counter = collections.Counter(text)
+        return self.lookup(counter, self.signature(counter))
+
+    def lookup(self, counter, signature):
+        if signature is None:
+            candidates = [i for i, other in enumerate(self.counters) if len(other) == 0]
+        else:
+            candidates = set()
+            for bucket, band in zip(self.buckets, self.bands(signature)):
+                candidates.update(bucket.get(band, []))
+            candidates = np.array(sorted(candidates), dtype=np.int64)
+            if len(candidates) > 0:
+                jaccard = (self.signatures[candidates] == signature).mean(axis=1)
+                candidates = candidates[jaccard >= self.min_jaccard].tolist()
+        # the similarity is at most 2 * min(la, lb) / (la + lb), which already rules out most candidates
+        length = sum(counter.values())
+        return [i for i in candidates
+                if 2.0 * min(length, self.lengths[i]) > self.threshold * (length + self.lengths[i]) and
+                self.similarity(counter, self.counters[i]) > self.threshold]
+
+    def is_duplicate(self, text):
+        return len(self.query(text)) > 0
+
+    def add(self, text):
+        counter = collections.Counter(text)
+        return self.insert(counter, self.signature(counter))
+
+    def add_unique(self, text):
+        """Add text unless it is a near duplicate of an added text, returns whether it was added."""
+        counter = collections.Counter(text)
+        signature = self.signature(counter)
+        if len(self.lookup(counter, signature)) > 0:
+            return False
+        self.insert(counter, signature)
+        return True
+
+    def insert(self, counter, signature):
+        key = len(self.counters)
+        self.counters.append(counter)
+        self.lengths.append(sum(counter.values()))
+        if key == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.zeros_like(self.signatures)])
+        if signature is not None:
+            self.signatures[key] = signature
+            for bucket, band in zip(self.buckets, self.bands(signature)):
+                bucket.setdefault(band, []).append(key)
+        return key
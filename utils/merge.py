@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import os
+import csv
+import heapq
+import shutil
+import tempfile
+
+
+def iter_csv(files):
+    """Yield (head, row) for every data row of the given csv files, missing files are skipped."""
+    for file in files:
+        if not os.path.exists(file):
+            continue
+        with open(file, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            head = next(reader, None)
+            for row in reader:
+                yield head, row
+
+
+def merge_csv(files, out_file, id_index, sort_key=None, reverse=False, chunk_size=200000, record=None):
+    """
+    Merge the csv files into out_file in one streaming pass, keeping the first row seen for every id.
+    Rows are sorted by sort_key with an external merge sort, so at most chunk_size rows are held in memory.
+    With a record class (see weibospider/records.py) the kept rows are parsed once into typed records, sort_key
+    gets the records and the head of out_file is the fields of the record.
+    Returns the number of rows written, out_file is not created when there is no row.
+    """
+    ids = set()
+    head = None
+    chunk = []
+    runs = []
+    temp_dir = tempfile.mkdtemp(prefix='merge_', dir=os.path.dirname(os.path.realpath(out_file)))
+    try:
+        for row_head, row in iter_csv(files):
+            if head is None:
+                head = row_head if record is None else record.fields
+            row_id = row[id_index]
+            if row_id in ids:
+                continue
+            ids.add(row_id)
+            chunk.append(row if record is None else record.from_row(row))
+            if len(chunk) >= chunk_size:
+                runs.append(write_run(chunk, temp_dir, len(runs), sort_key, reverse, record))
+                chunk = []
+        if len(ids) == 0:
+            return 0
+
+        if sort_key is not None:
+            chunk.sort(key=sort_key, reverse=reverse)
+        readers = [iter_run(run, record) for run in runs] + [iter(chunk)]
+        if sort_key is not None and len(readers) > 1:
+            rows = heapq.merge(*readers, key=sort_key, reverse=reverse)
+        else:
+            rows = (row for reader in readers for row in reader)
+        with open(out_file, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, dialect='excel')
+            writer.writerow(head)
+            writer.writerows(rows if record is None else (row.to_row() for row in rows))
+    finally:
+        shutil.rmtree(temp_dir)
+    return len(ids)
+
+
+def write_run(rows, temp_dir, run_id, sort_key=None, reverse=False, record=None):
+    if sort_key is not None:
+        rows.sort(key=sort_key, reverse=reverse)
+    run_file = os.path.join(temp_dir, 'run_{:d}.csv'.format(run_id))
+    with open(run_file, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f, dialect='excel').writerows(rows if record is None else (row.to_row() for row in rows))
+    return run_file
+
+
+def iter_run(run_file, record=None):
+    with open(run_file, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            yield row if record is None else record.from_row(row)
+
+
+def merge_lines(files, out_file=None):
+    """Merge the lines of the text files in order of first appearance, empty lines are dropped."""
+    lines = {}
+    for file in files:
+        if not os.path.exists(file):
+            continue
+        with open(file, 'r', encoding='utf-8-sig', newline='') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    lines[line] = None
+    lines = list(lines)
+    if out_file is not None:
+        with open(out_file, 'w', encoding='utf-8-sig', newline='') as f:
+            f.writelines([line + '\n' for line in lines])
+    return lines
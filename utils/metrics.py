@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import json
+import time
+import threading
+
+
+def rollup(files, interval):
+    """
+    Sum up the metrics files written by the CrawlMetrics extension of the workers. Rates and queue depths are only
+    taken from the spiders that are still running, totals from the latest spider of every worker.
+    """
+    now = time.time()
+    total = {'updated_at': now, 'workers': 0, 'active_workers': 0, 'requests': 0, 'responses': 0, 'items': {},
+             'statuses': {}, 'bans': 0, 'login_redirects': 0, 'requests_per_second': 0.0, 'items_per_second': {},
+             'queue_depth': 0, 'in_progress': 0, 'latency': {}}
+    for file in files:
+        try:
+            with open(file, 'r', encoding='utf-8') as f:
+                metrics = json.load(f)
+        except (OSError, ValueError):
+            continue
+        total['workers'] += 1
+        for key in ['requests', 'responses', 'bans', 'login_redirects']:
+            total[key] += metrics[key]
+        for key in ['items', 'statuses']:
+            for name, count in metrics[key].items():
+                total[key][name] = total[key].get(name, 0) + count
+        for kind, latencies in metrics['latency'].items():
+            for label, latency in latencies.items():
+                merged = total['latency'].setdefault(kind, {}).setdefault(label, {'sum': 0.0, 'count': 0, 'max': 0.0})
+                merged['sum'] += latency['sum']
+                merged['count'] += latency['count']
+                merged['max'] = max(merged['max'], latency['max'])
+        if metrics['closed'] or now - metrics['updated_at'] > 3 * interval:
+            continue
+        total['active_workers'] += 1
+        total['requests_per_second'] += metrics['requests_per_second']
+        for name, rate in metrics['items_per_second'].items():
+            total['items_per_second'][name] = total['items_per_second'].get(name, 0.0) + rate
+        total['queue_depth'] += metrics['queue_depth']
+        total['in_progress'] += metrics['in_progress']
+    return total
+
+
+class MetricsRollup(threading.Thread):
+    """Periodically roll up the metrics of all workers in run_dir into one file and print a summary line."""
+
+    def __init__(self, run_dir, interval=30):
+        super().__init__(daemon=True)
+        self.run_dir = run_dir
+        self.interval = interval
+        self.metrics_file = os.path.join(run_dir, 'metrics.json')
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        self.stopped.set()
+
+    def report(self):
+        files = glob.glob(os.path.join(self.run_dir, 'weibospider_*', 'temp', 'metrics.json'))
+        if len(files) == 0 or not os.path.exists(self.run_dir):
+            return
+        metrics = rollup(files, self.interval)
+        with open(self.metrics_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, indent=2)
+        os.replace(self.metrics_file + '.tmp', self.metrics_file)
+        blocked = (metrics['bans'] + metrics['login_redirects']) / max(metrics['responses'], 1)
+        print("Metrics of {:d}/{:d} running workers: {:.1f} requests/s, {:.1f} items/s, queue {:d}, "
+              "{:.1%} responses banned or redirected to login".format(
+                  metrics['active_workers'], metrics['workers'], metrics['requests_per_second'],
+                  sum(metrics['items_per_second'].values()), metrics['queue_depth'], blocked))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+from urllib.parse import quote, unquote
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+
+
+class ResultStore(object):
+    """
+    The crawled tweets, comments and users as typed parquet tables in store_dir, with the types of their records
+    (see weibospider/records.py): int64 ids, counters and epoch times, strings and nulls. Every table may be
+    partitioned by keyword and date (hive style, keyword=<keyword>/date=<date>, the values uri-escaped like pyarrow
+    expects them).
+    """
+    # the user urls of the comments are resolved to the numeric ids by postprocess_final
+    resolved_columns = ['comment_user_id']
+    partition_columns = ['keyword', 'date']
+
+    def __init__(self, store_dir, chunk_size=100000):
+        self.store_dir = store_dir
+        self.chunk_size = chunk_size
+
+    def table_dir(self, table):
+        return os.path.join(self.store_dir, table)
+
+    def exists(self, table):
+        return any([files for _, _, files in os.walk(self.table_dir(table))])
+
+    def reset(self, table):
+        table_dir = self.table_dir(table)
+        if os.path.exists(table_dir):
+            shutil.rmtree(table_dir)
+        os.makedirs(table_dir)
+
+    def head(self, table):
+        # the stored columns of a table, without the partition columns
+        for root, dirs, files in sorted(os.walk(self.table_dir(table))):
+            for file in sorted(files):
+                return pq.read_schema(os.path.join(root, file)).names
+        return None
+
+    def schema(self, record):
+        int_columns = record.int_fields + record.time_fields + self.resolved_columns
+        return pa.schema([(column, pa.int64() if column in int_columns else pa.string()) for column in record.fields])
+
+    def write(self, table, record, rows, partition=None):
+        """
+        Append the records to a table, partition maps a record to its (keyword, date) or is None for a flat table.
+        Records are buffered per partition and flushed as one parquet file per partition every chunk_size rows.
+        Returns the number of rows written.
+        """
+        schema = self.schema(record)
+        table_dir = self.table_dir(table)
+        if not os.path.exists(table_dir):
+            os.makedirs(table_dir)
+        num_parts = len([file for _, _, files in os.walk(table_dir) for file in files])
+        buffers = {}
+        num_rows = 0
+        for row in rows:
+            key = partition(row) if partition is not None else ()
+            buffers.setdefault(key, []).append(row)
+            num_rows += 1
+            if num_rows % self.chunk_size == 0:
+                num_parts = self.flush(table_dir, schema, buffers, num_parts)
+        self.flush(table_dir, schema, buffers, num_parts)
+        return num_rows
+
+    def flush(self, table_dir, schema, buffers, num_parts):
+        for key, rows in buffers.items():
+            # a keyword may contain a / or a %, which pyarrow would decode when the partitions are read
+            part_dir = os.path.join(table_dir, *['{:s}={:s}'.format(column, quote(value, safe=''))
+                                                 for column, value in zip(self.partition_columns, key)])
+            if not os.path.exists(part_dir):
+                os.makedirs(part_dir)
+            # the records are typed already, the columns are taken as they are
+            columns = [pa.array([getattr(row, field.name) for row in rows], type=field.type) for field in schema]
+            pq.write_table(pa.Table.from_arrays(columns, schema=schema),
+                           os.path.join(part_dir, 'part-{:05d}.parquet'.format(num_parts)))
+            num_parts += 1
+        buffers.clear()
+        return num_parts
+
+    def read(self, table, columns=None, keyword=None):
+        partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in self.partition_columns]),
+                                       flavor='hive')
+        dataset = ds.dataset(self.table_dir(table), format='parquet', partitioning=partitioning)
+        if keyword is None:
+            return dataset.to_table(columns=columns)
+        return dataset.to_table(columns=columns, filter=ds.field('keyword') == keyword)
+
+    def iter_rows(self, table, columns=None, keyword=None):
+        """Yield the rows of a table as lists of python values in the order of the given columns."""
+        if not self.exists(table):
+            return
+        data = self.read(table, columns, keyword).to_pydict()
+        columns = columns if columns is not None else list(data)
+        for row in zip(*[data[column] for column in columns]):
+            yield list(row)
+
+    def keywords(self, table):
+        table_dir = self.table_dir(table)
+        if not os.path.exists(table_dir):
+            return []
+        return sorted([unquote(name.split('=', 1)[1]) for name in os.listdir(table_dir) if name.startswith('keyword=')])
+
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import sqlite3
+
+
+class TaskQueue(object):
+    """
+    A task queue shared by the worker processes of one run and backed by a SQLite file,
+    idle workers keep pulling the next pending task until the queue is drained.
+    Tasks of the later crawl stages are handed out first, so the queues between the stages stay short.
+
+    Tasks taken with a lease go back to the queue when their lease expires before they are acknowledged,
+    which lets workers on several hosts share one frontier. Failed tasks go back to the queue until they have
+    been tried max_attempts times. The SQLite file is a stand-in for a shared backend, another backend only
+    has to provide the same methods.
+    """
+    stages = ['user', 'comment', 'tweet']
+
+    def __init__(self, db_file, max_attempts=3):
+        self.db_file = db_file
+        self.max_attempts = max_attempts
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=600, isolation_level=None)
+        return conn
+
+    def reset(self):
+        if os.path.exists(self.db_file):
+            os.remove(self.db_file)
+        conn = self.connect()
+        try:
+            conn.execute('CREATE TABLE tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, stage TEXT, '
+                         'priority INTEGER, args TEXT, status TEXT, worker TEXT, started_at REAL, finished_at REAL, '
+                         'leased_until REAL, attempts INTEGER DEFAULT 0)')
+            conn.execute('CREATE TABLE items (stage TEXT, key TEXT, batched INTEGER, PRIMARY KEY (stage, key))')
+            conn.execute('CREATE TABLE state (key TEXT PRIMARY KEY, value TEXT)')
+        finally:
+            conn.close()
+
+    def put(self, name, args, stage='tweet'):
+        conn = self.connect()
+        try:
+            conn.execute('INSERT OR IGNORE INTO tasks (name, stage, priority, args, status) VALUES (?, ?, ?, ?, ?)',
+                         (name, stage, self.stages.index(stage), json.dumps(args), 'pending'))
+        finally:
+            conn.close()
+
+    def get(self, worker_id, lease=None):
+        # take the next pending task, or a running one whose lease has expired
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT id, name, args, stage FROM tasks WHERE status = ? OR (status = ? AND '
+                               'leased_until IS NOT NULL AND leased_until < ?) ORDER BY priority, id LIMIT 1',
+                               ('pending', 'running', now)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute('UPDATE tasks SET status = ?, worker = ?, started_at = ?, leased_until = ? WHERE id = ?',
+                         ('running', str(worker_id), now, now + lease if lease else None, row[0]))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return row[1], json.loads(row[2]), row[3]
+
+    def renew(self, name, worker_id, lease):
+        # a worker whose lease has expired and was taken over by another worker no longer owns the task
+        conn = self.connect()
+        try:
+            conn.execute('UPDATE tasks SET leased_until = ? WHERE name = ? AND worker = ? AND status = ?',
+                         (time.time() + lease, name, str(worker_id), 'running'))
+        finally:
+            conn.close()
+
+    def done(self, name, worker_id):
+        conn = self.connect()
+        try:
+            conn.execute('UPDATE tasks SET status = ?, finished_at = ? WHERE name = ? AND worker = ? AND status = ?',
+                         ('done', time.time(), name, str(worker_id), 'running'))
+        finally:
+            conn.close()
+
+    ack = done
+
+    def nack(self, name, worker_id):
+        # put a failed task back into the queue, or give it up once it has been tried max_attempts times
+        conn = self.connect()
+        try:
+            conn.execute('UPDATE tasks SET status = CASE WHEN attempts + 1 < ? THEN ? ELSE ? END, '
+                         'attempts = attempts + 1, worker = NULL, leased_until = NULL, finished_at = ? '
+                         'WHERE name = ? AND worker = ? AND status = ?',
+                         (self.max_attempts, 'pending', 'failed', time.time(), name, str(worker_id), 'running'))
+        finally:
+            conn.close()
+
+    def seal(self):
+        # mark the queue as fully seeded, workers of other hosts wait for this before they start pulling
+        conn = self.connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', ('sealed', '1'))
+        finally:
+            conn.close()
+
+    def is_sealed(self):
+        if not os.path.exists(self.db_file):
+            return False
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT value FROM state WHERE key = ?', ('sealed',)).fetchone()
+        except sqlite3.OperationalError:
+            return False
+        finally:
+            conn.close()
+        return row is not None
+
+    def is_drained(self):
+        conn = self.connect()
+        try:
+            num_tasks = conn.execute('SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)',
+                                     ('pending', 'running')).fetchone()[0]
+            num_items = conn.execute('SELECT COUNT(*) FROM items WHERE batched = 0').fetchone()[0]
+        finally:
+            conn.close()
+        return num_tasks == 0 and num_items == 0
+
+    def count(self, status, stages=None):
+        stages = stages or self.stages
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT COUNT(*) FROM tasks WHERE status = ? AND stage IN ({:s})'.format(
+                ', '.join(['?'] * len(stages))), [status] + list(stages)).fetchone()
+        finally:
+            conn.close()
+        return row[0]
+
+    def count_items(self, stage):
+        # the items of a stage still waiting to be batched
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT COUNT(*) FROM items WHERE stage = ? AND batched = 0', (stage,)).fetchone()
+        finally:
+            conn.close()
+        return row[0]
+
+    def add_items(self, stage, keys, batched=False):
+        # items are the ids waiting to be batched into tasks of a stage, every id is only added once per run
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            num_items = conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+            conn.executemany('INSERT OR IGNORE INTO items (stage, key, batched) VALUES (?, ?, ?)',
+                             [(stage, key, int(batched)) for key in keys])
+            num_items = conn.execute('SELECT COUNT(*) FROM items').fetchone()[0] - num_items
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return num_items
+
+    def take_items(self, stage, batch_size, force=False):
+        # take a full batch of waiting items, or whatever is left when force is set
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('SELECT key FROM items WHERE stage = ? AND batched = 0 ORDER BY rowid LIMIT ?',
+                                (stage, batch_size)).fetchall()
+            keys = [row[0] for row in rows]
+            if len(keys) < batch_size and not force:
+                keys = []
+            conn.executemany('UPDATE items SET batched = 1 WHERE stage = ? AND key = ?', [(stage, key) for key in keys])
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return keys
+
+    def tasks(self, status=None):
+        conn = self.connect()
+        try:
+            if status is None:
+                rows = conn.execute('SELECT name, stage, args, status, worker, started_at, finished_at FROM tasks '
+                                    'ORDER BY id').fetchall()
+            else:
+                rows = conn.execute('SELECT name, stage, args, status, worker, started_at, finished_at FROM tasks '
+                                    'WHERE status = ? ORDER BY id', (status,)).fetchall()
+        finally:
+            conn.close()
+        keys = ['name', 'stage', 'args', 'status', 'worker', 'started_at', 'finished_at']
+        tasks = [dict(zip(keys, row)) for row in rows]
+        for task in tasks:
+            task['args'] = json.loads(task['args'])
+        return tasks
+
+    def report(self):
+        for task in self.tasks(status='failed'):
+            print("Task {:s} ({:s}) failed {:d} times and was given up!".format(task['name'], task['stage'],
+                                                                                self.max_attempts))
+        tasks = self.tasks(status='done')
+        if len(tasks) == 0:
+            return
+        workers = {}
+        for task in sorted(tasks, key=lambda x: x['finished_at'] - x['started_at'], reverse=True):
+            wall_time = task['finished_at'] - task['started_at']
+            workers[task['worker']] = workers.get(task['worker'], 0) + wall_time
+            print("Task {:s} ({:s}) on worker {:s}: {:.1f}s".format(task['name'], task['stage'], task['worker'],
+                                                                    wall_time))
+        total_time = sum(workers.values())
+        run_time = max([task['finished_at'] for task in tasks]) - min([task['started_at'] for task in tasks])
+        print("{:d} tasks took {:.1f}s of work in {:.1f}s on {:d} workers (busiest worker {:.1f}s).".format(
+            len(tasks), total_time, run_time, len(workers), max(workers.values())))
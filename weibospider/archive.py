@@ -0,0 +1,206 @@
+# encoding: utf-8
+"""
+The page archive: every page fetched by the spiders is appended to segment files in the WARC format, one gzip
+member per record so that a segment is a valid .warc.gz, with a small index next to each segment. The archive is
+never rewritten, unlike the http cache nothing expires, and the pages can be parsed again offline by replay.py.
+"""
+import os
+import json
+import time
+import uuid
+import zlib
+import datetime
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.response import response_status_message
+from httpcache import request_key
+
+
+def warc_record(url, status, headers, body, fields):
+    """A WARC response record of the page, gzip compressed on its own."""
+    status_line = 'HTTP/1.1 {}\r\n'.format(response_status_message(status)).encode('utf-8')
+    http = status_line + headers_dict_to_raw(headers) + b'\r\n\r\n' + body
+    header = [
+        ('WARC-Type', 'response'),
+        ('WARC-Record-ID', '<urn:uuid:{}>'.format(uuid.uuid4())),
+        ('WARC-Date', datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')),
+        ('WARC-Target-URI', url),
+        ('Content-Type', 'application/http; msgtype=response'),
+    ] + fields + [('Content-Length', str(len(http)))]
+    header = 'WARC/1.0\r\n' + ''.join(['{}: {}\r\n'.format(name, value) for name, value in header]) + '\r\n'
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(header.encode('utf-8') + http + b'\r\n\r\n') + compressor.flush()
+
+
+def parse_record(data):
+    """Return the (WARC fields, url, status, headers, body) of a decompressed record."""
+    header, block = data.split(b'\r\n\r\n', 1)
+    fields = dict([line.split(': ', 1) for line in header.decode('utf-8').split('\r\n')[1:]])
+    http = block[:int(fields['Content-Length'])]
+    status_line, http = http.split(b'\r\n', 1)
+    raw_headers, body = http.split(b'\r\n\r\n', 1)
+    return fields, fields['WARC-Target-URI'], int(status_line.split()[1]), headers_raw_to_dict(raw_headers), body
+
+
+def read_records(segment):
+    """The (offset, length, data) of the records of a segment in order, by walking its gzip members."""
+    with open(segment, 'rb') as f:
+        offset = 0
+        while True:
+            f.seek(offset)
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunks = []
+            while not decompressor.eof:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    # the end of the segment, or the last record of a worker that was killed while writing it
+                    return
+                chunks.append(decompressor.decompress(chunk))
+            length = f.tell() - offset - len(decompressor.unused_data)
+            yield offset, length, b''.join(chunks)
+            offset += length
+
+
+class PageArchive(object):
+    """
+    The segments of a spider under ARCHIVE_DIR/<spider name>. The writer of a process appends to its own segment,
+    <time>-<pid>.warc.gz, and starts a new one above ARCHIVE_SEGMENT_BYTES. The index of a segment has a line per
+    record: the request key, offset, length, and whether it was a start request, whose json meta is kept in the
+    record so that the crawl can be replayed from it.
+    """
+    # the meta set by scrapy and the middlewares, not by the spiders
+    internal_meta = ['depth', 'download_timeout', 'download_slot', 'download_latency', 'proxy', 'retry_times',
+                     'handle_httpstatus_list', 'mock_site_url', 'cookiejar', 'redirect_times', 'redirect_urls',
+                     'cookie_label', 'cookie_retries', 'proxy_label']
+
+    def __init__(self, archive_dir, spider_name, segment_bytes=256 * 1024 ** 2):
+        self.spider_dir = os.path.join(archive_dir, spider_name)
+        self.segment_bytes = segment_bytes
+        self.segment = None
+        self.index = None
+        self.records = 0
+        self.bytes_written = 0
+
+    def open_segment(self):
+        self.close()
+        os.makedirs(self.spider_dir, exist_ok=True)
+        name = '{}-{:d}'.format(time.strftime('%Y%m%d%H%M%S'), os.getpid())
+        self.segment = open(os.path.join(self.spider_dir, name + '.warc.gz'), 'ab')
+        self.index = open(os.path.join(self.spider_dir, name + '.idx'), 'a', encoding='utf-8', newline='')
+
+    def write(self, request, response):
+        if self.segment is None or self.segment.tell() >= self.segment_bytes:
+            self.open_segment()
+        callback = request.callback.__name__ if request.callback else 'parse'
+        fields = [('X-Callback', callback)]
+        # only the start requests are not given a depth by the DepthMiddleware before they are downloaded
+        start = 'depth' not in request.meta
+        if start:
+            meta = {}
+            for key, value in request.meta.items():
+                if key in self.internal_meta or key.startswith('_'):
+                    continue
+                try:
+                    json.dumps(value)
+                except (TypeError, ValueError):
+                    continue
+                meta[key] = value
+            fields.append(('X-Start-Meta', json.dumps(meta, ensure_ascii=False)))
+        data = warc_record(response.url, response.status, response.headers, response.body, fields)
+        offset = self.segment.tell()
+        self.segment.write(data)
+        self.segment.flush()
+        # the response keeps the url of the page, not the one of the mock site
+        self.index.write('{}\t{:d}\t{:d}\t{:d}\n'.format(
+            request_key(request.method, response.url, request.body), offset, len(data), start))
+        self.index.flush()
+        self.records += 1
+        self.bytes_written += len(data)
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+            self.segment = self.index = None
+
+    def segments(self):
+        if not os.path.exists(self.spider_dir):
+            return []
+        return sorted([os.path.join(self.spider_dir, name) for name in os.listdir(self.spider_dir)
+                       if name.endswith('.warc.gz')])
+
+    def load_index(self):
+        """
+        Return {request key: (segment, offset, length)} of the latest record of every request and the keys of the
+        start requests. The index of a segment is rebuilt from the segment when it is missing.
+        """
+        index = {}
+        starts = {}
+        for segment in self.segments():
+            index_file = segment[:-len('.warc.gz')] + '.idx'
+            if not os.path.exists(index_file):
+                with open(index_file, 'w', encoding='utf-8', newline='') as f:
+                    for offset, length, data in read_records(segment):
+                        fields, url, _, _, _ = parse_record(data)
+                        # the requests of the spiders are all GET requests without a body
+                        f.write('{}\t{:d}\t{:d}\t{:d}\n'.format(
+                            request_key('GET', url), offset, length, 'X-Start-Meta' in fields))
+            with open(index_file, 'r', encoding='utf-8', newline='') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) != 4:
+                        continue
+                    key, offset, length, start = parts
+                    index[key] = (segment, int(offset), int(length))
+                    if start == '1':
+                        starts[key] = None
+        return index, list(starts)
+
+    @staticmethod
+    def read(segment, offset, length, request=None):
+        """Return the (WARC fields, response) of a record, the response of request when given."""
+        with open(segment, 'rb') as f:
+            f.seek(offset)
+            data = zlib.decompress(f.read(length), 16 + zlib.MAX_WBITS)
+        fields, url, status, headers, body = parse_record(data)
+        headers = Headers(headers)
+        response_cls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return fields, response_cls(url=url, status=status, headers=headers, body=body, request=request)
+
+
+class ArchivePages(object):
+    """
+    Append the pages fetched by the spider to the PageArchive under ARCHIVE_DIR when ARCHIVE_ENABLED. Only the
+    pages with status 200 are archived, and not those served by the http cache, which were archived when they
+    were fetched.
+    """
+    def __init__(self, archive_dir, segment_bytes):
+        self.archive_dir = archive_dir
+        self.segment_bytes = segment_bytes
+        self.archive = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ARCHIVE_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler.settings.get('ARCHIVE_DIR'), crawler.settings.getint('ARCHIVE_SEGMENT_BYTES'))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        return ext
+
+    def spider_opened(self, spider):
+        self.archive = PageArchive(self.archive_dir, spider.name, self.segment_bytes)
+
+    def spider_closed(self, spider, reason):
+        self.archive.close()
+        spider.logger.info("page archive: {:d} pages archived, {:.1f}MB compressed".format(
+            self.archive.records, self.archive.bytes_written / 1024 ** 2))
+
+    def response_received(self, response, request, spider):
+        if response.status != 200 or 'cached' in response.flags:
+            return
+        self.archive.write(request, response)
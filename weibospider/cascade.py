@@ -0,0 +1,147 @@
+# encoding: utf-8
+"""
+The repost cascades of RepostSpider: the repost trees of many tweets, rebuilt from the //@user chains of the repost
+contents and kept in concatenated int64 arrays, with the depth, breadth and growth metrics computed on the arrays
+of all cascades at once instead of on a python object per repost.
+"""
+import re
+import numpy as np
+from graph import save_npz
+
+# the first user of the chain of a repost is the one it was reposted from: text//@B: text of B//@C: text of C
+PARENT_RE = re.compile(r'//@([\w-]+)')
+
+
+def parent_name(content):
+    match = PARENT_RE.search(content)
+    return match.group(1) if match else None
+
+
+class Cascades(object):
+    """
+    The repost trees of tweet_ids. The reposts of cascade i are offsets[i]:offsets[i + 1] of user_ids, times and
+    parents, in order of time. parents holds the index of the parent of a repost within its cascade, -1 for a
+    repost of the tweet itself, so that a parent always comes before its children.
+    """
+    def __init__(self, tweet_ids, offsets, user_ids, times, parents):
+        self.tweet_ids = np.asarray(tweet_ids, dtype=str)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.times = np.asarray(times, dtype=np.int64)
+        self.parents = np.asarray(parents, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.tweet_ids)
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    def cascade(self, i):
+        """The (user_ids, times, parents) arrays of the cascade i, as views."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.user_ids[start:end], self.times[start:end], self.parents[start:end]
+
+    def cascade_index(self):
+        # the cascade of every repost
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.sizes)
+
+    @classmethod
+    def build(cls, tweet_ids, cascade, user_ids, times, positions, names, parent_names):
+        """
+        Build the trees from the reposts of all cascades, given as arrays in any order: the index of their tweet in
+        tweet_ids, the user id, the time, the position in the repost list (page and row, newest first), and codes
+        of the user name and of the name the repost was reposted from (-1 for none). The parent of a repost is the
+        latest earlier repost of that name in its cascade, a name without one (the author of the tweet, or a
+        repost that was not crawled) is taken as a repost of the tweet.
+        """
+        cascade, user_ids, times, positions, names, parent_names = [
+            np.asarray(column, dtype=np.int64) for column in [cascade, user_ids, times, positions, names, parent_names]]
+        # weibo.cn shows the times to the minute, the reposts of a minute keep the (reversed) order of the list
+        order = np.lexsort((-positions, times, cascade))
+        cascade, user_ids, times, names, parent_names = [
+            column[order] for column in [cascade, user_ids, times, names, parent_names]]
+        size = len(order)
+        offsets = np.zeros(len(tweet_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cascade, minlength=len(tweet_ids)), out=offsets[1:])
+
+        parents = np.full(size, -1, dtype=np.int64)
+        if size == 0:
+            return cls(tweet_ids, offsets, user_ids, times, parents)
+
+        # the (cascade, name) pairs of the reposts, and those of the names they were reposted from
+        num_names = int(max(names.max(), parent_names.max())) + 1
+        groups, node_groups = np.unique(cascade * num_names + names, return_inverse=True)
+        query = cascade * num_names + parent_names
+        query_groups = np.minimum(np.searchsorted(groups, query), len(groups) - 1)
+        found = (parent_names >= 0) & (groups[query_groups] == query)
+        # the last repost of a group before a repost is found by a binary search over (group, index) keys
+        index = np.arange(size, dtype=np.int64)
+        keys = np.sort(node_groups.astype(np.int64) * size + index)
+        before = np.searchsorted(keys, query_groups * size + index) - 1
+        found &= before >= 0
+        found[found] &= keys[before[found]] // size == query_groups[found]
+        parents[found] = keys[before[found]] % size - offsets[cascade[found]]
+        return cls(tweet_ids, offsets, user_ids, times, parents)
+
+    def global_parents(self):
+        # the parents as indices into the concatenated arrays, -1 for the tweets
+        parents = self.parents.copy()
+        reposts = parents >= 0
+        parents[reposts] += self.offsets[self.cascade_index()[reposts]]
+        return parents
+
+    def depths(self):
+        """The depth of every repost, 1 for the reposts of the tweet, by pointer jumping over all cascades."""
+        ancestors = self.global_parents()
+        depths = np.ones(len(ancestors), dtype=np.int64)
+        jumping = ancestors >= 0
+        while jumping.any():
+            # depths[i] is the distance from i to ancestors[i], both double every round
+            depths[jumping] += depths[ancestors[jumping]]
+            ancestors[jumping] = ancestors[ancestors[jumping]]
+            jumping = ancestors >= 0
+        return depths
+
+    def metrics(self):
+        """
+        The size, max depth, mean depth, max breadth (reposts of a depth) and duration (seconds from the first to
+        the last repost) of every cascade, as arrays keyed by name.
+        """
+        sizes = self.sizes
+        depths = self.depths()
+        cascade = self.cascade_index()
+        max_depths = np.zeros(len(self), dtype=np.int64)
+        np.maximum.at(max_depths, cascade, depths)
+        mean_depths = np.bincount(cascade, weights=depths, minlength=len(self)) / np.maximum(sizes, 1)
+        width = int(depths.max(initial=0)) + 1
+        breadths = np.bincount(cascade * width + depths, minlength=len(self) * width).reshape(len(self), width)
+        durations = np.zeros(len(self), dtype=np.int64)
+        non_empty = sizes > 0
+        durations[non_empty] = self.times[self.offsets[1:][non_empty] - 1] - self.times[self.offsets[:-1][non_empty]]
+        return {'tweet_id': self.tweet_ids, 'size': sizes, 'depth': max_depths, 'mean_depth': mean_depths,
+                'breadth': breadths.max(axis=1), 'duration': durations}
+
+    def growth(self, interval, num_intervals):
+        """
+        The number of reposts of every cascade by the end of each of num_intervals intervals of interval seconds
+        after its first repost, an array of (len(self), num_intervals).
+        """
+        if len(self.times) == 0:
+            return np.zeros((len(self), num_intervals), dtype=np.int64)
+        cascade = self.cascade_index()
+        first_times = self.times[np.minimum(self.offsets[:-1], len(self.times) - 1)]
+        intervals = (self.times - first_times[cascade]) // interval
+        within = intervals < num_intervals
+        counts = np.bincount(cascade[within] * num_intervals + intervals[within],
+                             minlength=len(self) * num_intervals).reshape(len(self), num_intervals)
+        return counts.cumsum(axis=1)
+
+    def save(self, file):
+        save_npz(file, tweet_ids=self.tweet_ids, offsets=self.offsets, user_ids=self.user_ids, times=self.times,
+                 parents=self.parents)
+
+    @classmethod
+    def load(cls, file):
+        data = np.load(file)
+        return cls(data['tweet_ids'], data['offsets'], data['user_ids'], data['times'], data['parents'])
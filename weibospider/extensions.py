@@ -0,0 +1,192 @@
+# encoding: utf-8
+import os
+import json
+import time
+import hashlib
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from twisted.internet import task
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+
+class CrawlMetrics(object):
+    """
+    Live counters of a spider: requests, items by type, response statuses, bans and redirects to the login page,
+    queue depth and the download latency per cookie and per proxy. Every METRICS_INTERVAL seconds they are
+    written to METRICS_FILE as json, and served in the prometheus text format on METRICS_PORT + the worker index
+    (METRICS_PORT itself outside a worker directory) when METRICS_PORT is set.
+    """
+    ban_statuses = [403, 418]
+    login_urls = ['passport.weibo.cn', 'login.sina.com.cn', 'weibo.cn/pub']
+
+    def __init__(self, crawler, interval, metrics_file, port):
+        self.crawler = crawler
+        self.interval = interval
+        self.metrics_file = metrics_file
+        self.port = port
+        self.worker = os.path.basename(os.path.split(os.path.realpath(__file__))[0])
+        self.requests = 0
+        self.responses = 0
+        self.items = {}
+        self.statuses = {}
+        self.bans = 0
+        self.login_redirects = 0
+        self.latencies = {'cookie': {}, 'proxy': {}}
+        self.last = (time.time(), 0, {})
+        self.metrics = {}
+        self.text = ''
+        self.started_at = time.time()
+        self.task = None
+        self.server = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        interval = crawler.settings.getfloat('METRICS_INTERVAL')
+        if not interval:
+            raise NotConfigured
+        port = crawler.settings.getint('METRICS_PORT')
+        worker = os.path.basename(os.path.split(os.path.realpath(__file__))[0]).split('_')[-1]
+        if port and worker.isdigit():
+            # outside a weibospider_<n> worker directory, like scrapy crawl in weibospider, the base port is used
+            port += int(worker)
+        ext = cls(crawler, interval, crawler.settings.get('METRICS_FILE'), port)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        return ext
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        if self.port:
+            self.server = HTTPServer(('127.0.0.1', self.port), self.handler())
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.task = task.LoopingCall(self.dump)
+        self.task.start(self.interval)
+
+    def spider_closed(self, spider, reason):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        self.dump(closed=True)
+        if self.server is not None:
+            self.server.shutdown()
+
+    def request_scheduled(self, request, spider):
+        self.requests += 1
+
+    def response_received(self, response, request, spider):
+        self.responses += 1
+        self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+        if response.status in self.ban_statuses:
+            self.bans += 1
+        location = response.headers.get('Location', b'').decode('utf-8', 'ignore')
+        if response.status in [301, 302] and any([url in location for url in self.login_urls]):
+            self.login_redirects += 1
+        latency = request.meta.get('download_latency')
+        if latency is None:
+            return
+        # cookies are only identified by a digest, they must not end up in the metrics
+        cookie = request.headers.get('Cookie', b'')
+        labels = {
+            'cookie': hashlib.md5(cookie).hexdigest()[:8] if cookie else 'none',
+            'proxy': request.meta.get('proxy') or 'direct',
+        }
+        for kind, label in labels.items():
+            latency_sum, count, latency_max = self.latencies[kind].get(label, (0.0, 0, 0.0))
+            self.latencies[kind][label] = (latency_sum + latency, count + 1, max(latency_max, latency))
+
+    def item_scraped(self, item, response, spider):
+        item_type = type(item).__name__
+        self.items[item_type] = self.items.get(item_type, 0) + 1
+
+    def queue_depth(self):
+        engine = self.crawler.engine
+        slot = getattr(engine, 'slot', None) or getattr(engine, '_slot', None)
+        if engine is None or slot is None:
+            return 0, 0
+        return len(slot.scheduler), len(engine.downloader.active)
+
+    def dump(self, closed=False):
+        now = time.time()
+        last_time, last_requests, last_items = self.last
+        elapsed = max(now - last_time, 1e-6)
+        queue_depth, in_progress = self.queue_depth() if not closed else (0, 0)
+        self.metrics = {
+            'worker': self.worker,
+            'spider': self.spider.name,
+            'pid': os.getpid(),
+            'started_at': self.started_at,
+            'updated_at': now,
+            'closed': closed,
+            'requests': self.requests,
+            'responses': self.responses,
+            'items': dict(self.items),
+            'statuses': {str(status): count for status, count in self.statuses.items()},
+            'bans': self.bans,
+            'login_redirects': self.login_redirects,
+            'requests_per_second': 0.0 if closed else (self.requests - last_requests) / elapsed,
+            'items_per_second': {item_type: 0.0 if closed else (count - last_items.get(item_type, 0)) / elapsed
+                                 for item_type, count in self.items.items()},
+            'queue_depth': queue_depth,
+            'in_progress': in_progress,
+            'latency': {kind: {label: {'sum': value[0], 'count': value[1], 'max': value[2]}
+                               for label, value in latencies.items()} for kind, latencies in self.latencies.items()},
+        }
+        self.last = (now, self.requests, dict(self.items))
+        self.text = prometheus(self.metrics)
+        if self.metrics_file:
+            metrics_dir = os.path.dirname(self.metrics_file)
+            if not os.path.exists(metrics_dir):
+                os.makedirs(metrics_dir)
+            # write to a temp file first, so readers never see a partial file
+            with open(self.metrics_file + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.metrics, f)
+            os.replace(self.metrics_file + '.tmp', self.metrics_file)
+
+    def handler(self):
+        ext = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = ext.text.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return MetricsHandler
+
+
+def prometheus(metrics, labels=None):
+    """Render metrics dumped by CrawlMetrics (or rolled up from several of them) in the prometheus text format."""
+    labels = labels if labels is not None else {'worker': metrics['worker'], 'spider': metrics['spider']}
+
+    def line(name, value, **extra):
+        pairs = dict(labels, **extra)
+        label_text = ','.join(['{:s}="{:s}"'.format(key, str(pairs[key]).replace('"', '\\"')) for key in pairs])
+        return 'weibo_{:s}{{{:s}}} {:g}'.format(name, label_text, value)
+
+    lines = [
+        line('requests_total', metrics['requests']),
+        line('responses_total', metrics['responses']),
+        line('bans_total', metrics['bans']),
+        line('login_redirects_total', metrics['login_redirects']),
+        line('requests_per_second', metrics['requests_per_second']),
+        line('queue_depth', metrics['queue_depth']),
+        line('requests_in_progress', metrics['in_progress']),
+    ]
+    lines += [line('responses_by_status_total', count, status=status) for status, count in metrics['statuses'].items()]
+    lines += [line('items_total', count, type=item_type) for item_type, count in metrics['items'].items()]
+    lines += [line('items_per_second', rate, type=item_type) for item_type, rate in metrics['items_per_second'].items()]
+    for kind, latencies in metrics['latency'].items():
+        for label, latency in latencies.items():
+            lines.append(line('download_latency_seconds_sum', latency['sum'], **{kind: label}))
+            lines.append(line('download_latency_seconds_count', latency['count'], **{kind: label}))
+            lines.append(line('download_latency_seconds_max', latency['max'], **{kind: label}))
+    return '\n'.join(lines) + '\n'
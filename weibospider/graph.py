@@ -0,0 +1,108 @@
+# encoding: utf-8
+"""
+The data structures of the social-graph crawl of FanSpider and FollowerSpider: a bloom filter of the visited user
+ids and a compact store of the edges, which are kept in int64 arrays and loaded for analysis as csr arrays.
+"""
+import math
+import hashlib
+import numpy as np
+
+
+def save_npz(file, **arrays):
+    # through a file object, so that numpy does not append .npz to the name
+    with open(file, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+
+class BloomFilter(object):
+    """
+    A bloom filter of the visited user ids, about 1.44 * log2(1 / error_rate) bits per id for capacity ids. Ids
+    are never reported as unvisited once added, an unvisited id is taken for a visited one with error_rate.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        # double hashing of one 128 bit digest instead of num_hashes digests
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key):
+        return all([self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key)])
+
+    def add(self, key):
+        """Add the key, returns False when it was (most likely) added before."""
+        added = False
+        for position in self.positions(key):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+
+class EdgeStore(object):
+    """
+    The directed edges (src, dst) of a graph in two int64 arrays that grow by doubling, without a python object
+    per edge. An edge src -> dst means that src follows dst.
+    """
+    def __init__(self, capacity=1 << 16):
+        self.src = np.empty(capacity, dtype=np.int64)
+        self.dst = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, src, dst):
+        """Append the edges, src and dst are ids or arrays of ids broadcast against each other."""
+        src, dst = np.broadcast_arrays(np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64))
+        src, dst = src.ravel(), dst.ravel()
+        size = self.size + len(src)
+        if size > len(self.src):
+            capacity = max(size, 2 * len(self.src))
+            self.src = np.resize(self.src, capacity)
+            self.dst = np.resize(self.dst, capacity)
+        self.src[self.size:size] = src
+        self.dst[self.size:size] = dst
+        self.size = size
+
+    def edges(self):
+        return self.src[:self.size], self.dst[:self.size]
+
+    def save(self, file):
+        src, dst = self.edges()
+        save_npz(file, src=src, dst=dst)
+
+    @classmethod
+    def load(cls, file):
+        data = np.load(file)
+        store = cls(max(len(data['src']), 1))
+        store.extend(data['src'], data['dst'])
+        return store
+
+    def to_csr(self):
+        """
+        Return (ids, indptr, indices) over the sorted distinct ids, without duplicate edges: the users followed by
+        ids[i] are ids[indices[indptr[i]:indptr[i + 1]]], in order of their ids.
+        """
+        src, dst = self.edges()
+        ids, inverse = np.unique(np.concatenate([src, dst]), return_inverse=True)
+        rows, cols = inverse[:self.size], inverse[self.size:]
+        order = np.lexsort((cols, rows))
+        rows, cols = rows[order], cols[order]
+        if len(rows) > 0:
+            unique = np.concatenate([[True], (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])])
+            rows, cols = rows[unique], cols[unique]
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(ids)), out=indptr[1:])
+        return ids, indptr, cols.astype(np.int64)
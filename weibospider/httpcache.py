@@ -0,0 +1,183 @@
+# encoding: utf-8
+import os
+import re
+import time
+import zlib
+import hashlib
+import sqlite3
+import datetime
+from urllib.parse import urlparse, parse_qs
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+from w3lib.url import canonicalize_url
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+
+def request_key(method, url, body=b''):
+    # the cookies and other headers of a request do not change the page
+    return hashlib.sha1(b'\n'.join([method.encode('utf-8'), canonicalize_url(url).encode('utf-8'),
+                                    body or b''])).hexdigest()
+
+
+class ContentCacheStorage(object):
+    """
+    A HTTPCACHE_STORAGE for the HttpCacheMiddleware of scrapy, shared by the workers of a run directory. The
+    bodies are stored zlib compressed under the sha1 of their content, so that the pages fetched by several
+    requests are stored once, and an sqlite index maps the requests to them. A response expires after the ttl of
+    its url class in HTTPCACHE_TTLS, the least recently used responses are evicted above HTTPCACHE_MAX_BYTES of
+    bodies, and the hit rates by url class are logged and put in the crawl stats when the spider closes.
+    """
+    # the url classes in order of matching, the search windows that ended HTTPCACHE_OLD_DAYS ago are search_old
+    url_classes = [
+        ('search', re.compile(r'^/search/')),
+        ('comment', re.compile(r'^/comment/')),
+        ('repost', re.compile(r'^/repost/')),
+        ('relationship', re.compile(r'^/\d+/(?:fans|follow)$')),
+        ('profile', re.compile(r'^/(?:u/\d+|\d+/info|\d+/profile|\w+)$')),
+    ]
+    # stores between two checks of the size of the cache
+    evict_interval = 256
+
+    def __init__(self, settings):
+        self.cache_dir = settings.get('HTTPCACHE_DIR')
+        self.ttls = settings.getdict('HTTPCACHE_TTLS')
+        self.old_days = settings.getint('HTTPCACHE_OLD_DAYS', 2)
+        self.max_bytes = settings.getint('HTTPCACHE_MAX_BYTES')
+        self.db_file = os.path.join(self.cache_dir, 'index.db')
+        self.conn = None
+        self.stats = None
+        self.lookups = {}
+        self.hits = {}
+        self.stores = 0
+        self.bytes_read = 0
+        self.bytes_stored = 0
+        self.accessed = {}
+
+    def open_spider(self, spider):
+        if not os.path.exists(os.path.join(self.cache_dir, 'bodies')):
+            os.makedirs(os.path.join(self.cache_dir, 'bodies'), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_file, timeout=600, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, url TEXT, status INTEGER, '
+                          'headers BLOB, digest TEXT, stored_at REAL, accessed_at REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_digest ON responses (digest)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS bodies (digest TEXT PRIMARY KEY, size INTEGER)')
+        self.stats = spider.crawler.stats
+
+    def close_spider(self, spider):
+        self.evict()
+        self.conn.close()
+        lookups = sum(self.lookups.values())
+        hits = sum(self.hits.values())
+        self.stats.set_value('httpcache/hit_rate', hits / lookups if lookups else 0.0)
+        for url_class, num_lookups in self.lookups.items():
+            self.stats.set_value('httpcache/hit_rate/' + url_class, self.hits.get(url_class, 0) / num_lookups)
+        spider.logger.info("http cache: {:d} of {:d} requests hit ({:.1%}), {:s}; {:d} responses stored, {:.1f}MB "
+                           "read and {:.1f}MB stored compressed".format(
+                               hits, lookups, hits / lookups if lookups else 0.0,
+                               ', '.join(['{:s} {:d}/{:d}'.format(url_class, self.hits.get(url_class, 0), num_lookups)
+                                          for url_class, num_lookups in sorted(self.lookups.items())]),
+                               self.stores, self.bytes_read / 1024 ** 2, self.bytes_stored / 1024 ** 2))
+
+    def url_class(self, url):
+        url = urlparse(url)
+        for url_class, pattern in self.url_classes:
+            if pattern.match(url.path):
+                break
+        else:
+            return 'default'
+        if url_class == 'search':
+            end_time = parse_qs(url.query).get('endtime', [''])[0][:8]
+            if end_time.isdigit() and len(end_time) == 8:
+                end_date = datetime.datetime.strptime(end_time, '%Y%m%d')
+                if end_date < datetime.datetime.now() - datetime.timedelta(days=self.old_days):
+                    return 'search_old'
+        return url_class
+
+    def ttl(self, url_class):
+        return self.ttls.get(url_class, self.ttls.get('default', 0))
+
+    def body_file(self, digest):
+        return os.path.join(self.cache_dir, 'bodies', digest[:2], digest + '.z')
+
+    def retrieve_response(self, spider, request):
+        url_class = self.url_class(request.url)
+        self.lookups[url_class] = self.lookups.get(url_class, 0) + 1
+        ttl = self.ttl(url_class)
+        if ttl <= 0:
+            return None
+        key = request_key(request.method, request.url, request.body)
+        row = self.conn.execute('SELECT url, status, headers, digest, stored_at FROM responses WHERE key = ?',
+                                (key,)).fetchone()
+        if row is None or row[4] < time.time() - ttl:
+            return None
+        url, status, headers, digest, stored_at = row
+        try:
+            with open(self.body_file(digest), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            # evicted by another worker in the meantime
+            return None
+        body = zlib.decompress(data)
+        self.hits[url_class] = self.hits.get(url_class, 0) + 1
+        self.bytes_read += len(data)
+        self.accessed[key] = time.time()
+        headers = Headers(headers_raw_to_dict(headers))
+        response_cls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return response_cls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        # the bans, errors and redirects to the login page are not cached
+        if response.status != 200 or self.ttl(self.url_class(request.url)) <= 0:
+            return
+        digest = hashlib.sha1(response.body).hexdigest()
+        body_file = self.body_file(digest)
+        if not os.path.exists(body_file):
+            data = zlib.compress(response.body)
+            os.makedirs(os.path.dirname(body_file), exist_ok=True)
+            # written to a temporary file first, so that the other workers never read a partial body
+            temp_file = '{:s}.{:d}'.format(body_file, os.getpid())
+            with open(temp_file, 'wb') as f:
+                f.write(data)
+            os.replace(temp_file, body_file)
+            self.conn.execute('INSERT OR REPLACE INTO bodies (digest, size) VALUES (?, ?)', (digest, len(data)))
+            self.bytes_stored += len(data)
+        now = time.time()
+        self.conn.execute('INSERT OR REPLACE INTO responses (key, url, status, headers, digest, stored_at, '
+                          'accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                          (request_key(request.method, request.url, request.body), response.url, response.status,
+                           headers_dict_to_raw(response.headers), digest, now, now))
+        self.stores += 1
+        if self.stores % self.evict_interval == 0:
+            self.evict()
+
+    def evict(self):
+        """Evict the least recently used responses and their unshared bodies down to 90% of max_bytes."""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany('UPDATE responses SET accessed_at = ? WHERE key = ?',
+                                  [(accessed_at, key) for key, accessed_at in self.accessed.items()])
+            self.accessed = {}
+            size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
+            digests = []
+            while self.max_bytes and size > self.max_bytes * 0.9:
+                keys = self.conn.execute('SELECT key FROM responses ORDER BY accessed_at LIMIT 100').fetchall()
+                if len(keys) == 0:
+                    break
+                self.conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+                bodies = self.conn.execute('SELECT digest, size FROM bodies WHERE digest NOT IN '
+                                           '(SELECT digest FROM responses)').fetchall()
+                self.conn.executemany('DELETE FROM bodies WHERE digest = ?', [(digest,) for digest, _ in bodies])
+                size -= sum([body_size for _, body_size in bodies])
+                digests.extend([digest for digest, _ in bodies])
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        for digest in digests:
+            try:
+                os.remove(self.body_file(digest))
+            except FileNotFoundError:
+                pass
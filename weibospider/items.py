@@ -48,7 +48,7 @@ class RelationshipItem(Item):
     _id = Field()
     fan_id = Field()  # 关注者,即粉丝的id
     followed_id = Field()  # 被关注者的id
-    # crawl_time = Field()  # 抓取时间戳
+    crawl_time = Field()  # 抓取时间戳
 
 
 class CommentItem(Item):
@@ -73,4 +73,4 @@ class RepostItem(Item):
     content = Field()  # 转发的内容
     weibo_id = Field()  # 转发的微博的id
     created_at = Field()  # 转发时间
-    # crawl_time = Field()  # 抓取时间戳
+    crawl_time = Field()  # 抓取时间戳
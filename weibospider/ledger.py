@@ -0,0 +1,47 @@
+# encoding: utf-8
+import sqlite3
+
+
+class CrawlLedger(object):
+    """
+    A persistent record of the finished units of a crawl (keyword windows, tweet comments, user batches
+    and runner phases) together with the files they produced, so that a resumed run can skip them.
+    """
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=600, isolation_level=None)
+        conn.execute('CREATE TABLE IF NOT EXISTS units (unit TEXT, key TEXT, output TEXT, PRIMARY KEY (unit, key))')
+        return conn
+
+    def is_done(self, unit, key):
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT 1 FROM units WHERE unit = ? AND key = ?', (unit, key)).fetchone()
+        finally:
+            conn.close()
+        return row is not None
+
+    def get(self, unit, key):
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT output FROM units WHERE unit = ? AND key = ?', (unit, key)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row is not None else None
+
+    def mark_done(self, unit, key, output=''):
+        conn = self.connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO units (unit, key, output) VALUES (?, ?, ?)', (unit, key, output))
+        finally:
+            conn.close()
+
+    def units(self, unit):
+        conn = self.connect()
+        try:
+            rows = conn.execute('SELECT key, output FROM units WHERE unit = ? ORDER BY rowid', (unit,)).fetchall()
+        finally:
+            conn.close()
+        return rows
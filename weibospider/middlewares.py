@@ -1,24 +1,464 @@
 # encoding: utf-8
 import os
+import time
+import hashlib
+import logging
+import urllib.request
+from collections import deque
+from twisted.internet import reactor, task, threads
+from twisted.internet.task import deferLater
+from twisted.python.threadpool import ThreadPool
+from scrapy import signals
+from scrapy.exceptions import NotConfigured, IgnoreRequest
+from extensions import CrawlMetrics
 
-ips_file = os.path.join(os.path.split(os.path.realpath(__file__))[0], 'ips.txt')
-with open(ips_file, 'r', encoding='utf-8-sig', newline='') as f:
-    ips = f.readlines()
-    ips = [ip.strip() for ip in ips]
-    ips = [ip if ip != 'default' else None for ip in ips]
-IPS = dict(zip(range(len(ips)), ips))
+logger = logging.getLogger(__name__)
+
+# sent with the request by a middleware that retries it from process_response, the middlewares after it in the
+# response chain never see the response and release what they hold for the request on this signal
+request_retried = object()
+
+
+def probe_proxy(proxy, url, timeout):
+    """Fetch url through the proxy, None for the direct connection, and return the latency. Run in a thread."""
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': proxy, 'https': proxy} if proxy else {}))
+    started_at = time.time()
+    with opener.open(url, timeout=timeout) as response:
+        response.read()
+    return time.time() - started_at
+
+
+class ProxyHealth(object):
+    """The latencies and outcomes of the last requests and probes through a proxy, None for the direct connection."""
+
+    def __init__(self, proxy, window):
+        self.proxy = proxy
+        # the credentials of a proxy must not end up in the logs
+        self.label = proxy.split('://', 1)[-1].rsplit('@', 1)[-1] if proxy else 'direct'
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+        self.in_flight = 0
+        self.probing = False
+        self.evicted = False
+
+    def record(self, success, latency=None):
+        self.outcomes.append(success)
+        if success and latency is not None:
+            self.latencies.append(latency)
+
+    def error_rate(self):
+        return 1.0 - sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def percentile(self, q):
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[int(round(q * (len(latencies) - 1)))]
+
+    def reset(self):
+        self.latencies.clear()
+        self.outcomes.clear()
 
 
 class IPProxyMiddleware(object):
+    """
+    A pool of the proxies of PROXIES_FILE, ip:port or user:password@ip:port per line, default for the direct
+    connection. A request goes through the healthy proxy with the lowest median latency per request in flight
+    (PROXIES_SELECTION = 'fastest') or with the fewest requests in flight ('least_loaded'). The latencies and
+    outcomes of the last PROXIES_WINDOW requests and probes of every proxy are kept, a proxy is evicted when its
+    error rate reaches PROXIES_MAX_ERROR_RATE or its 90th percentile latency exceeds PROXIES_MAX_LATENCY. Every
+    PROXIES_PROBE_INTERVAL seconds all the proxies fetch PROXIES_PROBE_URL in the background, on PROXIES_PROBE_THREADS
+    threads of their own, an evicted proxy comes back when it answers a probe in time again.
+    """
+    # the statuses of a proxy that failed to relay a request, the bans of weibo.cn are left to the cookie pool
+    error_statuses = [407, 502, 503, 504]
+    # outcomes of a proxy before it can be evicted
+    min_outcomes = 5
+
+    def __init__(self, settings, stats):
+        self.proxies_file = settings.get('PROXIES_FILE')
+        self.selection = settings.get('PROXIES_SELECTION', 'fastest')
+        self.probe_url = settings.get('PROXIES_PROBE_URL')
+        self.probe_interval = settings.getfloat('PROXIES_PROBE_INTERVAL')
+        self.probe_timeout = settings.getfloat('PROXIES_PROBE_TIMEOUT')
+        self.probe_threads = settings.getint('PROXIES_PROBE_THREADS', 2)
+        self.max_error_rate = settings.getfloat('PROXIES_MAX_ERROR_RATE')
+        self.max_latency = settings.getfloat('PROXIES_MAX_LATENCY')
+        self.stats = stats
+        proxies = []
+        if os.path.exists(self.proxies_file):
+            with open(self.proxies_file, 'r', encoding='utf-8-sig', newline='') as f:
+                proxies = list(dict.fromkeys([line.strip() for line in f if line.strip()]))
+        proxies = [None if proxy == 'default' else 'http://' + proxy for proxy in proxies] or [None]
+        worker = os.path.basename(os.path.split(os.path.realpath(__file__))[0]).split('_')[-1]
+        if worker.isdigit():
+            # the workers of a run start from different proxies
+            shift = int(worker) % len(proxies)
+            proxies = proxies[shift:] + proxies[:shift]
+        window = settings.getint('PROXIES_WINDOW')
+        self.proxies = [ProxyHealth(proxy, window) for proxy in proxies]
+        self.labels = {health.label: health for health in self.proxies}
+        self.task = None
+        self.threadpool = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mw = cls(crawler.settings, crawler.stats)
+        crawler.signals.connect(mw.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(mw.request_retried, signal=request_retried)
+        return mw
+
+    def spider_opened(self, spider):
+        if self.probe_interval and self.probe_url and len(self.proxies) > 1:
+            # the probes block their threads for up to PROXIES_PROBE_TIMEOUT, so they do not take the threads of the
+            # reactor, which resolve the hostnames of the crawl
+            self.threadpool = ThreadPool(minthreads=0, maxthreads=self.probe_threads, name='proxy-probes')
+            self.threadpool.start()
+            # stopping it waits for the probes still running, which is left to the shutdown of the reactor
+            reactor.addSystemEventTrigger('during', 'shutdown', self.threadpool.stop)
+            self.task = task.LoopingCall(self.probe)
+            self.task.start(self.probe_interval)
+
+    def probe(self):
+        for health in self.proxies:
+            if health.probing:
+                continue
+            health.probing = True
+            d = threads.deferToThreadPool(reactor, self.threadpool, probe_proxy, health.proxy, self.probe_url,
+                                          self.probe_timeout)
+            d.addCallbacks(self.probed, self.probe_failed, callbackArgs=(health,), errbackArgs=(health,))
+
+    def probed(self, latency, health):
+        health.probing = False
+        if health.evicted and latency <= self.max_latency:
+            # the outcomes before the eviction would evict it again
+            health.reset()
+            health.evicted = False
+            logger.info("proxy {:s} is back, probed in {:.2f}s".format(health.label, latency))
+        health.record(True, latency)
+        self.check(health)
+
+    def probe_failed(self, failure, health):
+        health.probing = False
+        health.record(False)
+        self.check(health)
+
+    def check(self, health):
+        if health.evicted or len(health.outcomes) < self.min_outcomes:
+            return
+        error_rate, latency = health.error_rate(), health.percentile(0.9)
+        if error_rate < self.max_error_rate and latency <= self.max_latency:
+            return
+        health.evicted = True
+        self.stats.inc_value('proxies/evictions')
+        logger.warning("proxy {:s} evicted, {:.0%} errors, p90 {:.2f}s, {:d} of {:d} proxies left".format(
+            health.label, error_rate, latency, len([health for health in self.proxies if not health.evicted]),
+            len(self.proxies)))
+
+    def choose(self):
+        healthy = [health for health in self.proxies if not health.evicted]
+        if not healthy:
+            # all of them were evicted, the least failing one is used rather than stopping the crawl
+            return min(self.proxies, key=lambda health: (health.error_rate(), health.percentile(0.5)))
+        if self.selection == 'least_loaded':
+            return min(healthy, key=lambda health: (health.in_flight, health.error_rate(), health.percentile(0.5)))
+        return min(healthy, key=lambda health: (self.expected_latency(health) * (health.in_flight + 1), health.in_flight))
+
+    def expected_latency(self, health):
+        # the latency of a successful request, a proxy that only failed so far is taken as the slowest allowed
+        if not health.latencies:
+            latency = self.max_latency if health.outcomes else 0.0
+        else:
+            latency = health.percentile(0.5)
+        return latency / max(1.0 - health.error_rate(), 0.01)
+
+    def release(self, request):
+        # the label is taken off, so that a request is only released once
+        health = self.labels.get(request.meta.pop('proxy_label', None))
+        if health is not None:
+            health.in_flight = max(health.in_flight - 1, 0)
+        return health
+
+    def process_request(self, request, spider):
+        health = self.choose()
+        health.requests += 1
+        health.in_flight += 1
+        request.meta['proxy_label'] = health.label
+        request.meta['proxy'] = health.proxy
+
+    def process_response(self, request, response, spider):
+        health = self.release(request)
+        if health is None or 'cached' in response.flags:
+            return response
+        if response.status in self.error_statuses:
+            health.record(False)
+        else:
+            health.record(True, request.meta.get('download_latency'))
+        self.check(health)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        health = self.release(request)
+        if health is not None and not isinstance(exception, IgnoreRequest):
+            health.record(False)
+            self.check(health)
+
+    def request_retried(self, request):
+        # the proxy relayed the response that the cookie pool retried
+        health = self.release(request)
+        if health is not None:
+            health.record(True, request.meta.get('download_latency'))
+            self.check(health)
+
+    def spider_closed(self, spider, reason):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        self.stats.set_value('proxies/healthy', len([health for health in self.proxies if not health.evicted]))
+        self.stats.set_value('proxies/evicted', len([health for health in self.proxies if health.evicted]))
+        spider.logger.info("proxy pool: {:s}".format(', '.join([
+            '{:s} {:s} ({:d} requests, p50 {:.2f}s, p90 {:.2f}s, {:.0%} errors)'.format(
+                health.label, 'evicted' if health.evicted else 'healthy', health.requests, health.percentile(0.5),
+                health.percentile(0.9), health.error_rate())
+            for health in self.proxies])))
 
-    def fetch_proxy(self):
-        # You need to rewrite this function if you want to add proxy pool
-        # the function should return a ip in the format of "ip:port" like "12.34.1.4:9090"
-        return IPS[int(os.path.basename(os.path.split(os.path.realpath(__file__))[0]).split('_')[-1]) % len(IPS.keys())]
+
+class CookieHealth(object):
+    """
+    The health of a cookie of the pool: moving averages of its success and latency, its cool down, and the interval
+    between its requests, which doubles with every ban and shrinks with every success, so that the rate of a cookie
+    settles below the limit of its account.
+    """
+    alpha = 0.1
+    interval_decay = 0.95
+
+    def __init__(self, cookie):
+        self.cookie = cookie
+        # cookies are only identified by a digest, like in CrawlMetrics, they must not end up in the logs
+        self.label = hashlib.md5(cookie.encode('utf-8')).hexdigest()[:8]
+        self.success = 1.0
+        self.latency = 0.0
+        self.responses = 0
+        self.in_flight = 0
+        self.strikes = 0
+        self.cool_until = 0.0
+        self.interval = 0.0
+        self.next_at = 0.0
+        self.ejected = False
+
+    def update(self, success, latency=None):
+        self.responses += 1
+        self.success += self.alpha * (float(success) - self.success)
+        if latency is not None:
+            self.latency = latency if self.responses == 1 else self.latency + self.alpha * (latency - self.latency)
+
+    def available_at(self):
+        return max(self.cool_until, self.next_at)
+
+    def score(self):
+        # the success rate per second of latency
+        return self.success / (1.0 + self.latency)
+
+    def state(self, now):
+        if self.ejected:
+            return 'ejected'
+        return 'cooling' if self.cool_until > now else 'healthy'
+
+
+class CookiePoolMiddleware(object):
+    """
+    Assign a cookie of COOKIES_FILE to every request: the available cookie with the fewest requests in flight for
+    its score. A ban cools a cookie down for COOKIES_COOLDOWN seconds, doubled for every ban in a row, and paces
+    its requests from then on, at least COOKIES_INTERVAL seconds apart at first. A cookie is ejected after
+    COOKIES_MAX_STRIKES bans in a row or a redirect to the login page. The requests failed by a cookie are retried
+    with another one up to COOKIES_MAX_RETRIES times, and when no cookie is available the requests wait for the
+    first one in the downloader, which holds back the crawl. COOKIES_FILE is reloaded when it changes, the cookies
+    kept keep their health, so an ejected cookie only comes back after it is replaced by a new login. The pool
+    comes after the HttpCacheMiddleware, the requests served by the http cache never take or wait for a cookie.
+    The crawl fails when COOKIES_FILE has no cookie, and is closed with 'cookies_ejected' once all of them are ejected.
+    """
+    ban_statuses = CrawlMetrics.ban_statuses
+    login_urls = CrawlMetrics.login_urls
+
+    def __init__(self, settings, stats):
+        self.cookies_file = settings.get('COOKIES_FILE')
+        self.reload_interval = settings.getfloat('COOKIES_RELOAD_INTERVAL')
+        self.cooldown = settings.getfloat('COOKIES_COOLDOWN')
+        self.interval = settings.getfloat('COOKIES_INTERVAL')
+        self.max_strikes = settings.getint('COOKIES_MAX_STRIKES')
+        self.max_retries = settings.getint('COOKIES_MAX_RETRIES')
+        self.stats = stats
+        self.worker = os.path.basename(os.path.split(os.path.realpath(__file__))[0]).split('_')[-1]
+        self.cookies = {}
+        self.labels = {}
+        self.mtime = None
+        self.next_reload = 0.0
+        self.crawler = None
+        self.closing = False
+        self.reload()
+        if not self.cookies:
+            # every request would be dropped and the crawl would look finished
+            raise ValueError("no cookies in {:s}, it is missing or empty".format(self.cookies_file))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get('COOKIES_FILE'):
+            raise NotConfigured
+        mw = cls(crawler.settings, crawler.stats)
+        mw.crawler = crawler
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def reload(self):
+        self.next_reload = time.time() + self.reload_interval
+        try:
+            mtime = os.path.getmtime(self.cookies_file)
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        with open(self.cookies_file, 'r', encoding='utf-8-sig', newline='') as f:
+            cookies = list(dict.fromkeys([line.strip() for line in f if line.strip()]))
+        if cookies and self.worker.isdigit():
+            # the workers of a run start from different cookies
+            shift = int(self.worker) % len(cookies)
+            cookies = cookies[shift:] + cookies[:shift]
+        self.cookies = {cookie: self.cookies.get(cookie) or CookieHealth(cookie) for cookie in cookies}
+        self.labels = {health.label: health for health in self.cookies.values()}
+        logger.info("cookie pool: {:d} cookies loaded from {:s}".format(len(self.cookies), self.cookies_file))
+
+    def choose(self):
+        now = time.time()
+        if now >= self.next_reload:
+            self.reload()
+        usable = [health for health in self.cookies.values() if not health.ejected]
+        available = [health for health in usable if health.available_at() <= now]
+        if available:
+            return min(available, key=lambda health: (health.in_flight + 1) / max(health.score(), 1e-3))
+        if usable:
+            return min(usable, key=lambda health: health.available_at())
+        return None
+
+    def release(self, request):
+        # the label is taken off, so that the retries of the request made by the other middlewares go without it
+        health = self.labels.get(request.meta.pop('cookie_label', None))
+        if health is not None:
+            health.in_flight = max(health.in_flight - 1, 0)
+        return health
 
     def process_request(self, request, spider):
-        proxy_data = self.fetch_proxy()
-        if proxy_data:
-            current_proxy = f'http://{proxy_data}'
-            spider.logger.debug(f"current proxy:{current_proxy}")
-            request.meta['proxy'] = current_proxy
+        health = self.choose()
+        if health is None:
+            if not self.closing:
+                # the crawl is stopped with its own reason, so that it is not taken for a finished one
+                self.closing = True
+                self.crawler.engine.close_spider(spider, 'cookies_ejected')
+            raise IgnoreRequest("no cookie left in {:s}, all of them were ejected".format(self.cookies_file))
+        now = time.time()
+        if health.available_at() > now:
+            # the request waits in the downloader, so that the crawl slows down instead of being banned again
+            return deferLater(reactor, health.available_at() - now, self.process_request, request, spider)
+        health.in_flight += 1
+        health.next_at = now + health.interval
+        request.headers['Cookie'] = health.cookie
+        request.meta['cookie_label'] = health.label
+
+    def process_response(self, request, response, spider):
+        health = self.release(request)
+        if health is None:
+            return response
+        location = response.headers.get('Location', b'').decode('utf-8', 'ignore')
+        if response.status in [301, 302] and any([url in location for url in self.login_urls]):
+            health.update(False)
+            self.eject(health, 'redirected to the login page')
+        elif response.status in self.ban_statuses:
+            health.update(False)
+            self.cool_down(health)
+        else:
+            health.update(True, request.meta.get('download_latency'))
+            health.strikes = 0
+            health.interval *= health.interval_decay
+            return response
+        return self.retry(request, response)
+
+    def process_exception(self, request, exception, spider):
+        health = self.release(request)
+        if health is not None and not isinstance(exception, IgnoreRequest):
+            health.update(False)
+
+    def cool_down(self, health):
+        now = time.time()
+        if health.ejected or health.cool_until > now:
+            # banned again by the requests sent before the first ban
+            return
+        health.interval = max(2 * health.interval, self.interval)
+        health.strikes += 1
+        if health.strikes >= self.max_strikes:
+            self.eject(health, 'banned {:d} times in a row'.format(health.strikes))
+            return
+        cooldown = self.cooldown * 2 ** (health.strikes - 1)
+        health.cool_until = now + cooldown
+        self.stats.inc_value('cookies/cool_downs')
+        logger.warning("cookie {:s} banned, cooling down for {:.0f}s".format(health.label, cooldown))
+
+    def eject(self, health, reason):
+        if health.ejected:
+            return
+        health.ejected = True
+        self.stats.inc_value('cookies/ejections')
+        logger.warning("cookie {:s} ejected, {:s}, {:d} of {:d} cookies left".format(
+            health.label, reason, len([health for health in self.cookies.values() if not health.ejected]),
+            len(self.cookies)))
+
+    def retry(self, request, response):
+        retries = request.meta.get('cookie_retries', 0)
+        if retries >= self.max_retries:
+            return response
+        self.stats.inc_value('cookies/retries')
+        # the proxy pool comes after the cookie pool in the response chain and never sees the retried response
+        self.crawler.signals.send_catch_log(request_retried, request=request)
+        retry_request = request.copy()
+        retry_request.meta['cookie_retries'] = retries + 1
+        retry_request.dont_filter = True
+        return retry_request
+
+    def spider_closed(self, spider, reason):
+        now = time.time()
+        states = [health.state(now) for health in self.cookies.values()]
+        for state in ['healthy', 'cooling', 'ejected']:
+            self.stats.set_value('cookies/' + state, states.count(state))
+        spider.logger.info("cookie pool: {:s}".format(', '.join([
+            '{:s} {:s} ({:d} responses, {:.0%} success, {:.2f}s)'.format(
+                health.label, state, health.responses, health.success, health.latency)
+            for health, state in zip(self.cookies.values(), states)])))
+
+
+class MockSiteMiddleware(object):
+    """
+    Send the requests for weibo.cn to the mirror at MOCK_SITE_URL, like the mock server of the benchmarks,
+    the responses keep the weibo.cn urls so that the spiders can not tell the difference.
+    """
+    site_url = 'https://weibo.cn'
+
+    def __init__(self, mock_url):
+        self.mock_url = mock_url.rstrip('/')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mock_url = crawler.settings.get('MOCK_SITE_URL')
+        if not mock_url:
+            raise NotConfigured
+        return cls(mock_url)
+
+    def process_request(self, request, spider):
+        if not request.url.startswith(self.site_url):
+            return None
+        meta = dict(request.meta, mock_site_url=request.url)
+        return request.replace(url=self.mock_url + request.url[len(self.site_url):], meta=meta)
+
+    def process_response(self, request, response, spider):
+        if 'mock_site_url' not in request.meta:
+            return response
+        return response.replace(url=request.meta['mock_site_url'])
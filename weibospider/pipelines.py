@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 import os
 import csv
+import shutil
 import pymongo
+from collections import OrderedDict
 from pymongo.errors import DuplicateKeyError
 from settings import MONGO_HOST, MONGO_PORT, SAVE_ROOT
+from records import TweetRecord, CommentRecord, RepostRecord, RelationshipRecord, UserRecord
 
 
 class MongoDBPipeline(object):
@@ -40,26 +43,30 @@ class MongoDBPipeline(object):
 
 
 class CSVPipeline(object):
+    # comments are routed to one file per tweet, keep at most this many of them open at once
+    max_open_comments_files = 256
 
     def __init__(self):
         if not os.path.exists(SAVE_ROOT):
             os.makedirs(SAVE_ROOT)
+        self.comments_dir = os.path.join(SAVE_ROOT, 'comments')
+        if os.path.exists(self.comments_dir):
+            shutil.rmtree(self.comments_dir)
+        os.makedirs(self.comments_dir)
 
         users_file = open(os.path.join(SAVE_ROOT, 'users.csv'), 'w', encoding='utf-8-sig', newline='')
         tweets_file = open(os.path.join(SAVE_ROOT, 'tweets.csv'), 'w', encoding='utf-8-sig', newline='')
-        comments_file = open(os.path.join(SAVE_ROOT, 'comments.csv'), 'w', encoding='utf-8-sig', newline='')
         relationships_file = open(os.path.join(SAVE_ROOT, 'relationships.csv'), 'w', encoding='utf-8-sig', newline='')
         reposts_file = open(os.path.join(SAVE_ROOT, 'reposts.csv'), 'w', encoding='utf-8-sig', newline='')
 
         self.users_writer = csv.writer(users_file, dialect='excel')
         self.tweets_writer = csv.writer(tweets_file, dialect='excel')
-        self.comments_writer = csv.writer(comments_file, dialect='excel')
+        self.comments_files = OrderedDict()
         self.relationships_writer = csv.writer(relationships_file, dialect='excel')
         self.reposts_writer = csv.writer(reposts_file, dialect='excel')
 
         self.users_head = False
         self.tweets_head = False
-        self.comments_head = False
         self.relationships_head = False
         self.reposts_head = False
 
@@ -70,52 +77,72 @@ class CSVPipeline(object):
         self.reposts_ids = []
 
     def process_item(self, item, spider):
-        item = dict(item)
+        # the columns are the fields of the records, the values are written as they are typed, None as empty
         if spider.name == 'comment_spider':
-            if not self.comments_head:
-                self.comments_writer.writerow(list(item.keys()))
-                self.comments_head = True
+            comments_writer = self.get_comments_writer(item)
             # if item['_id'] not in self.comments_ids:
-            self.comments_writer.writerow(list(item.values()))
+            comments_writer.writerow(CommentRecord.from_item(item).to_row())
             self.comments_ids.append(item['_id'])
 
         elif spider.name == 'fan_spider':
             if not self.relationships_head:
-                self.relationships_writer.writerow(list(item.keys()))
+                self.relationships_writer.writerow(RelationshipRecord.fields)
                 self.relationships_head = True
             # if item['_id'] not in self.relationships_ids:
-            self.relationships_writer.writerow(list(item.values()))
+            self.relationships_writer.writerow(RelationshipRecord.from_item(item).to_row())
             self.relationships_ids.append(item['_id'])
 
         elif spider.name == 'follower_spider':
             if not self.relationships_head:
-                self.relationships_writer.writerow(list(item.keys()))
+                self.relationships_writer.writerow(RelationshipRecord.fields)
                 self.relationships_head = True
             # if item['_id'] not in self.relationships_ids:
-            self.relationships_writer.writerow(list(item.values()))
+            self.relationships_writer.writerow(RelationshipRecord.from_item(item).to_row())
             self.relationships_ids.append(item['_id'])
 
         elif spider.name == 'user_spider':
             if not self.users_head:
-                self.users_writer.writerow(list(item.keys()))
+                self.users_writer.writerow(UserRecord.fields)
                 self.users_head = True
             # if item['_id'] not in self.users_ids:
-            self.users_writer.writerow(list(item.values()))
+            self.users_writer.writerow(UserRecord.from_item(item).to_row())
             self.users_ids.append(item['_id'])
 
         elif spider.name == 'tweet_spider':
             if not self.tweets_head:
-                self.tweets_writer.writerow(list(item.keys()))
+                self.tweets_writer.writerow(TweetRecord.fields)
                 self.tweets_head = True
             # if item['_id'] not in self.tweets_ids:
-            self.tweets_writer.writerow(list(item.values()))
+            self.tweets_writer.writerow(TweetRecord.from_item(item).to_row())
             self.tweets_ids.append(item['_id'])
 
         elif spider.name == 'repost_spider':
             if not self.reposts_head:
-                self.reposts_writer.writerow(list(item.keys()))
+                self.reposts_writer.writerow(RepostRecord.fields)
                 self.reposts_head = True
             # if item['_id'] not in self.reposts_ids:
-            self.reposts_writer.writerow(list(item.values()))
+            self.reposts_writer.writerow(RepostRecord.from_item(item).to_row())
             self.reposts_ids.append(item['_id'])
         return item
+
+    def get_comments_writer(self, item):
+        weibo_id = item['weibo_id']
+        if weibo_id in self.comments_files:
+            self.comments_files.move_to_end(weibo_id)
+            return self.comments_files[weibo_id][1]
+        if len(self.comments_files) >= self.max_open_comments_files:
+            _, (comments_file, _) = self.comments_files.popitem(last=False)
+            comments_file.close()
+        file_name = os.path.join(self.comments_dir, weibo_id + '.csv')
+        file_exists = os.path.exists(file_name)
+        comments_file = open(file_name, 'a', encoding='utf-8-sig', newline='')
+        comments_writer = csv.writer(comments_file, dialect='excel')
+        if not file_exists:
+            comments_writer.writerow(CommentRecord.fields)
+        self.comments_files[weibo_id] = (comments_file, comments_writer)
+        return comments_writer
+
+    def close_spider(self, spider):
+        for comments_file, _ in self.comments_files.values():
+            comments_file.close()
+        self.comments_files.clear()
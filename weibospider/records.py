@@ -0,0 +1,161 @@
+# encoding: utf-8
+"""
+Compact typed records of the crawled tweets, comments, reposts, relationships and users, shared by the spiders,
+the pipelines and the postprocessing of the runner. Ids and counters are ints, times are epoch seconds and what is
+missing is None, the values are only formatted (times, excel hyperlinks) by the exports.
+"""
+import re
+import datetime
+from operator import attrgetter
+
+# weibo.cn shows the times in Beijing time
+CST = datetime.timezone(datetime.timedelta(hours=8), 'CST')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+TIME_FORMATS = [TIME_FORMAT, '%Y-%m-%d %H:%M', '%Y-%m-%d']
+# the null of the files written before the records
+LEGACY_NULL = 'Unknown'
+ID_RE = re.compile(r'(?:/u/|C_)?(\d+)')
+
+
+def unlink(value):
+    # the displayed value of an excel hyperlink formula, other values are returned unchanged
+    if value.startswith('=HYPERLINK(') and value.endswith(')'):
+        return value[len('=HYPERLINK('):-1].split('","')[-1].strip('"')
+    return value
+
+
+def to_epoch(time_string):
+    """The epoch seconds of a 'YYYY-MM-DD HH:MM[:SS]' time of weibo.cn, None when it does not parse."""
+    for time_format in TIME_FORMATS:
+        try:
+            return int(datetime.datetime.strptime(time_string, time_format).replace(tzinfo=CST).timestamp())
+        except ValueError:
+            continue
+    return None
+
+
+def format_time(epoch):
+    if epoch is None:
+        return ''
+    return datetime.datetime.fromtimestamp(epoch, CST).strftime(TIME_FORMAT)
+
+
+def parse_str(value):
+    if value is None or value == '' or value == LEGACY_NULL:
+        return None
+    if value.__class__ is str and value.startswith('=HYPERLINK('):
+        return unlink(value)
+    return value
+
+
+def parse_int(value):
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        # the user urls (/u/123), comment ids (C_123), hyperlinks and nulls of the legacy files
+        match = ID_RE.fullmatch(unlink(value))
+        return int(match.group(1)) if match else None
+
+
+def parse_time(value):
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return to_epoch(value)
+
+
+def field_parsers(fields, int_fields, time_fields):
+    return [parse_int if field in int_fields else parse_time if field in time_fields else parse_str
+            for field in fields]
+
+
+class Record(object):
+    """
+    A typed row of a csv file, fields gives the order of the columns. from_row parses the csv strings (and the
+    typed values of the items), to_row gives the values back for a csv writer, which writes None as empty.
+    """
+    __slots__ = ()
+    fields = []
+    int_fields = []
+    time_fields = []
+    parsers = []
+    getter = None
+
+    def __init__(self, *values):
+        for field, value in zip(self.fields, values):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*[parser(value) for parser, value in zip(cls.parsers, row)])
+
+    @classmethod
+    def from_item(cls, item):
+        return cls.from_row([item.get(field) for field in cls.fields])
+
+    def to_row(self):
+        return list(self.getter(self))
+
+    def __repr__(self):
+        return '{:s}({:s})'.format(type(self).__name__, ', '.join([repr(value) for value in self.to_row()]))
+
+
+class TweetRecord(Record):
+    # _id is the base62 mid of weibo.cn, which is also how its urls address the tweet
+    fields = ['weibo_url', 'user_id', '_id', 'created_at', 'tool', 'like_num', 'repost_num', 'comment_num',
+              'image_url', 'video_url', 'web_url', 'origin_weibo', 'content']
+    int_fields = ['user_id', 'like_num', 'repost_num', 'comment_num']
+    time_fields = ['created_at']
+    parsers = field_parsers(fields, int_fields, time_fields)
+    getter = attrgetter(*fields)
+    __slots__ = fields
+
+    def comment_priority(self):
+        # the order of the comment crawl: the most commented tweets first, then the most liked and reposted ones
+        return self.comment_num or 0, (self.like_num or 0) + (self.repost_num or 0)
+
+    def counters(self):
+        # the order of the tweet files: the most liked, reposted and commented tweets first, blank counters last
+        return tuple([num if num is not None else -1 for num in (self.like_num, self.repost_num, self.comment_num)])
+
+
+class CommentRecord(Record):
+    # comment_user_id is the user url (/u/123 or a vanity url like /yht2018) until postprocess_final resolves it
+    fields = ['weibo_id', 'comment_user_id', 'content', '_id', 'like_num', 'created_at']
+    int_fields = ['_id', 'like_num']
+    time_fields = ['created_at']
+    parsers = field_parsers(fields, int_fields, time_fields)
+    getter = attrgetter(*fields)
+    __slots__ = fields
+
+
+class RepostRecord(Record):
+    fields = ['_id', 'weibo_id', 'user_id', 'content', 'created_at', 'crawl_time']
+    int_fields = ['user_id']
+    time_fields = ['created_at', 'crawl_time']
+    parsers = field_parsers(fields, int_fields, time_fields)
+    getter = attrgetter(*fields)
+    __slots__ = fields
+
+
+class RelationshipRecord(Record):
+    fields = ['_id', 'fan_id', 'followed_id', 'crawl_time']
+    int_fields = ['fan_id', 'followed_id']
+    time_fields = ['crawl_time']
+    parsers = field_parsers(fields, int_fields, time_fields)
+    getter = attrgetter(*fields)
+    __slots__ = fields
+
+
+class UserRecord(Record):
+    fields = ['_id', 'nick_name', 'gender', 'province', 'city', 'brief_introduction', 'birthday', 'sex_orientation',
+              'sentiment', 'vip_level', 'authentication', 'labels', 'tweets_num', 'follows_num', 'fans_num', 'url']
+    int_fields = ['_id', 'tweets_num', 'follows_num', 'fans_num']
+    time_fields = []
+    parsers = field_parsers(fields, int_fields, time_fields)
+    getter = attrgetter(*fields)
+    __slots__ = fields
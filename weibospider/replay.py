@@ -0,0 +1,95 @@
+# encoding: utf-8
+"""
+Replay a crawl from the page archive without the network: the archived pages are fed to the callbacks of the
+spider again, so that a fix of the extraction can be applied to the pages crawled before. The crawl is replayed
+from every archived start request on a pool of processes, each follows the requests its callbacks yield through
+the archive, and the items are written by the CSVPipeline of the parent like those of a crawl.
+"""
+import os
+import json
+import time
+import multiprocessing
+from collections import deque
+from scrapy.http import Request
+from archive import PageArchive
+from httpcache import request_key
+from pipelines import CSVPipeline
+
+# the state of a worker, inherited from the parent when the processes are forked
+_spider = None
+_index = None
+_starts = None
+
+
+def init_worker(spider_cls, kwargs, archive_dir):
+    global _spider, _index, _starts
+    _spider = spider_cls(**kwargs)
+    if _index is None:
+        _index, starts = PageArchive(archive_dir, spider_cls.name).load_index()
+        _starts = set(starts)
+
+
+def replay_start(start_key):
+    """
+    Replay the crawl from the start request start_key, return its items and the numbers of pages replayed, of
+    requests not in the archive and of callback errors. The requests of other start requests are not followed,
+    they are replayed on their own.
+    """
+    items = []
+    pages = missing = errors = 0
+    seen = {start_key}
+    queue = deque([(start_key, None)])
+    while queue:
+        key, request = queue.popleft()
+        if key not in _index:
+            missing += 1
+            continue
+        fields, response = PageArchive.read(*_index[key])
+        if request is None:
+            request = Request(response.url, callback=getattr(_spider, fields['X-Callback']), dont_filter=True,
+                              meta=json.loads(fields.get('X-Start-Meta', '{}')))
+        response.request = request
+        pages += 1
+        try:
+            for output in (request.callback or _spider.parse)(response) or []:
+                if not isinstance(output, Request):
+                    items.append(output)
+                    continue
+                key = request_key(output.method, output.url, output.body)
+                if key not in seen and key not in _starts:
+                    seen.add(key)
+                    queue.append((key, output))
+        except Exception:
+            errors += 1
+            _spider.logger.exception("Error replaying {}".format(response.url))
+    return items, pages, missing, errors
+
+
+def replay(spider_cls, kwargs, archive_dir, workers=0):
+    """Replay the archived crawls of spider_cls on workers processes (all the cores by default)."""
+    global _index, _starts
+    started_at = time.time()
+    _index, starts = PageArchive(archive_dir, spider_cls.name).load_index()
+    _starts = set(starts)
+    spider = spider_cls(**kwargs)
+    spider.logger.info("replaying {:d} start requests, {:d} archived pages of {:s}".format(
+        len(starts), len(_index), spider.name))
+    pipeline = CSVPipeline()
+    workers = workers or os.cpu_count()
+    num_items = pages = missing = errors = 0
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(spider_cls, kwargs, archive_dir)) as pool:
+        # the start requests differ a lot in size, small chunks keep the workers busy until the end
+        chunksize = max(1, len(starts) // (workers * 16))
+        for items, start_pages, start_missing, start_errors in pool.imap_unordered(replay_start, starts, chunksize):
+            for item in items:
+                pipeline.process_item(item, spider)
+            num_items += len(items)
+            pages += start_pages
+            missing += start_missing
+            errors += start_errors
+    pipeline.close_spider(spider)
+    elapsed = time.time() - started_at
+    spider.logger.info("replayed {:d} pages into {:d} items in {:.1f}s ({:.0f} pages/s) on {:d} processes, "
+                       "{:d} requests not archived, {:d} errors".format(
+                           pages, num_items, elapsed, pages / elapsed if elapsed else 0.0, workers, missing, errors))
+    return num_items, pages, missing, errors
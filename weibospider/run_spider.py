@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 # encoding: utf-8
 import os
+import sys
 import argparse
 from scrapy.crawler import CrawlerProcess
+from scrapy.utils.log import configure_logging
 from scrapy.utils.project import get_project_settings
+from replay import replay
 from spiders.tweet import TweetSpider
 from spiders.comment import CommentSpider
 from spiders.follower import FollowerSpider
@@ -20,11 +23,38 @@ if __name__ == '__main__':
     parser.add_argument('--date-end', type=str, default='')
     parser.add_argument('--tweet-ids', type=str, default='JDktUgcsD')
     parser.add_argument('--user-ids', type=str, default='/yht2018')
+    parser.add_argument('--user-cache', type=str, default='', help='the user cache of the runner, users.db')
+    parser.add_argument('--http-cache-dir', type=str, default='', help='the http cache, HTTPCACHE_DIR by default')
+    parser.add_argument('--archive-dir', type=str, default='', help='the page archive, ARCHIVE_DIR by default')
+    parser.add_argument('--cookies-file', type=str, default='', help='the cookies of the pool, COOKIES_FILE by default')
+    parser.add_argument('--proxies-file', type=str, default='', help='the proxies of the pool, PROXIES_FILE by default')
+    parser.add_argument('--replay', action='store_true', help='parse the archived pages again instead of crawling')
+    parser.add_argument('--workers', type=int, default=0, help='processes of the replay, all the cores by default')
+    parser.add_argument('--user-info-ttl', type=float, default=30, help='days')
+    parser.add_argument('--user-counters-ttl', type=float, default=7, help='days')
+    parser.add_argument('--depth', type=int, default=0, help='hops from the seed users of the fan and follow graph')
+    parser.add_argument('--max-users', type=int, default=0, help='users expanded by the graph crawl, 0 for no limit')
+    parser.add_argument('--edges-file', type=str, default='', help='crawl the graph into this .npz edge store')
+    parser.add_argument('--bloom-capacity', type=int, default=10000000, help='users visited by the graph crawl')
+    parser.add_argument('--max-pages', type=int, default=None,
+                        help='repost or comment pages of a tweet, 0 for all of them (50 reposts, all comments)')
+    parser.add_argument('--max-requests', type=int, default=0, help='requests of the comment crawl, 0 for no limit')
+    parser.add_argument('--cascades-file', type=str, default='', help='rebuild the repost trees into this .npz file')
+    parser.add_argument('--min-like-num', type=int, default=0)
+    parser.add_argument('--min-repost-num', type=int, default=0)
+    parser.add_argument('--min-comment-num', type=int, default=0)
     args = parser.parse_args()
 
     os.environ['SCRAPY_SETTINGS_MODULE'] = f'settings'
     settings = get_project_settings()
-    process = CrawlerProcess(settings)
+    if args.http_cache_dir:
+        settings.set('HTTPCACHE_DIR', args.http_cache_dir)
+    if args.archive_dir:
+        settings.set('ARCHIVE_DIR', args.archive_dir)
+    if args.cookies_file:
+        settings.set('COOKIES_FILE', args.cookies_file)
+    if args.proxies_file:
+        settings.set('PROXIES_FILE', args.proxies_file)
     mode_to_spider = {
         'comment': CommentSpider,
         'fan': FanSpider,
@@ -40,6 +70,45 @@ if __name__ == '__main__':
         'tweet_ids': args.tweet_ids.split(','),
         'user_ids': args.user_ids.split(','),
     }
-    process.crawl(mode_to_spider[args.mode], **kwargs)
-    # the script will block here until the crawling is finished
-    process.start()
+    # a replay only parses, the user cache and the edge and cascade files are left as they are
+    if args.mode == 'user' and not args.replay:
+        kwargs.update({
+            'user_cache': args.user_cache,
+            'user_info_ttl': args.user_info_ttl,
+            'user_counters_ttl': args.user_counters_ttl,
+        })
+    if args.mode in ['fan', 'follow'] and not args.replay:
+        kwargs.update({
+            'depth': args.depth,
+            'max_users': args.max_users,
+            'edges_file': args.edges_file,
+            'bloom_capacity': args.bloom_capacity,
+        })
+    if args.mode == 'repost' and not args.replay:
+        kwargs.update({
+            'cascades_file': args.cascades_file,
+        })
+    if args.mode == 'comment':
+        kwargs.update({
+            'max_requests': args.max_requests,
+        })
+    if args.mode in ['repost', 'comment'] and args.max_pages is not None:
+        kwargs['max_pages'] = args.max_pages
+    if args.mode == 'tweet':
+        kwargs.update({
+            'min_like_num': args.min_like_num,
+            'min_repost_num': args.min_repost_num,
+            'min_comment_num': args.min_comment_num,
+        })
+    if args.replay:
+        configure_logging(settings)
+        replay(mode_to_spider[args.mode], kwargs, settings.get('ARCHIVE_DIR'), args.workers)
+    else:
+        process = CrawlerProcess(settings)
+        crawler = process.create_crawler(mode_to_spider[args.mode])
+        process.crawl(crawler, **kwargs)
+        # the script will block here until the crawling is finished
+        process.start()
+        # a crawl that failed to start or was closed before its end is not taken for a finished one by the runner
+        if crawler.stats.get_value('finish_reason') != 'finished':
+            sys.exit(1)
@@ -6,6 +6,8 @@ import csv
 import shutil
 import argparse
 import subprocess
+from ledger import CrawlLedger
+from records import TweetRecord, CommentRecord
 from settings import SAVE_ROOT
 
 
@@ -18,15 +20,30 @@ if __name__ == '__main__':
     parser.add_argument('--min-repost-num', type=int, default=0)
     parser.add_argument('--min-comment-num', type=int, default=0)
     parser.add_argument('--file-dir', type=str, default='./data')
+    parser.add_argument('--ledger', type=str, default='', help='the ledger file of finished units to resume from')
+    parser.add_argument('--stage', type=str, default='all', help='all, tweets or comments')
+    parser.add_argument('--tweet-ids', type=str, default='', help='the file of tweet ids for the comments stage')
+    parser.add_argument('--max-comment-requests', type=int, default=0,
+                        help='requests of the comment crawl of a keyword, 0 for no limit')
+    parser.add_argument('--http-cache-dir', type=str, default='', help='the http cache of the runner')
+    parser.add_argument('--archive-dir', type=str, default='', help='the page archive of the runner')
+    parser.add_argument('--cookies-file', type=str, default='', help='the cookies of the runner')
+    parser.add_argument('--proxies-file', type=str, default='', help='the proxies of the runner')
+    parser.add_argument('--max-comment-pages', type=int, default=0, help='comment pages of a tweet, 0 for all of them')
     args = parser.parse_args()
 
     if not os.path.exists(args.file_dir):
         os.makedirs(args.file_dir)
 
     current_dir = os.path.split(os.path.realpath(__file__))[0]
+    task_name = os.path.basename(os.path.realpath(args.file_dir))
+    ledger = CrawlLedger(args.ledger) if args.ledger else None
 
     keywords = args.keywords.split(',')
-    user_ids = []
+    # dicts keep the ids in order of first appearance with constant time lookups, users are kept by their urls
+    user_ids = {}
+    # a spider that did not finish fails the task, which is tried again with the finished units of the ledger
+    failed = False
     for keyword in keywords:
         tweets_dir = os.path.join(args.file_dir, keyword)
         if not os.path.exists(tweets_dir):
@@ -35,72 +52,164 @@ if __name__ == '__main__':
         if not os.path.exists(comments_dir):
             os.makedirs(comments_dir)
 
-        print("Crawling the tweets for keyword {:s} ...".format(keyword))
-        subprocess.run([sys.executable, os.path.join(current_dir, 'run_spider.py'),
-                        '--mode', 'tweet', '--keywords', keyword,
-                        '--date-start', args.date_start, '--date-end', args.date_end])
-        print("Tweets crawling for keyword {:s} is finished.".format(keyword))
+        tweets_file = os.path.join(tweets_dir, 'tweets.csv')
+        tweet_ids = {}
+        # the comment priorities of the tweets, the ids of the comments stage are already in order of them
+        priorities = {}
+        tweets_key = task_name + '/' + keyword
+        if args.stage == 'comments':
+            with open(args.tweet_ids, 'r', encoding='utf-8-sig', newline='') as f:
+                for line in f:
+                    if line.strip():
+                        tweet_ids[line.strip()] = None
+        elif ledger is not None and ledger.is_done('tweets', tweets_key):
+            print("Reusing the crawled tweets for keyword {:s} ...".format(keyword))
+            done_file = ledger.get('tweets', tweets_key)
+            if os.path.exists(done_file) and os.path.realpath(done_file) != os.path.realpath(tweets_file):
+                shutil.copy(done_file, tweets_file)
+            if os.path.exists(tweets_file):
+                with open(tweets_file, 'r', encoding='utf-8-sig', newline='') as f:
+                    reader = csv.reader(f)
+                    for i, row in enumerate(reader):
+                        if i == 0:
+                            continue
+                        tweet = TweetRecord.from_row(row)
+                        if tweet.user_id is None:
+                            continue
+                        user_id = '/u/{:d}'.format(tweet.user_id)
+                        if user_id not in user_ids:
+                            user_ids[user_id] = None
+                        if tweet._id not in tweet_ids:
+                            tweet_ids[tweet._id] = None
+                            priorities[tweet._id] = tweet.comment_priority()
+        else:
+            print("Crawling the tweets for keyword {:s} ...".format(keyword))
+            tweets_finished = subprocess.run([sys.executable, os.path.join(current_dir, 'run_spider.py'),
+                                              '--mode', 'tweet', '--keywords', keyword,
+                                              '--date-start', args.date_start,
+                                              '--date-end', args.date_end,
+                                              '--min-like-num', str(args.min_like_num),
+                                              '--min-repost-num', str(args.min_repost_num),
+                                              '--min-comment-num', str(args.min_comment_num),
+                                              '--http-cache-dir', args.http_cache_dir,
+                                              '--archive-dir', args.archive_dir,
+                                              '--cookies-file', args.cookies_file,
+                                              '--proxies-file', args.proxies_file]).returncode == 0
+            failed = failed or not tweets_finished
+            print("Tweets crawling for keyword {:s} is finished.".format(keyword))
 
-        print("Postprocessing the crawled tweets for keyword {:s} ...".format(keyword))
-        tweet_ids = []
-        tweets = []
-        tweets_head = None
-        with open(os.path.join(SAVE_ROOT, 'tweets.csv'), 'r', encoding='utf-8-sig', newline='') as f:
-            reader = csv.reader(f)
-            for i, row in enumerate(reader):
-                if i == 0:
-                    tweets_head = row
-                    continue
-                user_id, tweet_id, like_num, repost_num, comment_num = \
-                    row[1], row[2], int(row[5]), int(row[6]), int(row[7])
-                if like_num < args.min_like_num or repost_num < args.min_repost_num or \
-                        comment_num < args.min_comment_num:
-                    continue
-                if user_id not in user_ids:
-                    user_ids.append(user_id)
-                if tweet_id not in tweet_ids:
-                    tweet_ids.append(tweet_id)
-                    tweets.append(row)
-        if len(tweets) > 0:
-            tweets.sort(key=lambda x: (int(x[5]), int(x[6]), int(x[7])), reverse=True)
-            tweets_file = os.path.join(tweets_dir, 'tweets.csv')
-            with open(tweets_file, 'w', encoding='utf-8-sig', newline='') as f:
-                tweets_writer = csv.writer(f, dialect='excel')
-                tweets_writer.writerow(tweets_head)
-                for tweet in tweets:
-                    tweets_writer.writerow(tweet)
-        print("Tweets postprocessing for keyword {:s} is finished.".format(keyword))
+            print("Postprocessing the crawled tweets for keyword {:s} ...".format(keyword))
+            tweets = []
+            with open(os.path.join(SAVE_ROOT, 'tweets.csv'), 'r', encoding='utf-8-sig', newline='') as f:
+                reader = csv.reader(f)
+                for i, row in enumerate(reader):
+                    if i == 0:
+                        continue
+                    tweet = TweetRecord.from_row(row)
+                    # a blank counter is taken as 0, so it only drops the tweet when a threshold is set
+                    if (tweet.like_num or 0) < args.min_like_num or (tweet.repost_num or 0) < args.min_repost_num or \
+                            (tweet.comment_num or 0) < args.min_comment_num:
+                        continue
+                    # a tweet without its user is dropped by postprocess_final anyway
+                    if tweet.user_id is None:
+                        continue
+                    user_id = '/u/{:d}'.format(tweet.user_id)
+                    if user_id not in user_ids:
+                        user_ids[user_id] = None
+                    if tweet._id not in tweet_ids:
+                        tweet_ids[tweet._id] = None
+                        priorities[tweet._id] = tweet.comment_priority()
+                        tweets.append(tweet)
+            if len(tweets) > 0:
+                tweets.sort(key=TweetRecord.counters, reverse=True)
+                with open(tweets_file, 'w', encoding='utf-8-sig', newline='') as f:
+                    tweets_writer = csv.writer(f, dialect='excel')
+                    tweets_writer.writerow(TweetRecord.fields)
+                    for tweet in tweets:
+                        tweets_writer.writerow(tweet.to_row())
+            if ledger is not None and tweets_finished:
+                ledger.mark_done('tweets', tweets_key, tweets_file)
+            print("Tweets postprocessing for keyword {:s} is finished.".format(keyword))
+        if args.stage == 'tweets':
+            continue
 
+        crawl_tweet_ids = []
         for tweet_id in tweet_ids:
-            print("Crawling the comments for tweet {:s} in keyword {:s} ...".format(tweet_id, keyword))
-            subprocess.run([sys.executable, os.path.join(current_dir, 'run_spider.py'),
-                            '--mode', 'comment', '--tweet-ids', tweet_id])
-            print("Comments crawling for tweet {:s} in keyword {:s} is finished.".format(tweet_id, keyword))
+            comments_file = os.path.join(comments_dir, tweet_id + '.csv')
+            comments_key = keyword + '/' + tweet_id
+            if ledger is None or not ledger.is_done('comments', comments_key):
+                crawl_tweet_ids.append(tweet_id)
+                continue
+            done_file = ledger.get('comments', comments_key)
+            if os.path.exists(done_file) and os.path.realpath(done_file) != os.path.realpath(comments_file):
+                shutil.copy(done_file, comments_file)
+            if os.path.exists(comments_file):
+                with open(comments_file, 'r', encoding='utf-8-sig', newline='') as f:
+                    reader = csv.reader(f)
+                    for i, row in enumerate(reader):
+                        if i == 0:
+                            continue
+                        user_id = row[1]
+                        if user_id not in user_ids:
+                            user_ids[user_id] = None
+
+        comments_finished = True
+        skipped_ids = set()
+        if len(crawl_tweet_ids) > 0:
+            crawl_tweet_ids.sort(key=lambda tweet_id: priorities.get(tweet_id, (0, 0)), reverse=True)
+            print("Crawling the comments for {:d} tweets in keyword {:s} ...".format(len(crawl_tweet_ids), keyword))
+            tweet_ids_file = os.path.join(tweets_dir, 'tweet_ids.txt')
+            with open(tweet_ids_file, 'w', encoding='utf-8-sig', newline='') as f:
+                f.writelines([line + '\n' for line in crawl_tweet_ids])
+            comments_finished = subprocess.run([sys.executable, os.path.join(current_dir, 'run_spider.py'),
+                                                '--mode', 'comment', '--tweet-ids', tweet_ids_file,
+                                                '--max-requests', str(args.max_comment_requests),
+                                                '--max-pages', str(args.max_comment_pages),
+                                                '--http-cache-dir', args.http_cache_dir,
+                                                '--archive-dir', args.archive_dir,
+                                                '--cookies-file', args.cookies_file,
+                                                '--proxies-file', args.proxies_file]).returncode == 0
+            failed = failed or not comments_finished
+            print("Comments crawling for keyword {:s} is finished.".format(keyword))
+            # the tweets cut by the request budget are left for a resumed run
+            skipped_file = os.path.join(SAVE_ROOT, 'comments_skipped.txt')
+            if os.path.exists(skipped_file):
+                with open(skipped_file, 'r', encoding='utf-8-sig', newline='') as f:
+                    skipped_ids = set([line.strip() for line in f if line.strip()])
+                if len(skipped_ids) > 0:
+                    print("{:d} tweets in keyword {:s} are cut by the comment budget.".format(len(skipped_ids),
+                                                                                              keyword))
 
+        for tweet_id in crawl_tweet_ids:
             print("Postprocessing the crawled comments for tweet {:s} of keyword {:s} ...".format(tweet_id, keyword))
-            comment_ids = []
+            tweet_comments_file = os.path.join(SAVE_ROOT, 'comments', tweet_id + '.csv')
+            comments_file = os.path.join(comments_dir, tweet_id + '.csv')
+            if not os.path.exists(tweet_comments_file):
+                if ledger is not None and comments_finished and tweet_id not in skipped_ids:
+                    ledger.mark_done('comments', keyword + '/' + tweet_id, comments_file)
+                continue
+            comment_ids = set()
             comments = []
-            comments_head = None
-            with open(os.path.join(SAVE_ROOT, 'comments.csv'), 'r', encoding='utf-8-sig', newline='') as f:
+            with open(tweet_comments_file, 'r', encoding='utf-8-sig', newline='') as f:
                 reader = csv.reader(f)
                 for i, row in enumerate(reader):
                     if i == 0:
-                        comments_head = row
                         continue
-                    user_id, comment_id = row[1], row[3]
-                    if user_id not in user_ids:
-                        user_ids.append(user_id)
-                    if comment_id not in comment_ids:
-                        comment_ids.append(comment_id)
-                        comments.append(row)
+                    comment = CommentRecord.from_row(row)
+                    if comment.comment_user_id not in user_ids:
+                        user_ids[comment.comment_user_id] = None
+                    if comment._id not in comment_ids:
+                        comment_ids.add(comment._id)
+                        comments.append(comment)
             if len(comments) > 0:
-                comments.sort(key=lambda x: int(x[4]), reverse=True)
-                comments_file = os.path.join(comments_dir, tweet_id + '.csv')
+                comments.sort(key=lambda x: x.like_num if x.like_num is not None else -1, reverse=True)
                 with open(comments_file, 'w', encoding='utf-8-sig', newline='') as f:
                     comments_writer = csv.writer(f, dialect='excel')
-                    comments_writer.writerow(comments_head)
+                    comments_writer.writerow(CommentRecord.fields)
                     for comment in comments:
-                        comments_writer.writerow(comment)
+                        comments_writer.writerow(comment.to_row())
+            if ledger is not None and comments_finished and tweet_id not in skipped_ids:
+                ledger.mark_done('comments', keyword + '/' + tweet_id, comments_file)
             print("Comments postprocessing for tweet {:s} of keyword {:s} is finished.".format(tweet_id, keyword))
 
     # print("Crawling the users ...")
@@ -115,4 +224,5 @@ if __name__ == '__main__':
     users_file = os.path.join(args.file_dir, 'users.txt')
     with open(users_file, 'w', encoding='utf-8-sig', newline='') as f:
         f.writelines([line+'\n' for line in user_ids])
-
+    if failed:
+        sys.exit(1)
@@ -9,16 +9,16 @@ NEWSPIDER_MODULE = 'spiders'
 
 ROBOTSTXT_OBEY = False
 
-cookies_file = os.path.join(os.path.split(os.path.realpath(__file__))[0], 'cookies.txt')
-with open(cookies_file, 'r', encoding='utf-8-sig', newline='') as f:
-    cookies = f.readlines()
-    cookies = [cookie.strip() for cookie in cookies]
-COOKIES = dict(zip(range(len(cookies)), cookies))
+# cookie池, 每个请求从cookies文件中分配一个cookie(一行一个, 替换成你自己的cookie), 文件修改后自动重新加载
+COOKIES_FILE = os.path.join(os.path.split(os.path.realpath(__file__))[0], 'cookies.txt')
+COOKIES_RELOAD_INTERVAL = 30  # 检查cookies文件是否修改的间隔(秒)
+COOKIES_COOLDOWN = 60  # cookie被封(403/418)后的冷却时间(秒), 连续被封时加倍
+COOKIES_INTERVAL = 3  # cookie被封后同一cookie两次请求的最小间隔(秒), 再次被封时加倍, 请求成功后逐渐缩短
+COOKIES_MAX_STRIKES = 5  # 连续被封该次数或跳转登录页后剔除cookie
+COOKIES_MAX_RETRIES = 3  # 被封或跳转登录页的请求换cookie重试的次数
 
-# change cookie to yours
 DEFAULT_REQUEST_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36',
-    'Cookie': COOKIES[int(os.path.basename(os.path.split(os.path.realpath(__file__))[0]).split('_')[-1]) % len(COOKIES.keys())],
     'X-Forwarded-For': '%s.%s.%s.%s' % (random.randrange(1, 200, 20), random.randrange(1, 200, 20), random.randrange(1, 200, 20), random.randrange(1, 200, 20)),
 }
 
@@ -34,10 +34,24 @@ LOG_STDOUT = True   # 是否标准输出
 DOWNLOADER_MIDDLEWARES = {
     'scrapy.downloadermiddlewares.cookies.CookiesMiddleware': None,
     'scrapy.downloadermiddlewares.redirect.RedirectMiddleware': None,
-    'middlewares.IPProxyMiddleware': 100,
-    'scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware': 101,
+    # cookie池在HttpCacheMiddleware(900)之后, 缓存命中的请求不选择cookie, 也不等待cookie冷却
+    'middlewares.CookiePoolMiddleware': 910,
+    # 代理池在重试之后处理响应与异常, 才能统计到每次失败, 并在HttpProxyMiddleware之前选择代理
+    'middlewares.IPProxyMiddleware': 740,
+    'scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware': 750,
 }
 
+# 代理池, ips.txt中一行一个代理(ip:port或user:password@ip:port, default为直连), 后台定时探测, 按延迟与错误率选择与剔除代理
+PROXIES_FILE = os.path.join(os.path.split(os.path.realpath(__file__))[0], 'ips.txt')
+PROXIES_SELECTION = 'fastest'  # fastest: 中位延迟与在途请求数之积最小, least_loaded: 在途请求数最少
+PROXIES_PROBE_URL = 'https://weibo.cn/pub/'  # 探测地址, 每个worker的每个代理都会定时请求, 可换成不计入weibo.cn访问频率的地址
+PROXIES_PROBE_INTERVAL = 30  # 探测间隔(秒), 0为关闭
+PROXIES_PROBE_TIMEOUT = 10
+PROXIES_PROBE_THREADS = 2  # 探测专用的线程数, 不占用reactor解析域名的线程池
+PROXIES_WINDOW = 50  # 统计延迟分位数与错误率的最近请求与探测数
+PROXIES_MAX_ERROR_RATE = 0.5  # 错误率达到该值的代理被剔除
+PROXIES_MAX_LATENCY = 10  # 延迟p90超过该值(秒)的代理被剔除, 探测恢复后重新加入
+
 # ITEM_PIPELINES = {
 #     'pipelines.MongoDBPipeline': 300,
 # }
@@ -48,5 +62,35 @@ ITEM_PIPELINES = {
 
 SAVE_ROOT = os.path.join(os.path.split(os.path.realpath(__file__))[0], 'temp')
 
+EXTENSIONS = {
+    'extensions.CrawlMetrics': 500,
+    'archive.ArchivePages': 510,
+}
+
+# 页面缓存, 所有worker共用(WeiboSpiderRunner使用data/source/httpcache), 重跑或日期重叠的任务直接读取本地缓存
+HTTPCACHE_ENABLED = True
+HTTPCACHE_STORAGE = 'httpcache.ContentCacheStorage'
+HTTPCACHE_DIR = os.path.join(os.path.dirname(os.path.split(os.path.realpath(__file__))[0]), 'httpcache')
+HTTPCACHE_MAX_BYTES = 2 * 1024 ** 3  # 压缩后页面的总大小上限, 超出时淘汰最久未用的页面
+HTTPCACHE_OLD_DAYS = 2  # 结束超过该天数的搜索时间窗口不再变化
+HTTPCACHE_TTLS = {  # 各类页面的缓存时间(秒), 0为不缓存
+    'search_old': 30 * 24 * 3600,
+    'search': 3600,
+    'comment': 7 * 24 * 3600,
+    'repost': 24 * 3600,
+    'relationship': 24 * 3600,
+    'profile': 6 * 3600,
+    'default': 3600,
+}
+
+# 页面存档, 抓取的页面追加写入WARC格式的分段文件(WeiboSpiderRunner使用data/source/archive), 用run_spider.py --replay离线重新解析
+ARCHIVE_ENABLED = True
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.split(os.path.realpath(__file__))[0]), 'archive')
+ARCHIVE_SEGMENT_BYTES = 256 * 1024 ** 2  # 单个分段文件的大小上限
+
+METRICS_INTERVAL = 10  # 指标写入间隔(秒), 0为关闭
+METRICS_FILE = os.path.join(SAVE_ROOT, 'metrics.json')
+METRICS_PORT = 0  # prometheus端口, 每个worker使用METRICS_PORT + worker序号, 0为关闭
+
 MONGO_HOST = '127.0.0.1'
 MONGO_PORT = 27017
@@ -6,45 +6,124 @@ Author: nghuyong
 Mail: nghuyong@163.com
 Created Time: 2020/4/14
 """
-import re
+import os
+import math
 import time
 from lxml import etree
 from scrapy import Spider
 from scrapy.http import Request
 from items import CommentItem
-from spiders.utils import extract_comment_content, time_fix
+from records import to_epoch, parse_int
+from spiders.utils import extract_comment_content, load_ids, time_fix
+from spiders.xpaths import ALL_PAGE_RE, COMMENT_NODES, LINK_HREFS, NODE_ID, CT_TEXTS, LIKE_TEXTS, num
 
 
 class CommentSpider(Spider):
+    """
+    The comments of tweet_ids, which come in order of priority (TweetRecord.comment_priority): the pages of a tweet
+    are crawled before those of the tweets after it. max_pages caps the pages of a tweet and max_requests the
+    requests of the crawl (0 for no cap). The 1/N页 of the first page of a tweet gives its cost, so the budget goes
+    to the tweets in order and the crawl can be cut off with the most commented tweets crawled first. The tweets
+    that were cut by the budget, or whose first page failed, are listed in comments_skipped.txt of SAVE_ROOT.
+    """
     name = "comment_spider"
     base_url = "https://weibo.cn"
 
-    def __init__(self, tweet_ids=[], **kwargs):
+    def __init__(self, tweet_ids=[], max_requests=0, max_pages=0, **kwargs):
         super().__init__(**kwargs)
-        self.tweet_ids = tweet_ids
+        self.tweet_ids = load_ids(tweet_ids)
+        self.max_requests = max_requests
+        self.max_pages = max_pages
+        self.num_requests = 0
+        # the tweets started so far, those whose first page is on the way and the requests reserved for them
+        self.num_started = 0
+        self.num_pending = 0
+        self.num_reserved = 0
+        self.reserved = {}
+        # the pages of the tweets whose first page came back, for the reservations of the next ones
+        self.num_tweets_seen = 0
+        self.num_pages_seen = 0
+        self.skipped_ids = []
 
     def start_requests(self):
         # tweet_ids = ['IDl56i8av', 'IDkNerVCG', 'IDkJ83QaY']
         # tweet_ids = ['FeN9mmEbO']
         # urls = [f"{self.base_url}/comment/hot/{tweet_id}?rl=1&page=1" for tweet_id in self.tweet_ids]
-        urls = [f"{self.base_url}/comment/hot/{tweet_id}?page=1" for tweet_id in self.tweet_ids]
-        for url in urls:
-            yield Request(url, callback=self.parse, dont_filter=True)
+        return self.next_requests()
+
+    def reservation(self):
+        """
+        The requests reserved for a tweet besides its first page: the mean pages of the tweets seen so far within the
+        page cap, or the page cap (all of the budget without one) until the first page of a tweet has come back. A
+        tweet that needs more than its reservation takes what the budget has left when its first page comes back.
+        """
+        cap = (self.max_pages or self.max_requests) - 1
+        if self.num_tweets_seen == 0:
+            return cap
+        return min(cap, int(math.ceil(self.num_pages_seen / self.num_tweets_seen)) - 1)
+
+    def next_requests(self):
+        """
+        The first pages of the next tweets. With a budget, the requests a tweet can take are reserved until its
+        first page tells its cost, and a tweet is only started when the budget left can take it besides the
+        reservations of the tweets before it.
+        """
+        while self.num_started < len(self.tweet_ids):
+            if self.max_requests:
+                if self.num_requests >= self.max_requests:
+                    return
+                if self.num_pending > 0 and self.num_requests + self.num_reserved + 1 > self.max_requests:
+                    return
+                self.num_pending += 1
+                self.reserved[self.num_started] = self.reservation()
+                self.num_reserved += self.reserved[self.num_started]
+            rank = self.num_started
+            self.num_started += 1
+            self.num_requests += 1
+            yield self.comment_request(self.tweet_ids[rank], 1, rank)
+
+    def comment_request(self, tweet_id, page_num, rank):
+        # the pages of the tweets before go first
+        return Request(f"{self.base_url}/comment/hot/{tweet_id}?page={page_num}", callback=self.parse,
+                       errback=self.first_page_failed if page_num == 1 else None, dont_filter=True, priority=-rank,
+                       meta={'rank': rank, 'page_num': page_num})
+
+    def next_pages(self, tweet_id, rank, all_page):
+        # the pages of a tweet after the first one within the page cap and the budget, then the next tweets
+        all_page = min(all_page, self.max_pages) if self.max_pages else all_page
+        if all_page > 0:
+            self.num_tweets_seen += 1
+            self.num_pages_seen += all_page
+        if self.max_requests:
+            self.num_pending -= 1
+            self.num_reserved -= self.reserved.pop(rank)
+            if all_page - 1 > self.max_requests - self.num_requests:
+                self.skipped_ids.append(tweet_id)
+                all_page = self.max_requests - self.num_requests + 1
+        self.num_requests += max(all_page - 1, 0)
+        for page_num in range(2, all_page + 1):
+            yield self.comment_request(tweet_id, page_num, rank)
+        yield from self.next_requests()
+
+    def first_page_failed(self, failure):
+        # the tweet is left for a resumed run like the ones cut by the budget, its reservation goes to the next tweets
+        tweet_id = failure.request.url.split('/')[-1].split('?')[0]
+        self.skipped_ids.append(tweet_id)
+        return self.next_pages(tweet_id, failure.request.meta['rank'], 0)
 
     def parse(self, response):
         # try:
-        if response.url.endswith('page=1'):
-            all_page = re.search(r'/>&nbsp;1/(\d+)页</div>', response.text)
+        if response.meta.get('page_num') == 1:
+            all_page = ALL_PAGE_RE.search(response.text)
             if all_page:
                 all_page = all_page.group(1)
                 all_page = int(all_page)
-                # all_page = all_page if all_page <= 50 else 50
-                for page_num in range(2, all_page + 1):
-                    page_url = response.url.replace('page=1', 'page={}'.format(page_num))
-                    yield Request(page_url, callback=self.parse, dont_filter=True, meta=response.meta)
+            else:
+                all_page = 1
+            yield from self.next_pages(response.url.split('/')[-1].split('?')[0], response.meta['rank'], all_page)
 
         tree_node = etree.HTML(response.body)
-        comment_nodes = tree_node.xpath('//div[@class="c" and contains(@id,"C_")]')
+        comment_nodes = COMMENT_NODES(tree_node)
         for comment_node in comment_nodes:
             comment_item = CommentItem()
             # comment_item['crawl_time'] = int(time.time())
@@ -53,19 +132,29 @@ class CommentSpider(Spider):
             # if not comment_user_url:
             #     comment_item['comment_user_id'] = re.search(r'/u/(\d+)', comment_user_url[0]).group(1)
             #     continue
-            comment_user_url = comment_node.xpath('.//a[contains(@href,"/")]/@href')[0]
+            comment_user_url = LINK_HREFS(comment_node)[0]
             comment_item['comment_user_id'] = comment_user_url
 
-            comment_item['content'] = extract_comment_content(etree.tostring(comment_node, encoding='unicode'))
+            comment_item['content'] = extract_comment_content(comment_node)
             # content_info_node = comment_node.xpath('.//span[@class="ctt"]')[-1]
             # content_info = content_info_node.xpath('string(.)')
             # comment_item['content'] = content_info
 
-            comment_item['_id'] = comment_node.xpath('./@id')[0]
-            created_at_info = comment_node.xpath('.//span[@class="ct"]/text()')[0]
-            like_num = comment_node.xpath('.//a[contains(text(),"赞[")]/text()')[-1]
-            comment_item['like_num'] = int(re.search('\d+', like_num).group())
-            comment_item['created_at'] = time_fix(created_at_info.split('\xa0')[0])
+            # C_<id>
+            comment_item['_id'] = parse_int(NODE_ID(comment_node)[0])
+            created_at_info = CT_TEXTS(comment_node)[0]
+            comment_item['like_num'] = num(LIKE_TEXTS(comment_node)[-1])
+            comment_item['created_at'] = to_epoch(time_fix(created_at_info.split('\xa0')[0]))
             yield comment_item
         # except Exception as e:
         #     self.logger.error(e)
+
+    def closed(self, reason):
+        self.skipped_ids.extend(self.tweet_ids[self.num_started:])
+        # written on every run, so that the list of a previous run is not taken for this one
+        with open(os.path.join(self.settings.get('SAVE_ROOT'), 'comments_skipped.txt'), 'w', encoding='utf-8-sig',
+                  newline='') as f:
+            f.writelines([tweet_id + '\n' for tweet_id in self.skipped_ids])
+        if self.max_requests:
+            self.logger.info("{:d} of {:d} requests of the budget used, {:d} tweets cut".format(
+                self.num_requests, self.max_requests, len(self.skipped_ids)))
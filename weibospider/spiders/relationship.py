@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import re
+import numpy as np
+from lxml import etree
+from scrapy import Spider
+from scrapy.http import Request
+from graph import BloomFilter, EdgeStore
+from records import parse_int
+from spiders.utils import load_ids
+from spiders.xpaths import ALL_PAGE_RE, UID_RE
+
+
+class RelationshipSpider(Spider):
+    """
+    The fans or follows of users, FanSpider and FollowerSpider set the relation. Without edges_file an item is
+    yielded per edge. With edges_file the graph is crawled breadth first from the seed users: the users found up to
+    depth hops away are expanded in turn, at most max_users users in all, the visited ids are kept in a bloom filter
+    and the edges in an EdgeStore saved to edges_file when the spider closes.
+    """
+    base_url = "https://weibo.cn"
+    relation = None
+    user_hrefs = None
+    default_user_ids = ['1087770692', '1699432410', '1266321801']
+
+    def __init__(self, user_ids=[], depth=0, max_users=0, edges_file='', bloom_capacity=10000000, **kwargs):
+        super().__init__(**kwargs)
+        self.user_ids = load_ids(user_ids)
+        # the pages are addressed by the numeric ids, /u/<id> urls are taken as their ids
+        user_ids = [parse_int(user_id) for user_id in self.user_ids]
+        if None in user_ids:
+            self.logger.warning("Users without a numeric id are skipped: {}".format(
+                [url for url, user_id in zip(self.user_ids, user_ids) if user_id is None]))
+        self.user_ids = [user_id for user_id in user_ids if user_id is not None] or \
+            [int(user_id) for user_id in self.default_user_ids]
+        self.depth = depth
+        self.max_users = max_users
+        self.edges_file = edges_file
+        self.edges = EdgeStore() if edges_file else None
+        self.visited = BloomFilter(bloom_capacity) if edges_file else None
+        self.num_users = 0
+
+    def start_requests(self):
+        for user_id in self.user_ids:
+            if self.visited is not None and not self.visited.add(user_id):
+                continue
+            yield self.user_request(user_id, 0)
+
+    def user_request(self, user_id, depth):
+        # the users of a lower depth go first, so the graph is expanded about breadth first
+        self.num_users += 1
+        return Request(f"{self.base_url}/{user_id}/{self.relation}?page=1", callback=self.parse, dont_filter=True,
+                       priority=-depth, meta={'graph_depth': depth})
+
+    def parse(self, response):
+        if response.url.endswith('page=1'):
+            all_page = ALL_PAGE_RE.search(response.text)
+            if all_page:
+                all_page = all_page.group(1)
+                all_page = int(all_page)
+                for page_num in range(2, all_page + 1):
+                    page_url = response.url.replace('page=1', 'page={}'.format(page_num))
+                    depth = response.meta.get('graph_depth', 0)
+                    yield Request(page_url, self.parse, dont_filter=True, priority=-depth, meta={'graph_depth': depth})
+        tree_node = etree.HTML(response.body)
+        urls = self.user_hrefs(tree_node)
+        uids = UID_RE.findall(";".join(urls))
+        ID = re.findall(r'(\d+)/' + self.relation, response.url)[0]
+        if self.edges is None:
+            for uid in uids:
+                yield self.relationship_item(uid, ID)
+            return
+
+        fan_ids, followed_ids = self.edge_ids(np.array(uids, dtype=np.int64), int(ID))
+        self.edges.extend(fan_ids, followed_ids)
+        depth = response.meta['graph_depth']
+        if depth >= self.depth:
+            return
+        for uid in uids:
+            if self.max_users and self.num_users >= self.max_users:
+                break
+            if self.visited.add(int(uid)):
+                yield self.user_request(uid, depth + 1)
+
+    def edge_ids(self, uids, user_id):
+        """Return the (fan ids, followed ids) of the users listed on a page of the user, broadcast together."""
+        raise NotImplementedError
+
+    def relationship_item(self, uid, ID):
+        raise NotImplementedError
+
+    def closed(self, reason):
+        if self.edges is None:
+            return
+        self.edges.save(self.edges_file)
+        self.logger.info("{:d} users expanded, {:d} users visited, {:d} edges saved to {:s}".format(
+            self.num_users, self.visited.count, len(self.edges), self.edges_file))
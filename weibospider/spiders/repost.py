@@ -6,48 +6,91 @@ Author: nghuyong
 Mail: nghuyong@163.com
 Created Time: 2020/4/14
 """
-import re
+import time
+from array import array
 from lxml import etree
 from scrapy import Spider
 from scrapy.http import Request
-import time
+from cascade import Cascades, parent_name
 from items import RepostItem
-from spiders.utils import extract_repost_content, time_fix
+from records import to_epoch
+from spiders.utils import extract_repost_content, load_ids, time_fix
+from spiders.xpaths import ALL_PAGE_RE, USER_URL_RE, REPOST_NODES, USER_LINKS, NODE_STRING, CT_TEXTS
+
 
 class RepostSpider(Spider):
+    """
+    The reposts of tweet_ids, at most max_pages pages of each (0 for all of them). With cascades_file the repost
+    trees of the tweets are also rebuilt from the //@user chains of the reposts and saved as Cascades when the
+    spider closes.
+    """
     name = "repost_spider"
     base_url = "https://weibo.cn"
+    cascade_columns = ['cascade', 'user_ids', 'times', 'positions', 'names', 'parent_names']
+
+    def __init__(self, tweet_ids=[], max_pages=50, cascades_file='', **kwargs):
+        super().__init__(**kwargs)
+        self.tweet_ids = load_ids(tweet_ids)
+        self.max_pages = max_pages
+        self.cascades_file = cascades_file
+        # the reposts of the cascades as int64 columns, the user names as codes
+        self.cascade_index = {tweet_id: i for i, tweet_id in enumerate(self.tweet_ids)}
+        self.columns = {column: array('q') for column in self.cascade_columns}
+        self.name_codes = {}
 
     def start_requests(self):
-        tweet_ids = ['JtSFZ4eGg']
-        urls = [f"{self.base_url}/repost/{tweet_id}?page=1" for tweet_id in tweet_ids]
+        urls = [f"{self.base_url}/repost/{tweet_id}?page=1" for tweet_id in self.tweet_ids]
         for url in urls:
-            yield Request(url, callback=self.parse)
+            yield Request(url, callback=self.parse, dont_filter=True)
 
     def parse(self, response):
         if response.url.endswith('page=1'):
-            all_page = re.search(r'/>&nbsp;1/(\d+)页</div>', response.text)
+            all_page = ALL_PAGE_RE.search(response.text)
             if all_page:
                 all_page = all_page.group(1)
                 all_page = int(all_page)
-                all_page = all_page if all_page <= 50 else 50
+                all_page = min(all_page, self.max_pages) if self.max_pages else all_page
                 for page_num in range(2, all_page + 1):
                     page_url = response.url.replace('page=1', 'page={}'.format(page_num))
-                    yield Request(page_url, self.parse, dont_filter=True, meta=response.meta)
+                    yield Request(page_url, self.parse, dont_filter=True)
+        weibo_id = response.url.split('/')[-1].split('?')[0]
+        page = int(response.url.rsplit('page=', maxsplit=1)[1])
         tree_node = etree.HTML(response.body)
-        repo_nodes = tree_node.xpath('//div[@class="c" and not(contains(@id,"M_"))]') 
-        for repo_node in repo_nodes:
-            repo_user_url = repo_node.xpath('.//a[contains(@href,"/u/")]/@href')
-            if not repo_user_url:
+        repo_nodes = REPOST_NODES(tree_node)
+        for row, repo_node in enumerate(repo_nodes):
+            repo_user_links = USER_LINKS(repo_node)
+            if not repo_user_links:
                 continue
             repo_item = RepostItem()
-            #repo_item['_id'] = ''
             repo_item['crawl_time'] = int(time.time())
-            repo_item['weibo_id'] = response.url.split('/')[-1].split('?')[0]
-            repo_item['user_id'] = re.search(r'/u/(\d+)', repo_user_url[0]).group(1)
-            content = extract_repost_content(etree.tostring(repo_node, encoding='unicode'))
+            repo_item['weibo_id'] = weibo_id
+            repo_item['user_id'] = int(USER_URL_RE.search(repo_user_links[0].get('href')).group(1))
+            content = extract_repost_content(repo_node)
             repo_item['content'] = content.split(':', maxsplit=1)[1]
-            created_at_info = repo_node.xpath('.//span[@class="ct"]/text()')[0].split('\xa0')
-            repo_item['created_at'] = time_fix((created_at_info[0]+created_at_info[1]))
+            created_at_info = CT_TEXTS(repo_node)[0].split('\xa0')
+            repo_item['created_at'] = to_epoch(time_fix((created_at_info[0]+created_at_info[1])))
+            repo_item['_id'] = '{}-{}-{}'.format(weibo_id, repo_item['user_id'], repo_item['created_at'])
+            if self.cascades_file and repo_item['created_at'] is not None:
+                self.add_repost(repo_item, (page << 16) + row, NODE_STRING(repo_user_links[0]).strip())
             yield repo_item
 
+    def name_code(self, name):
+        if name is None:
+            return -1
+        return self.name_codes.setdefault(name, len(self.name_codes))
+
+    def add_repost(self, repo_item, position, name):
+        values = [self.cascade_index[repo_item['weibo_id']], repo_item['user_id'], repo_item['created_at'],
+                  position, self.name_code(name), self.name_code(parent_name(repo_item['content']))]
+        for column, value in zip(self.cascade_columns, values):
+            self.columns[column].append(value)
+
+    def closed(self, reason):
+        if not self.cascades_file:
+            return
+        cascades = Cascades.build(self.tweet_ids, *[self.columns[column] for column in self.cascade_columns])
+        cascades.save(self.cascades_file)
+        metrics = cascades.metrics()
+        self.logger.info("{:d} reposts of {:d} tweets saved to {:s}, max depth {:d}, max breadth {:d}".format(
+            int(metrics['size'].sum()), len(cascades), self.cascades_file, int(metrics['depth'].max(initial=0)),
+            int(metrics['breadth'].max(initial=0))))
@@ -9,70 +9,100 @@ Created Time: 2020/4/14
 import re
 import time
 from lxml import etree
-from scrapy import Selector, Spider
+from scrapy import Spider
 from scrapy.http import Request
 from items import UserItem
+from user_cache import UserCache
+from records import UserRecord
+from spiders.utils import load_ids
+from spiders.xpaths import INFO_HREFS, INFO_TEXTS
 
 
 class UserSpider(Spider):
     name = "user_spider"
     base_url = "https://weibo.cn"
 
-    def __init__(self, user_ids=[], **kwargs):
+    def __init__(self, user_ids=[], user_cache='', user_info_ttl=30, user_counters_ttl=7, **kwargs):
         super().__init__(**kwargs)
-        self.user_ids = []
-        for user_id in user_ids:
-            if user_id.endswith('.txt'):
-                with open(user_id, 'r', encoding='utf-8-sig', newline='') as f:
-                    lines = f.readlines()
-                    lines = [line.strip() for line in lines]
-                    self.user_ids.extend(lines)
-            else:
-                self.user_ids.append(user_id)
+        self.user_ids = load_ids(user_ids)
+        # with the user cache only the pages of the expired fields are requested, and the crawled fields are
+        # written back to it
+        self.user_cache = None
+        if user_cache:
+            self.user_cache = UserCache(user_cache, user_info_ttl * 24 * 3600, user_counters_ttl * 24 * 3600)
+        self.crawled_users = []
 
     def start_requests(self):
         # user_ids = ['1087770692', '1699432410', '1266321801']
         # urls = [f'{self.base_url}/{user_id}/info' for user_id in self.user_ids]
-        urls = [f'{self.base_url}{user_id}' for user_id in self.user_ids]
-        for url in urls:
-            yield Request(url, callback=self.parse, dont_filter=True)
+        if self.user_cache is None:
+            urls = [f'{self.base_url}{user_id}' for user_id in self.user_ids]
+            for url in urls:
+                yield Request(url, callback=self.parse, dont_filter=True)
+            return
+
+        user_ids = self.user_cache.resolve(self.user_ids)
+        users = self.user_cache.get(user_ids.values())
+        now = time.time()
+        for url in self.user_ids:
+            user_id = user_ids.get(url)
+            if user_id is None:
+                # only the profile page of a vanity url tells its numeric id
+                yield Request(f'{self.base_url}{url}', callback=self.parse, dont_filter=True)
+                continue
+            cached = {field: value for field, (value, updated_at) in users.get(user_id, {}).items()
+                      if now - updated_at < self.user_cache.ttl(field)}
+            meta = {'cached': cached, 'crawled': {'url': url}}
+            if all([field in cached for field in UserCache.fields if field not in UserCache.counter_fields]):
+                yield Request(f'{self.base_url}/u/{user_id}', callback=self.parse, dont_filter=True, meta=meta)
+            else:
+                yield Request(f'{self.base_url}/{user_id}/info', callback=self.parse_info, dont_filter=True,
+                              meta=meta)
 
-    def parse(self, response):
-        user_item = UserItem()
-        text = response.text
+    @staticmethod
+    def parse_counters(text):
+        counters = {}
         tweets_num = re.findall('微博\[(\d+)\]', text)
         if tweets_num:
-            user_item['tweets_num'] = int(tweets_num[0])
+            counters['tweets_num'] = int(tweets_num[0])
         else:
-            user_item['tweets_num'] = 'Unknown'
+            counters['tweets_num'] = None
 
         follows_num = re.findall('关注\[(\d+)\]', text)
         if follows_num:
-            user_item['follows_num'] = int(follows_num[0])
+            counters['follows_num'] = int(follows_num[0])
         else:
-            user_item['follows_num'] = 'Unknown'
+            counters['follows_num'] = None
 
         fans_num = re.findall('粉丝\[(\d+)\]', text)
         if fans_num:
-            user_item['fans_num'] = int(fans_num[0])
+            counters['fans_num'] = int(fans_num[0])
         else:
-            user_item['fans_num'] = 'Unknown'
+            counters['fans_num'] = None
+        return counters
 
-        user_item['url'] = response.url.split('weibo.cn')[-1]
+    def parse(self, response):
+        # the profile page, for the counters
+        cached = response.meta.get('cached', {})
+        crawled = dict(response.meta.get('crawled', {}))
+        crawled.update(self.parse_counters(response.text))
+        if 'url' not in crawled:
+            crawled['url'] = response.url.split('weibo.cn')[-1]
+        if all([field in cached or field in crawled for field in UserCache.fields]):
+            yield self.build_item(cached, crawled)
+            return
 
-        request_meta = response.meta
-        request_meta['item'] = user_item
         tree_node = etree.HTML(response.body)
-        url = self.base_url + tree_node.xpath('.//a[contains(text(),"资料")]/@href')[0]
-        yield Request(url, callback=self.parse_info, dont_filter=True, meta=response.meta)
+        url = self.base_url + INFO_HREFS(tree_node)[0]
+        yield Request(url, callback=self.parse_info, dont_filter=True, meta={'cached': cached, 'crawled': crawled})
 
     def parse_info(self, response):
         # try:
-        user_item = UserItem()
+        user_item = {}
         # user_item['crawl_time'] = int(time.time())
-        selector = Selector(response)
-        user_item['_id'] = re.findall('(\d+)/info', response.url)[0]
-        user_info_text = ";".join(selector.xpath('body/div[@class="c"]//text()').extract())
+        tree_node = etree.HTML(response.body)
+        user_item['_id'] = int(re.findall('(\d+)/info', response.url)[0])
+        user_info_text = ";".join(INFO_TEXTS(tree_node))
         nick_name = re.findall('昵称;?:?(.*?);', user_info_text)
         gender = re.findall('性别;?:?(.*?);', user_info_text)
         place = re.findall('地区;?:?(.*?);', user_info_text)
@@ -87,12 +117,12 @@ class UserSpider(Spider):
         if nick_name and nick_name[0]:
             user_item["nick_name"] = nick_name[0].replace(u"\xa0", "")
         else:
-            user_item["nick_name"] = 'Unknown'
+            user_item["nick_name"] = None
 
         if gender and gender[0]:
             user_item["gender"] = gender[0].replace(u"\xa0", "")
         else:
-            user_item["gender"] = 'Unknown'
+            user_item["gender"] = None
 
         if place and place[0]:
             place = place[0].replace(u"\xa0", "").split(" ")
@@ -100,20 +130,20 @@ class UserSpider(Spider):
             if len(place) > 1:
                 user_item["city"] = place[1]
             else:
-                user_item["city"] = 'Unknown'
+                user_item["city"] = None
         else:
-            user_item["province"] = 'Unknown'
-            user_item["city"] = 'Unknown'
+            user_item["province"] = None
+            user_item["city"] = None
 
         if brief_introduction and brief_introduction[0]:
             user_item["brief_introduction"] = brief_introduction[0].replace(u"\xa0", "")
         else:
-            user_item["brief_introduction"] = 'Unknown'
+            user_item["brief_introduction"] = None
 
         if birthday and birthday[0]:
             user_item['birthday'] = birthday[0]
         else:
-            user_item['birthday'] = 'Unknown'
+            user_item['birthday'] = None
 
         if sex_orientation and sex_orientation[0]:
             if sex_orientation[0].replace(u"\xa0", "") == gender[0]:
@@ -121,60 +151,59 @@ class UserSpider(Spider):
             else:
                 user_item["sex_orientation"] = "异性恋"
         else:
-            user_item["sex_orientation"] = 'Unknown'
+            user_item["sex_orientation"] = None
 
         if sentiment and sentiment[0]:
             user_item["sentiment"] = sentiment[0].replace(u"\xa0", "")
         else:
-            user_item["sentiment"] = 'Unknown'
+            user_item["sentiment"] = None
 
         if vip_level and vip_level[0]:
             user_item["vip_level"] = vip_level[0].replace(u"\xa0", "")
         else:
-            user_item["vip_level"] = 'Unknown'
+            user_item["vip_level"] = None
 
         if authentication and authentication[0]:
             user_item["authentication"] = authentication[0].replace(u"\xa0", "")
         else:
-            user_item["authentication"] = 'Unknown'
+            user_item["authentication"] = None
 
         if labels and labels[0]:
             user_item["labels"] = labels[0].replace(u"\xa0", ",").replace(';', '').strip(',')
         else:
-            user_item["labels"] = 'Unknown'
-
-        item = response.meta['item']
-        user_item['tweets_num'] = item['tweets_num']
-        user_item['follows_num'] = item['follows_num']
-        user_item['fans_num'] = item['fans_num']
-        user_item['url'] = item['url']
-        yield user_item
-        # request_meta = response.meta
-        # request_meta['item'] = user_item
-        # yield Request(self.base_url + '/u/{}'.format(user_item['_id']),
-        #               callback=self.parse_further_information,
-        #               meta=request_meta, dont_filter=True, priority=1)
+            user_item["labels"] = None
+
+        cached = response.meta.get('cached', {})
+        crawled = dict(response.meta.get('crawled', {}))
+        crawled.update(user_item)
+        if not all([field in cached or field in crawled for field in UserCache.counter_fields]):
+            # the counters are taken from the info page when it carries them, else from the profile page
+            counters = self.parse_counters(response.text)
+            if None in counters.values():
+                yield Request(f'{self.base_url}/u/{crawled["_id"]}', callback=self.parse, dont_filter=True,
+                              meta={'cached': cached, 'crawled': crawled})
+                return
+            crawled.update(counters)
+        yield self.build_item(cached, crawled)
         # except Exception as e:
         #     self.logger.error(e)
 
-    def parse_further_information(self, response):
-        text = response.text
-        user_item = response.meta['item']
-        tweets_num = re.findall('微博\[(\d+)\]', text)
-        if tweets_num:
-            user_item['tweets_num'] = int(tweets_num[0])
-        else:
-            user_item['tweets_num'] = 'Unknown'
-
-        follows_num = re.findall('关注\[(\d+)\]', text)
-        if follows_num:
-            user_item['follows_num'] = int(follows_num[0])
-        else:
-            user_item['follows_num'] = 'Unknown'
-
-        fans_num = re.findall('粉丝\[(\d+)\]', text)
-        if fans_num:
-            user_item['fans_num'] = int(fans_num[0])
-        else:
-            user_item['fans_num'] = 'Unknown'
-        yield user_item
+    def build_item(self, cached, crawled):
+        fields = dict(cached)
+        fields.update(crawled)
+        # the cached values are strings
+        user = UserRecord.from_row([fields[field] for field in UserRecord.fields])
+        user_item = UserItem()
+        for field, value in zip(UserRecord.fields, user.to_row()):
+            user_item[field] = value
+        if self.user_cache is not None:
+            self.crawled_users.append(dict(crawled, _id=user._id))
+            if len(self.crawled_users) >= self.user_cache.chunk_size:
+                self.user_cache.update(self.crawled_users)
+                self.crawled_users = []
+        return user_item
+
+    def closed(self, reason):
+        if self.user_cache is not None and self.crawled_users:
+            self.user_cache.update(self.crawled_users)
+            self.crawled_users = []
@@ -4,6 +4,18 @@ import re
 import datetime
 
 
+def load_ids(ids):
+    """The ids of the spider arguments in order and without duplicates, a .txt file is read as an id per line."""
+    loaded = []
+    for id_ in ids:
+        if id_.endswith('.txt'):
+            with open(id_, 'r', encoding='utf-8-sig', newline='') as f:
+                loaded.extend([line.strip() for line in f if line.strip()])
+        else:
+            loaded.append(id_)
+    return list(dict.fromkeys(loaded))
+
+
 def time_fix(time_string):
     now_time = datetime.datetime.now()
     if '分钟前' in time_string:
@@ -27,71 +39,95 @@ def time_fix(time_string):
     return time_string
 
 
-keyword_re = re.compile('<span class="kt">|</span>|原图|<!-- 是否进行翻译 -->|<span class="cmt">|\[组图共.+张\]')
-emoji_re = re.compile('<img alt="|" src="//h5\.sinaimg(.*?)/>')
-white_space_re = re.compile('<br />')
-div_re = re.compile('</div>|<div>')
-image_re = re.compile('<img(.*?)/>')
-url_re = re.compile('<a href=(.*?)>|</a>')
-
-
-def extract_weibo_content(weibo_html):
-    s = weibo_html
-    if 'class="ctt">' in s:
-        s = s.split('class="ctt">', maxsplit=1)[1]
-    s = emoji_re.sub('', s)
-    s = url_re.sub('', s)
-    s = div_re.sub('', s)
-    s = image_re.sub('', s)
-    if '<span class="ct">' in s:
-        s = s.split('<span class="ct">')[0]
+keyword_re = re.compile(r'原图|\[组图共.+张\]')
+
+
+def append_text(element, pieces, stop_classes):
+    # append the text of the element without its tail, True when a span of stop_classes is reached
+    tag = element.tag
+    if tag == 'img':
+        if 'h5.sinaimg' in element.get('src', ''):
+            pieces.append(element.get('alt', ''))
+        return False
+    if tag == 'br':
+        pieces.append(' ')
+        return False
+    if tag.__class__ is not str:
+        # comments like <!-- 是否进行翻译 -->
+        return False
+    if tag == 'span' and element.get('class') in stop_classes:
+        return True
+    if element.text:
+        pieces.append(element.text)
+    for child in element:
+        if append_text(child, pieces, stop_classes):
+            return True
+        if child.tail:
+            pieces.append(child.tail)
+    return False
+
+
+def node_text(node, start_class=None, stop_classes=('ct',)):
+    """
+    Walk the node and return its text, with the alt text of the emoji and a space for <br>. With start_class the
+    walk starts at the first element of the class (the text before it is dropped) and goes on with the elements
+    after it, the walk ends at the first span of stop_classes.
+    """
+    pieces = []
+    element = None
+    if start_class is not None:
+        # the start element comes early, an xpath costs more than looking at a few elements
+        for descendant in node.iterdescendants():
+            if descendant.get('class') == start_class:
+                element = descendant
+                break
+    if element is None:
+        append_text(node, pieces, stop_classes)
+        return ''.join(pieces)
+    if append_text(element, pieces, stop_classes):
+        return ''.join(pieces)
+    while element is not node:
+        if element.tail:
+            pieces.append(element.tail)
+        for sibling in element.itersiblings():
+            if append_text(sibling, pieces, stop_classes):
+                return ''.join(pieces)
+            if sibling.tail:
+                pieces.append(sibling.tail)
+        element = element.getparent()
+    return ''.join(pieces)
+
+
+def clean_text(s):
+    s = keyword_re.sub('', s)
+    s = s.replace('\xa0', '')
+    s = s.strip(':')
+    s = s.strip()
+    return s
+
+
+def extract_weibo_content(weibo_node):
+    s = node_text(weibo_node, start_class='ctt')
     splits = s.split('赞[')
     if len(splits) == 2:
         s = splits[0]
     try:
         if len(splits) == 3:
+            # a repost, the origin text is followed by its counters, then the reason and the own counters
             origin_text = splits[0]
             retweet_text = splits[1].split('转发理由:')[1]
             s = origin_text + '转发理由:' + retweet_text
     except:
         s = splits[0]
-    s = white_space_re.sub(' ', s)
-    s = keyword_re.sub('', s)
-    s = s.replace('\xa0', '')
-    s = s.strip(':')
-    s = s.strip()
-    return s
+    return clean_text(s)
 
 
-def extract_comment_content(comment_html):
-    s = comment_html
-    if 'class="ctt">' in s:
-        s = s.split('class="ctt">', maxsplit=1)[1]
+def extract_comment_content(comment_node):
+    s = node_text(comment_node, start_class='ctt', stop_classes=('cc', 'ct'))
     s = s.split('举报', maxsplit=1)[0]
-    s = emoji_re.sub('', s)
-    s = keyword_re.sub('', s)
-    s = url_re.sub('', s)
-    s = div_re.sub('', s)
-    s = image_re.sub('', s)
-    s = white_space_re.sub(' ', s)
-    s = s.replace('\xa0', '')
-    s = s.strip(':')
-    s = s.strip()
-    return s
+    return clean_text(s)
 
 
-def extract_repost_content(repost_html):
-    s = repost_html
-    if 'class="cc">' in s:
-        s = s.split('<span class="cc">', maxsplit=1)[0]
-    s = emoji_re.sub('', s)
-    s = keyword_re.sub('', s)
-    s = url_re.sub('', s)
-    s = div_re.sub('', s)
-    s = image_re.sub('', s)
-    s = white_space_re.sub(' ', s)
-    s = s.replace('\xa0', '')
-    s = s.replace('<div class="c">', '')
-    s = s.strip(':')
-    s = s.strip()
-    return s
+def extract_repost_content(repost_node):
+    s = node_text(repost_node, stop_classes=('cc', 'ct'))
+    return clean_text(s)
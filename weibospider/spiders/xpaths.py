@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The xpaths and regexes shared by the spiders, compiled once at import instead of for every node. The links of a
+tweet (counters, images, videos, web links, origin and full content) are collected by tweet_links in a single
+pass over its anchors.
+"""
+import re
+from lxml import etree
+
+ALL_PAGE_RE = re.compile(r'/>&nbsp;1/(\d+)页</div>')
+NUM_RE = re.compile(r'\d+')
+REPOST_URL_RE = re.compile(r'/repost/(.*?)\?uid=(\d+)')
+USER_URL_RE = re.compile(r'/u/(\d+)')
+UID_RE = re.compile(r'uid=(\d+)')
+
+TWEET_NODES = etree.XPath('//div[@class="c" and @id]')
+COMMENT_NODES = etree.XPath('//div[@class="c" and contains(@id,"C_")]')
+REPOST_NODES = etree.XPath('//div[@class="c" and not(contains(@id,"M_"))]')
+FULL_CONTENT_NODE = etree.XPath('//*[@id="M_"]/div[1]')
+CT_NODES = etree.XPath('.//span[@class="ct"]')
+CT_TEXTS = etree.XPath('.//span[@class="ct"]/text()', smart_strings=False)
+NODE_STRING = etree.XPath('string(.)', smart_strings=False)
+NODE_ID = etree.XPath('./@id', smart_strings=False)
+LINK_HREFS = etree.XPath('.//a[contains(@href,"/")]/@href', smart_strings=False)
+USER_LINKS = etree.XPath('.//a[contains(@href,"/u/")]')
+LIKE_TEXTS = etree.XPath('.//a[contains(text(),"赞[")]/text()', smart_strings=False)
+INFO_HREFS = etree.XPath('.//a[contains(text(),"资料")]/@href', smart_strings=False)
+INFO_TEXTS = etree.XPath('body/div[@class="c"]//text()', smart_strings=False)
+FAN_HREFS = etree.XPath('//a[text()="关注他" or text()="关注她" or text()="移除"]/@href', smart_strings=False)
+FOLLOW_HREFS = etree.XPath('//a[text()="关注他" or text()="关注她" or text()="取消关注"]/@href', smart_strings=False)
+
+VIDEO_URL = 'https://m.weibo.cn/s/video/show?object_id='
+WEB_URL = 'https://weibo.cn/sinaurl?f=w&u='
+
+
+def first_text(node):
+    # the first text node, which contains(text(), ...) tests in an xpath
+    if node.text:
+        return node.text
+    for child in node:
+        if child.tail:
+            return child.tail
+    return ''
+
+
+def tweet_links(tweet_node):
+    """
+    Collect the links of a tweet node in one pass over its anchors and images, with the same matches as the
+    xpaths the spiders used: the first href and the last text of 转发[, the last texts of 赞[ and 评论[ (besides
+    原文评论[), the first image, video, web link, 原文评论[ href and 全文 href, None for what is missing.
+    """
+    links = {'repost_url': None, 'repost': None, 'like': None, 'comment': None, 'image': None, 'video': None,
+             'web': None, 'origin': None, 'all_content': None}
+    for node in tweet_node.iter('a', 'img'):
+        if node.tag == 'img':
+            if links['image'] is None and node.get('alt') == '图片' and node.get('src') is not None:
+                links['image'] = node.get('src')
+            continue
+        text = first_text(node)
+        href = node.get('href')
+        if '赞[' in text:
+            links['like'] = text
+        if '转发[' in text:
+            links['repost'] = text
+            if links['repost_url'] is None and href is not None:
+                links['repost_url'] = href
+        if '评论[' in text and '原文' not in text:
+            links['comment'] = text
+        if href is None:
+            continue
+        if links['origin'] is None and '原文评论[' in text:
+            links['origin'] = href
+        if links['all_content'] is None and text == '全文' and 'ckAll=1' in href:
+            links['all_content'] = href
+        if links['video'] is None and VIDEO_URL in href:
+            links['video'] = href
+        if links['web'] is None and WEB_URL in href:
+            links['web'] = href
+    return links
+
+
+def num(text):
+    return int(NUM_RE.search(text).group())
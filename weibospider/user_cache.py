@@ -0,0 +1,116 @@
+# encoding: utf-8
+import re
+import time
+import sqlite3
+
+
+class UserCache(object):
+    """
+    A persistent cache of the crawled users shared by the runs over one data directory. Every field of a user is
+    stored with its own crawl time, the counters expire after counters_ttl and the other info fields after info_ttl
+    seconds. The user urls (including vanity urls like /yht2018) are mapped to the resolved numeric ids.
+    """
+    fields = ['_id', 'nick_name', 'gender', 'province', 'city', 'brief_introduction', 'birthday', 'sex_orientation',
+              'sentiment', 'vip_level', 'authentication', 'labels', 'tweets_num', 'follows_num', 'fans_num', 'url']
+    counter_fields = ['tweets_num', 'follows_num', 'fans_num']
+    chunk_size = 500
+
+    def __init__(self, db_file, info_ttl=30 * 24 * 3600, counters_ttl=7 * 24 * 3600):
+        self.db_file = db_file
+        self.info_ttl = info_ttl
+        self.counters_ttl = counters_ttl
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=600, isolation_level=None)
+        conn.execute('CREATE TABLE IF NOT EXISTS fields (_id TEXT, field TEXT, value TEXT, updated_at REAL, '
+                     'PRIMARY KEY (_id, field))')
+        conn.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, _id TEXT)')
+        return conn
+
+    def ttl(self, field):
+        return self.counters_ttl if field in self.counter_fields else self.info_ttl
+
+    def update(self, users):
+        """Store the crawled users, given as dicts of their fields, None is stored as NULL."""
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for user in users:
+                conn.executemany('INSERT OR REPLACE INTO fields (_id, field, value, updated_at) VALUES (?, ?, ?, ?)',
+                                 [(str(user['_id']), field, None if user[field] is None else str(user[field]), now)
+                                  for field in self.fields if field in user])
+                if 'url' in user:
+                    conn.execute('INSERT OR REPLACE INTO urls (url, _id) VALUES (?, ?)',
+                                 (user['url'], str(user['_id'])))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def resolve(self, urls):
+        """Map the user urls to their numeric ids, urls that were never crawled are left out."""
+        user_ids = {}
+        unknown_urls = []
+        for url in urls:
+            match = re.fullmatch(r'/u/(\d+)', url)
+            if match:
+                user_ids[url] = match.group(1)
+            else:
+                unknown_urls.append(url)
+        conn = self.connect()
+        try:
+            for i in range(0, len(unknown_urls), self.chunk_size):
+                chunk = unknown_urls[i: i + self.chunk_size]
+                rows = conn.execute('SELECT url, _id FROM urls WHERE url IN ({:s})'.format(','.join('?' * len(chunk))),
+                                    chunk).fetchall()
+                user_ids.update(rows)
+        finally:
+            conn.close()
+        return user_ids
+
+    def urls(self):
+        conn = self.connect()
+        try:
+            rows = conn.execute('SELECT url, _id FROM urls').fetchall()
+        finally:
+            conn.close()
+        return dict(rows)
+
+    def get(self, user_ids):
+        """Return {_id: {field: (value, updated_at)}} for the cached users among user_ids."""
+        user_ids = list(set(user_ids))
+        users = {}
+        conn = self.connect()
+        try:
+            for i in range(0, len(user_ids), self.chunk_size):
+                chunk = user_ids[i: i + self.chunk_size]
+                rows = conn.execute('SELECT _id, field, value, updated_at FROM fields WHERE _id IN ({:s})'.format(
+                    ','.join('?' * len(chunk))), chunk).fetchall()
+                for user_id, field, value, updated_at in rows:
+                    users.setdefault(user_id, {})[field] = (value, updated_at)
+        finally:
+            conn.close()
+        return users
+
+    def is_fresh(self, user, now=None):
+        now = now if now is not None else time.time()
+        return all([field in user and now - user[field][1] < self.ttl(field) for field in self.fields])
+
+    def stale(self, urls):
+        """Return the user urls that are not cached or have an expired field, in their order."""
+        user_ids = self.resolve(urls)
+        users = self.get(user_ids.values())
+        now = time.time()
+        return [url for url in urls if users.get(user_ids.get(url)) is None or
+                not self.is_fresh(users[user_ids[url]], now)]
+
+    def rows(self, urls):
+        """Return the cached users of the urls as rows of fields, expired or not."""
+        user_ids = self.resolve(urls)
+        users = self.get(user_ids.values())
+        rows = []
+        for url in urls:
+            user = users.get(user_ids.get(url))
+            if user is not None and all([field in user for field in self.fields]):
+                rows.append([user[field][0] for field in self.fields])
+        return rows